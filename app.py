@@ -1,29 +1,26 @@
-import os
 import time
 from dotenv import load_dotenv
 import argparse
-from typing import List, Tuple, Dict, Any
-
-# Importar los componentes que creaste
-from rag.retrieve import QdrantRetriever
-from providers.deepseek import DeepSeekProvider
-from providers.openrouter import OpenRouterProvider
+import csv
+import json
+import sys
+from contextlib import nullcontext
+from pathlib import Path
+from typing import List, Tuple
 
 # Cargar las variables de entorno desde el archivo .env
 load_dotenv()
 
+# Importar los componentes que creaste
+from rag.filters import SearchFilters
+from rag.pipeline import CitationMetadata, build_default_pipeline
+
 # -------------------------------
 # Inicialización global (1 sola vez)
 # -------------------------------
-retriever = QdrantRetriever()
-deepseek_provider = DeepSeekProvider()
-openrouter_provider = OpenRouterProvider()
-
-# Definimos el tipo para los metadatos de citación
-CitationMetadata = Dict[str, Any]
+pipeline = build_default_pipeline()
 
 
-# MODIFICACIÓN CLAVE: AGREGAR 'k: int = 4' a la firma de la función.
 def rag_pipeline(query: str, provider: str = "openrouter", k: int = 4) -> Tuple[str, List[str], List[CitationMetadata], int]:
     """
     Ejecuta el pipeline RAG completo para una consulta de usuario.
@@ -41,60 +38,7 @@ def rag_pipeline(query: str, provider: str = "openrouter", k: int = 4) -> Tuple[
             tokens_used: int
         )
     """
-    # Seleccionar el proveedor ya inicializado
-    if provider == "deepseek":
-        llm = deepseek_provider
-    else:
-        llm = openrouter_provider
-
-    # Paso de Recuperación (Retrieval)
-    chunks = retriever.retrieve(query, k=k)  # Se pasa 'k' al retriever
-
-    if not chunks:
-        # DEVOLVEMOS LISTA VACÍA DE CITACIONES EN CASO DE NO ENCONTRAR NADA
-        return (
-            "No pude encontrar información relevante en la base de datos para responder a tu pregunta.",
-            [],
-            [],  # CITACIONES VACÍAS
-            0,
-        )
-
-    # 1. Extraer el contenido de texto para el prompt
-    retrieved_texts = [chunk["text"] for chunk in chunks]
-
-    # 2. LÓGICA DE CITACIÓN: Extraer y filtrar metadatos de citación (para evitar duplicados)
-    unique_citations_set = set()
-    citation_metadata: List[CitationMetadata] = []
-
-    for chunk in chunks:
-        source_key = (chunk.get("title"), chunk.get("page"), chunk.get("url"))
-
-        if source_key not in unique_citations_set:
-            unique_citations_set.add(source_key)
-            citation_metadata.append({
-                "title": chunk.get("title", "Documento Desconocido"),
-                "page": chunk.get("page", "N/D"),
-                "url": chunk.get("url", "#")
-            })
-
-    # Paso de Aumento de Contexto (Augmentation)
-    context = "\n\n".join(retrieved_texts)
-
-    # PROMPT MEJORADO: Política de Abstención más clara
-    augmented_prompt = (
-        f"Basado EXCLUSIVAMENTE en la siguiente información de la normativa de la UFRO, responde la pregunta del usuario. "
-        f"Si la información no es suficiente o no permite una respuesta completa, indica claramente que no puedes responderla con el contexto proporcionado (Política de Abstención).\n\n"
-        f"### Contexto:\n{context}\n\n### Pregunta del usuario:\n{query}"
-    )
-
-    # Paso de Generación (Generation)
-    response = llm.chat(messages=[{"role": "user", "content": augmented_prompt}])
-
-    # Estimación de tokens (puedes reemplazarlo con tiktoken si usas OpenAI-compatible)
-    tokens_used = len(augmented_prompt.split()) + len(response.split())
-
-    # DEVOLVEMOS LOS METADATOS DE CITACIÓN
-    return response, retrieved_texts, citation_metadata, tokens_used
+    return pipeline.run(query=query, provider=provider, k=k).as_tuple()
 
 
 # MODIFICAMOS LAS FIRMAS DE LAS ENVOLTURAS
@@ -108,9 +52,50 @@ def call_rag_deepseek(query: str, k: int = 4) -> Tuple[str, List[str], List[Cita
     return rag_pipeline(query=query, provider="deepseek", k=k)
 
 
+def read_batch_queries(path: str) -> List[str]:
+    """Preguntas del modo batch: un .csv con columna 'query' (p. ej. data/gold_set.csv) o una por línea ('-' = stdin)."""
+    if path.endswith(".csv"):
+        with open(path, encoding="utf-8", newline="") as f:
+            return [row["query"] for row in csv.DictReader(f) if (row.get("query") or "").strip()]
+    lines = sys.stdin.read().splitlines() if path == "-" else Path(path).read_text(encoding="utf-8").splitlines()
+    return [line for line in lines if line.strip()]
+
+
+def run_batch_cli(queries: List[str], provider: str, k: int, filters, auto_filters: bool,
+                  max_concurrency: int, output, expand_tokens=None):
+    """Escribe una línea NDJSON por pregunta a medida que terminan (mismo formato que /api/batch)."""
+    start_time = time.time()
+    unique = errors = 0
+    items = pipeline.run_batch(queries, provider=provider, k=k, filters=filters,
+                               auto_filters=auto_filters, max_concurrency=max_concurrency,
+                               expand_tokens=expand_tokens)
+    for item in items:
+        for i in item.indices:
+            if item.error:
+                line = {"index": i, "query": queries[i], "error": item.error}
+            else:
+                line = {
+                    "index": i,
+                    "query": queries[i],
+                    "answer": item.result.answer,
+                    "citations": item.result.citations,
+                    "tokens_used": item.result.tokens_used,
+                    "latency_ms": round(item.result.latency_ms, 2),
+                }
+            output.write(json.dumps(line, ensure_ascii=False) + "\n")
+        output.flush()
+        unique += 1
+        errors += bool(item.error)
+        print(f"[Batch] {unique} preguntas únicas listas", file=sys.stderr)
+
+    latency_s = time.time() - start_time
+    print(f"[Batch] {len(queries)} preguntas ({unique} únicas, {errors} con error) "
+          f"en {latency_s:.2f} s", file=sys.stderr)
+
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Ejecuta el pipeline RAG de la UFRO.")
-    parser.add_argument("query", type=str, help="La pregunta del usuario a procesar.")
+    parser.add_argument("query", type=str, nargs="?", help="La pregunta del usuario a procesar.")
     parser.add_argument(
         "--provider",
         type=str,
@@ -124,35 +109,73 @@ if __name__ == "__main__":
         default=4,
         help="Número de fragmentos (chunks) a recuperar de la base de datos (top-k).",
     )
+    # Filtros de búsqueda (ver rag/filters.py)
+    parser.add_argument("--doc-id", action="append", help="Restringe a un doc_id (se puede repetir).")
+    parser.add_argument("--doc-type", action="append",
+                        help="Restringe a un tipo: reglamento, calendario, politica, resolucion.")
+    parser.add_argument("--title", help="Texto que debe aparecer en el título del documento.")
+    parser.add_argument("--vigente-en", help="Solo documentos vigentes en esa fecha (AAAA-MM-DD).")
+    parser.add_argument("--no-auto-filters", action="store_true",
+                        help="No deducir filtros desde la pregunta.")
+    parser.add_argument("--expand-tokens", type=int, default=None,
+                        help="Completar los chunks con sus vecinos hasta N tokens (por defecto CONTEXT_EXPAND_TOKENS).")
+    # Modo batch: muchas preguntas, una búsqueda agrupada y generaciones concurrentes
+    parser.add_argument("--batch", metavar="ARCHIVO",
+                        help="Preguntas a procesar juntas: .csv con columna 'query' o una por línea ('-' = stdin).")
+    parser.add_argument("--output", help="Archivo NDJSON de salida del modo batch (por defecto stdout).")
+    parser.add_argument("--max-concurrency", type=int, default=None,
+                        help="Generaciones simultáneas en modo batch (por defecto BATCH_MAX_CONCURRENCY o 4).")
 
     args = parser.parse_args()
+    if not args.query and not args.batch:
+        parser.error("Indique una pregunta o --batch ARCHIVO.")
+    try:
+        filters = SearchFilters.from_dict({
+            "doc_id": args.doc_id, "doc_type": args.doc_type,
+            "title": args.title, "vigente_en": args.vigente_en,
+        })
+    except ValueError as e:
+        parser.error(f"Filtros inválidos: {e}")
+
+    if args.batch:
+        queries = read_batch_queries(args.batch)
+        if not queries:
+            parser.error(f"No hay preguntas en {args.batch}")
+        with (open(args.output, "w", encoding="utf-8") if args.output else nullcontext(sys.stdout)) as output:
+            run_batch_cli(queries, args.provider, args.k, filters, not args.no_auto_filters,
+                          args.max_concurrency, output, args.expand_tokens)
+        sys.exit(0)
 
     print("--- 1. Inicializando componentes RAG ---")
     start_time = time.time()
 
-    # ACTUALIZAMOS EL LLAMADO Y DESEMPAQUE DE LA TUPLA
-    final_response, retrieved_texts, citations, tokens = rag_pipeline(
-        query=args.query, provider=args.provider, k=args.k  # Se pasa el valor de 'k'
-    )
+    result = pipeline.run(query=args.query, provider=args.provider, k=args.k, filters=filters,
+                          auto_filters=not args.no_auto_filters, expand_tokens=args.expand_tokens)
 
     end_time = time.time()
     latency_ms = (end_time - start_time) * 1000
 
     print("\n--- ¡Proceso Completado! ---")
     print("\nRespuesta Final:")
-    print(final_response)
+    print(result.answer)
 
     # LÓGICA DE CITAS: Impresión de referencias en el formato requerido
-    if citations:
+    if result.citations:
         print("\n### Referencias:")
-        for citation in citations:
+        for citation in result.citations:
             # Formato requerido: [Documento, p.xx] e ID/URL
             print(f"  - [{citation['title']}, p.{citation['page']}] (URL: {citation['url']})")
     else:
         print("\n### Referencias: No se encontraron fuentes.")
 
     # ACTUALIZAMOS LAS MÉTRICAS FINALES
-    print(f"\nModelo usado: {args.provider.upper()}")
-    print(f"Fragmentos recuperados (k): {len(retrieved_texts)}")
-    print(f"Tokens usados (estimado): {tokens}")
-    print(f"Latencia: {latency_ms:.2f} ms")
\ No newline at end of file
+    print(f"\nModelo usado: {result.provider.upper()}")
+    print(f"Fragmentos recuperados (k): {len(result.retrieved_texts)}")
+    print(f"Filtros ({result.filters_source}): {result.filters.to_dict() or 'ninguno'}")
+    print(f"Tokens usados (estimado): {result.tokens_used}")
+    print(f"Latencia: {latency_ms:.2f} ms")
+
+    # Desglose por etapa: ¿el encoder, Qdrant o el LLM?
+    print("\nDesglose por etapa:")
+    for stage in result.stages:
+        print(f"  - {stage.name:<16} {stage.ms:>10.2f} ms  ({stage.alloc_blocks:+d} bloques)")
@@ -0,0 +1,47 @@
+#!/usr/bin/env python3
+"""
+Compara dos resultados de bench/run_bench.py (p. ej. dos commits).
+
+Uso:
+    python -m bench.compare bench/results/<base>.json bench/results/<nuevo>.json
+"""
+import json
+import sys
+from pathlib import Path
+
+
+def _delta(old, new) -> str:
+    if old in (None, 0) or new is None:
+        return "   n/d"
+    return f"{(new - old) / old * 100:+6.1f}%"
+
+
+def main():
+    if len(sys.argv) != 3:
+        print(__doc__)
+        sys.exit(1)
+
+    base = json.loads(Path(sys.argv[1]).read_text(encoding="utf-8"))
+    new = json.loads(Path(sys.argv[2]).read_text(encoding="utf-8"))
+    print(f"base {base['meta']['commit']}  ->  nuevo {new['meta']['commit']}")
+
+    base_levels = {lvl["concurrency"]: lvl for lvl in base["levels"]}
+    for lvl in new["levels"]:
+        old = base_levels.get(lvl["concurrency"])
+        if old is None:
+            continue
+        print(f"\n== concurrencia {lvl['concurrency']}")
+        print(f"   throughput {old['throughput_rps']:>10} -> {lvl['throughput_rps']:<10} "
+              f"{_delta(old['throughput_rps'], lvl['throughput_rps'])}")
+        rows = [("e2e", old["latency_ms"], lvl["latency_ms"])]
+        rows += [(name, old["stages_ms"].get(name, {}), s) for name, s in lvl["stages_ms"].items()]
+        for name, o, n in rows:
+            cells = "  ".join(f"{p} {_delta(o.get(p), n.get(p))}" for p in ("p50", "p95", "p99"))
+            print(f"   {name:<16} {cells}")
+
+    print(f"\nRSS máximo {base['peak_rss_mb']} MB -> {new['peak_rss_mb']} MB "
+          f"{_delta(base['peak_rss_mb'], new['peak_rss_mb'])}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+# bench/fakes.py
+"""
+Componentes falsos y deterministas para medir el pipeline sin claves de API.
+
+- FakeProvider: implementa `Provider` y duerme según una distribución de latencia.
+- HashingEncoder: reemplazo de SentenceTransformer (bolsa de palabras con hashing),
+  para correr sin descargar el modelo. Con `--encoder minilm` se usa el modelo real.
+"""
+import hashlib
+import math
+import random
+import re
+import threading
+import time
+from typing import Any, Dict, List, Union
+
+import numpy as np
+
+from providers.base import Provider
+
+
+class LatencyDistribution:
+    """
+    Distribución de latencia en ms a partir de una especificación de texto:
+
+        fixed:200            siempre 200 ms
+        uniform:100,400      uniforme entre 100 y 400 ms
+        normal:300,50        normal (media, desviación), truncada en 0
+        lognormal:300,0.5    log-normal (mediana, sigma): cola larga como un LLM real
+    """
+
+    def __init__(self, spec: str, seed: int = 0):
+        self.spec = spec
+        kind, _, params = spec.partition(":")
+        values = [float(v) for v in params.split(",")] if params else []
+        self.kind = kind
+        self.values = values
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+
+        expected = {"fixed": 1, "uniform": 2, "normal": 2, "lognormal": 2}
+        if kind not in expected or len(values) != expected[kind]:
+            raise ValueError(f"Distribución de latencia inválida: {spec!r}")
+
+    def sample_ms(self) -> float:
+        with self._lock:
+            if self.kind == "fixed":
+                return self.values[0]
+            if self.kind == "uniform":
+                return self._rng.uniform(*self.values)
+            if self.kind == "normal":
+                return max(0.0, self._rng.gauss(*self.values))
+            median, sigma = self.values
+            return self._rng.lognormvariate(math.log(median), sigma)
+
+
+class FakeProvider(Provider):
+    """Proveedor LLM falso: espera la latencia muestreada y responde con texto fijo."""
+
+    def __init__(self, provider_name: str, latency: Union[str, LatencyDistribution] = "fixed:0",
+                 seed: int = 0, answer_words: int = 60):
+        self._name = provider_name
+        self.latency = latency if isinstance(latency, LatencyDistribution) else LatencyDistribution(latency, seed)
+        self.answer_words = answer_words
+
+    @property
+    def name(self) -> str:
+        return f"Fake-{self._name}"
+
+    def chat(self, messages: List[Dict[str, str]], **kwargs: Any) -> str:
+        time.sleep(self.latency.sample_ms() / 1000.0)
+        prompt = messages[-1]["content"]
+        digest = hashlib.sha1(prompt.encode("utf-8")).hexdigest()[:8]
+        return f"Respuesta simulada {digest}. " + " ".join(["normativa"] * self.answer_words)
+
+
+class HashingEncoder:
+    """Encoder determinista compatible con la interfaz usada de SentenceTransformer."""
+
+    _TOKEN = re.compile(r"\w+", re.UNICODE)
+
+    def __init__(self, dimension: int = 384):
+        self.dimension = dimension
+
+    def get_sentence_embedding_dimension(self) -> int:
+        return self.dimension
+
+    def _encode_one(self, text: str) -> np.ndarray:
+        vec = np.zeros(self.dimension, dtype=np.float32)
+        for token in self._TOKEN.findall(text.lower()):
+            h = int.from_bytes(hashlib.blake2b(token.encode("utf-8"), digest_size=8).digest(), "little")
+            vec[h % self.dimension] += 1.0 if (h >> 63) & 1 else -1.0
+        norm = np.linalg.norm(vec)
+        return vec / norm if norm > 0 else vec
+
+    def encode(self, texts, **kwargs: Any) -> np.ndarray:
+        if isinstance(texts, str):
+            return self._encode_one(texts)
+        return np.stack([self._encode_one(t) for t in texts]) if texts else np.zeros((0, self.dimension), np.float32)
@@ -0,0 +1,352 @@
+#!/usr/bin/env python3
+"""
+Generador de carga HTTP para `/api/query` (solo biblioteca estándar).
+
+Modos:
+    open    Lazo abierto: llegadas a tasa fija (--rate, constante o Poisson).
+            La latencia se mide desde la hora de llegada *programada*, no desde
+            el envío real. Si el servidor (o el cliente) se atrasa, la espera en
+            cola queda incluida. Así se corrige la omisión coordinada.
+    closed  Lazo cerrado: --concurrency usuarios que envían, esperan la
+            respuesta y vuelven a enviar. Con --expected-interval-ms se agregan
+            las muestras que un usuario habría enviado mientras esperaba
+            (corrección tipo HdrHistogram).
+    sweep   Lazo cerrado para cada nivel de --sweep (p. ej. 1,2,4,8,16): reporta
+            throughput vs concurrencia y el punto de saturación.
+
+Fuentes de consultas:
+    --replay "logs/traces.*.jsonl*"
+                                 Spans raíz de rag/tracing.py (query, provider, k),
+                                 respetando los tiempos originales (--speed los acelera).
+                                 Por defecto solo las trazas del muestreo aleatorio:
+                                 las lentas y con error se guardan siempre y
+                                 sesgarían la mezcla (--replay-biased las incluye).
+    --replay data/gold_set.csv   Preguntas del gold set (sin tiempos: usa --rate).
+
+Ejemplos:
+    python -m bench.loadgen open --rate 5 --duration 60
+    python -m bench.loadgen open --replay "logs/traces.*.jsonl*" --speed 100
+    python -m bench.loadgen closed --concurrency 8 --duration 60 --expected-interval-ms 2000
+    python -m bench.loadgen sweep --sweep 1,2,4,8,16,32 --duration 30
+"""
+import argparse
+import csv
+import json
+import math
+import random
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import List, Optional
+
+# Añadir el directorio raíz al path para importar módulos
+root_dir = Path(__file__).parent.parent
+sys.path.append(str(root_dir))
+
+from rag.tracing import ROOT_SPAN_NAME, load_traces
+
+PERCENTILES = (50, 90, 95, 99, 99.9)
+
+
+@dataclass
+class Request:
+    """Consulta a enviar y su desfase (s) respecto del inicio de la prueba."""
+    query: str
+    provider: str = "openrouter"
+    k: int = 4
+    offset_s: Optional[float] = None
+
+
+@dataclass
+class Sample:
+    latency_ms: float          # desde la llegada programada (corregida)
+    service_ms: float          # desde el envío real
+    ok: bool
+    status: int
+    synthetic: bool = False    # muestra agregada por la corrección de lazo cerrado
+
+
+@dataclass
+class Results:
+    samples: List[Sample] = field(default_factory=list)
+    lock: threading.Lock = field(default_factory=threading.Lock)
+
+    def add(self, sample: Sample):
+        with self.lock:
+            self.samples.append(sample)
+
+
+# -------------------------------
+# Carga de consultas
+# -------------------------------
+def load_requests(path: str, provider: str, k: int, include_biased: bool = False) -> List[Request]:
+    """
+    Consultas desde un CSV o desde trazas. De las trazas se toman solo las
+    guardadas por muestreo aleatorio (sampled_reason "random"), salvo con
+    `include_biased`: con TRACE_SAMPLE_RATE=0.01 cada lenta o con error pesa
+    100 veces más en el log que en el tráfico real. Las trazas sin
+    sampled_reason (logs antiguos) se incluyen.
+    """
+    p = Path(path)
+    if p.suffix == ".csv":
+        with p.open(encoding="utf-8", newline="") as f:
+            return [Request(row["query"], provider, k) for row in csv.DictReader(f) if row.get("query")]
+
+    roots = [r for r in load_traces(path) if r["name"] == ROOT_SPAN_NAME]
+    if not include_biased:
+        kept = [r for r in roots if r["attributes"].get("sampled_reason", "random") == "random"]
+        if len(kept) < len(roots):
+            print(f"[replay] Se omiten {len(roots) - len(kept)} trazas guardadas por lentas o con error "
+                  f"(muestreo sesgado; --replay-biased las incluye)")
+        roots = kept
+    if not roots:
+        return []
+    rates = {r["attributes"].get("sample_rate") for r in roots} - {None}
+    if len(rates) == 1:
+        rate = rates.pop()
+        print(f"[replay] {len(roots)} trazas muestreadas al {rate:.2%}: los tiempos entre llegadas son "
+              f"~{1 / rate:.0f}x los reales (--speed {1 / rate:.0f} recupera la tasa original)")
+    t0 = roots[0]["start"]
+    return [
+        Request(
+            query=r["attributes"].get("query", ""),
+            provider=r["attributes"].get("provider", provider),
+            k=int(r["attributes"].get("k", k)),
+            offset_s=r["start"] - t0,
+        )
+        for r in roots
+        if r["attributes"].get("query")
+    ]
+
+
+# -------------------------------
+# Envío HTTP
+# -------------------------------
+def send(url: str, req: Request, timeout: float):
+    """Envía una consulta y devuelve (ok, status)."""
+    body = json.dumps({"query": req.query, "provider": req.provider, "k": req.k}).encode("utf-8")
+    http_req = urllib.request.Request(url, data=body, headers={"Content-Type": "application/json"}, method="POST")
+    try:
+        with urllib.request.urlopen(http_req, timeout=timeout) as resp:
+            resp.read()
+            return resp.status == 200, resp.status
+    except urllib.error.HTTPError as e:
+        return False, e.code
+    except Exception:
+        return False, 0
+
+
+# -------------------------------
+# Lazo abierto
+# -------------------------------
+def open_loop(url: str, requests: List[Request], rate: float, duration: float, poisson: bool,
+              speed: float, max_inflight: int, timeout: float, seed: int) -> Results:
+    """
+    Programa las llegadas de antemano y mide cada request desde su hora
+    programada. Si los `max_inflight` hilos están ocupados, el request espera y
+    esa espera cuenta como latencia (es lo que vería un usuario real).
+    """
+    rng = random.Random(seed)
+    schedule = []
+    if requests and requests[0].offset_s is not None:
+        # Replay: se respetan los tiempos originales (escalados por --speed)
+        for req in requests:
+            if req.offset_s / speed > duration:
+                break
+            schedule.append((req.offset_s / speed, req))
+    else:
+        t, i = 0.0, 0
+        while t < duration:
+            schedule.append((t, requests[i % len(requests)]))
+            i += 1
+            t += rng.expovariate(rate) if poisson else 1.0 / rate
+
+    results = Results()
+    start = time.perf_counter()
+
+    def fire(intended: float, req: Request):
+        sent = time.perf_counter()
+        ok, status = send(url, req, timeout)
+        done = time.perf_counter()
+        results.add(Sample(
+            latency_ms=(done - intended) * 1000,
+            service_ms=(done - sent) * 1000,
+            ok=ok,
+            status=status,
+        ))
+
+    with ThreadPoolExecutor(max_workers=max_inflight) as executor:
+        for offset, req in schedule:
+            intended = start + offset
+            delay = intended - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            executor.submit(fire, intended, req)
+    return results
+
+
+# -------------------------------
+# Lazo cerrado
+# -------------------------------
+def closed_loop(url: str, requests: List[Request], concurrency: int, duration: float,
+                expected_interval_ms: Optional[float], think_ms: float, timeout: float) -> Results:
+    """
+    `concurrency` usuarios en lazo cerrado. Con `expected_interval_ms`, una
+    respuesta que tardó L > intervalo agrega muestras L - intervalo,
+    L - 2·intervalo, ...: son los requests que el usuario no alcanzó a enviar
+    mientras esperaba.
+    """
+    results = Results()
+    deadline = time.perf_counter() + duration
+    counter = iter(range(sys.maxsize))
+    counter_lock = threading.Lock()
+
+    def user():
+        while time.perf_counter() < deadline:
+            with counter_lock:
+                i = next(counter)
+            req = requests[i % len(requests)]
+            sent = time.perf_counter()
+            ok, status = send(url, req, timeout)
+            latency_ms = (time.perf_counter() - sent) * 1000
+            results.add(Sample(latency_ms, latency_ms, ok, status))
+
+            if expected_interval_ms:
+                missing = latency_ms - expected_interval_ms
+                while missing > 0:
+                    results.add(Sample(missing, missing, ok, status, synthetic=True))
+                    missing -= expected_interval_ms
+            if think_ms:
+                time.sleep(think_ms / 1000.0)
+
+    threads = [threading.Thread(target=user, daemon=True) for _ in range(concurrency)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return results
+
+
+# -------------------------------
+# Reporte
+# -------------------------------
+def percentile(sorted_values: List[float], p: float) -> float:
+    """Percentil por rango más cercano: el valor en la posición ceil(p/100 · n)."""
+    if not sorted_values:
+        return 0.0
+    # p * n antes de dividir: 7 / 100.0 * 100 da 7.000000000000001 y ceil lo sube a 8
+    idx = max(0, min(len(sorted_values) - 1, math.ceil(p * len(sorted_values) / 100.0) - 1))
+    return sorted_values[idx]
+
+
+def summarize(results: Results, wall_s: float) -> dict:
+    real = [s for s in results.samples if not s.synthetic]
+    corrected = sorted(s.latency_ms for s in results.samples)
+    service = sorted(s.service_ms for s in real)
+    errors = sum(1 for s in real if not s.ok)
+    completed_ok = len(real) - errors
+    return {
+        "requests": len(real),
+        "errors": errors,
+        "error_rate": round(errors / len(real), 4) if real else 0.0,
+        "throughput_rps": round(completed_ok / wall_s, 3) if wall_s > 0 else 0.0,
+        "latency_ms": dict(
+            {f"p{p:g}": round(percentile(corrected, p), 2) for p in PERCENTILES},
+            max=round(corrected[-1], 2) if corrected else 0.0,
+        ),
+        "service_time_ms": {f"p{p:g}": round(percentile(service, p), 2) for p in PERCENTILES},
+        "status_codes": _count_status(real),
+    }
+
+
+def _count_status(samples: List[Sample]) -> dict:
+    counts = {}
+    for s in samples:
+        counts[str(s.status)] = counts.get(str(s.status), 0) + 1
+    return counts
+
+
+def print_summary(title: str, summary: dict):
+    print(f"\n== {title}")
+    print(f"   requests {summary['requests']}  errores {summary['errors']} "
+          f"({summary['error_rate'] * 100:.2f}%)  throughput {summary['throughput_rps']} req/s")
+    lat = "  ".join(f"{k} {v}" for k, v in summary["latency_ms"].items())
+    svc = "  ".join(f"{k} {v}" for k, v in summary["service_time_ms"].items())
+    print(f"   latencia (corregida) ms: {lat}")
+    print(f"   tiempo de servicio   ms: {svc}")
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Generador de carga para /api/query")
+    ap.add_argument("mode", choices=["open", "closed", "sweep"])
+    ap.add_argument("--url", default="http://localhost:5000/api/query")
+    ap.add_argument("--replay", default="data/gold_set.csv",
+                    help="JSONL de trazas (rag/tracing.py) o CSV con columna 'query'")
+    ap.add_argument("--provider", default="openrouter")
+    ap.add_argument("--k", type=int, default=4)
+    ap.add_argument("--duration", type=float, default=60.0, help="Duración en segundos (por nivel en sweep)")
+    ap.add_argument("--rate", type=float, default=1.0, help="Llegadas por segundo (modo open)")
+    ap.add_argument("--poisson", action="store_true", help="Llegadas Poisson en vez de intervalo fijo")
+    ap.add_argument("--speed", type=float, default=1.0, help="Factor de aceleración del replay de trazas")
+    ap.add_argument("--replay-biased", action="store_true",
+                    help="Incluir trazas guardadas por lentas o con error (sobrerrepresentadas)")
+    ap.add_argument("--max-inflight", type=int, default=256, help="Requests simultáneos máximos (modo open)")
+    ap.add_argument("--concurrency", type=int, default=4)
+    ap.add_argument("--sweep", default="1,2,4,8,16,32")
+    ap.add_argument("--expected-interval-ms", type=float, default=None,
+                    help="Intervalo esperado entre requests de un usuario (corrección en lazo cerrado)")
+    ap.add_argument("--think-ms", type=float, default=0.0)
+    ap.add_argument("--timeout", type=float, default=120.0)
+    ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("--output", default=None, help="Guardar el reporte como JSON")
+    args = ap.parse_args()
+
+    requests = load_requests(args.replay, args.provider, args.k, args.replay_biased)
+    if not requests:
+        print(f"No se encontraron consultas en {args.replay}")
+        sys.exit(1)
+    if args.mode == "open" and requests[0].offset_s is None and args.rate <= 0:
+        # Sin tiempos de replay las llegadas salen de --rate
+        ap.error(f"--rate debe ser mayor que 0 en modo open (recibido {args.rate})")
+
+    report = {"mode": args.mode, "url": args.url, "replay": args.replay, "levels": []}
+
+    if args.mode == "open":
+        start = time.perf_counter()
+        results = open_loop(args.url, requests, args.rate, args.duration, args.poisson, args.speed,
+                            args.max_inflight, args.timeout, args.seed)
+        summary = summarize(results, time.perf_counter() - start)
+        print_summary(f"lazo abierto ({args.rate} req/s)", summary)
+        report["levels"].append(dict(summary, rate=args.rate))
+
+    else:
+        levels = [args.concurrency] if args.mode == "closed" else [int(c) for c in args.sweep.split(",")]
+        for concurrency in levels:
+            start = time.perf_counter()
+            results = closed_loop(args.url, requests, concurrency, args.duration,
+                                  args.expected_interval_ms, args.think_ms, args.timeout)
+            summary = summarize(results, time.perf_counter() - start)
+            print_summary(f"lazo cerrado, concurrencia {concurrency}", summary)
+            report["levels"].append(dict(summary, concurrency=concurrency))
+
+        if args.mode == "sweep":
+            best = max(report["levels"], key=lambda lvl: lvl["throughput_rps"])
+            report["saturation"] = {"concurrency": best["concurrency"], "throughput_rps": best["throughput_rps"]}
+            print("\nThroughput vs concurrencia:")
+            for lvl in report["levels"]:
+                print(f"   {lvl['concurrency']:>4}  {lvl['throughput_rps']:>8} req/s  "
+                      f"p99 {lvl['latency_ms']['p99']} ms")
+            print(f"Saturación: ~{best['throughput_rps']} req/s con concurrencia {best['concurrency']}")
+
+    if args.output:
+        Path(args.output).write_text(json.dumps(report, ensure_ascii=False, indent=2), encoding="utf-8")
+        print(f"\nReporte guardado en '{args.output}'")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,232 @@
+#!/usr/bin/env python3
+"""
+Benchmark offline de extremo a extremo del pipeline RAG.
+
+Corre `RAGPipeline` contra un Qdrant en memoria (`QdrantClient(":memory:")`) y
+proveedores falsos con latencia configurable, sin claves de API ni servidor.
+Reporta p50/p95/p99 por etapa, throughput para varios niveles de concurrencia
+y el RSS máximo del proceso. El resultado se guarda como JSON
+(bench/results/<commit>.json) para compararlo entre commits con bench/compare.py.
+
+Uso:
+    python -m bench.run_bench --concurrency 1,4,16 --requests 200 \\
+        --provider-latency lognormal:800,0.4
+"""
+import argparse
+import csv
+import json
+import os
+import platform
+import random
+import resource
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Dict, List
+
+import numpy as np
+
+# Añadir el directorio raíz al path para importar módulos
+root_dir = Path(__file__).parent.parent
+sys.path.append(str(root_dir))
+
+from qdrant_client import QdrantClient
+
+from bench.fakes import FakeProvider, HashingEncoder
+from rag.ingest import build_records, create_collection, load_sources, upload_records
+from rag.pipeline import STAGES, RAGPipeline
+from rag.retrieve import QdrantRetriever
+
+COLLECTION = "bench_normativa"
+PERCENTILES = (50, 95, 99)
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=root_dir, stderr=subprocess.DEVNULL, text=True
+        ).strip()
+    except Exception:
+        return "unknown"
+
+
+def peak_rss_mb() -> float:
+    """RSS máximo del proceso (ru_maxrss está en KB en Linux y en bytes en macOS)."""
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / (1024 * 1024) if sys.platform == "darwin" else rss / 1024
+
+
+def summarize(values: List[float]) -> Dict[str, float]:
+    if not values:
+        return {}
+    arr = np.asarray(values, dtype=np.float64)
+    out = {f"p{p}": round(float(np.percentile(arr, p)), 3) for p in PERCENTILES}
+    out["mean"] = round(float(arr.mean()), 3)
+    return out
+
+
+def load_queries(path: Path) -> List[str]:
+    with path.open(encoding="utf-8", newline="") as f:
+        return [row["query"] for row in csv.DictReader(f) if row.get("query")]
+
+
+def synthetic_records(n_chunks: int, queries: List[str], seed: int = 0) -> List[dict]:
+    """Corpus sintético: mezcla palabras de las preguntas con relleno determinista."""
+    rng = random.Random(seed)
+    vocab = sorted({w for q in queries for w in q.lower().split()}) or ["normativa"]
+    records = []
+    for i in range(n_chunks):
+        doc = i % 6
+        words = [rng.choice(vocab) for _ in range(200)]
+        records.append({
+            "chunk_id": f"synthetic-{doc}_p{i // 6}_c0",
+            "doc_id": f"synthetic-{doc}",
+            "title": f"Documento sintético {doc}",
+            "page": i // 6 + 1,
+            "url": "",
+            "vigencia": "",
+            "text": " ".join(words),
+            "filename": f"synthetic-{doc}.txt",
+        })
+    return records
+
+
+def build_pipeline(args, queries: List[str]):
+    """Carga el corpus en Qdrant en memoria y arma el pipeline con proveedores falsos."""
+    if args.encoder == "hash":
+        encoder = HashingEncoder()
+    else:
+        from sentence_transformers import SentenceTransformer
+        encoder = SentenceTransformer("all-MiniLM-L6-v2")
+
+    if args.corpus == "raw":
+        records = build_records(Path(args.raw), load_sources(Path(args.sources)), args.chunk_size, args.overlap)
+    else:
+        records = synthetic_records(args.synthetic_chunks, queries, seed=args.seed)
+
+    client = QdrantClient(":memory:")
+    start = time.perf_counter()
+    create_collection(client, COLLECTION, encoder.get_sentence_embedding_dimension())
+    upload_records(client, COLLECTION, records, encoder)
+    ingest_s = time.perf_counter() - start
+
+    # Las preguntas del gold set se repiten: sin desactivar el cache LRU de
+    # vectores, embed_query mediría aciertos de cache y no el encoder
+    if not args.embed_cache:
+        os.environ["EMBED_CACHE_SIZE"] = "0"
+    retriever = QdrantRetriever(collection_name=COLLECTION, qdrant_client=client, embedding_model=encoder)
+    providers = {
+        "openrouter": FakeProvider("openrouter", args.provider_latency, seed=args.seed),
+        "deepseek": FakeProvider("deepseek", args.provider_latency, seed=args.seed + 1),
+    }
+    corpus = {"source": args.corpus, "chunks": len(records), "ingest_s": round(ingest_s, 3)}
+    return RAGPipeline(retriever, providers), corpus
+
+
+def run_level(pipeline: RAGPipeline, queries: List[str], concurrency: int, n_requests: int,
+              provider: str, k: int) -> dict:
+    """Ejecuta n_requests con `concurrency` hilos y agrega las latencias."""
+    workload = [queries[i % len(queries)] for i in range(n_requests)]
+
+    def one(query: str):
+        return pipeline.run(query=query, provider=provider, k=k)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = list(executor.map(one, workload))
+    wall_s = time.perf_counter() - start
+
+    stage_values: Dict[str, List[float]] = {name: [] for name in STAGES}
+    for r in results:
+        for s in r.stages:
+            stage_values.setdefault(s.name, []).append(s.ms)
+
+    return {
+        "concurrency": concurrency,
+        "requests": n_requests,
+        "wall_s": round(wall_s, 3),
+        "throughput_rps": round(n_requests / wall_s, 3) if wall_s > 0 else None,
+        "latency_ms": summarize([r.latency_ms for r in results]),
+        "stages_ms": {name: summarize(v) for name, v in stage_values.items() if v},
+    }
+
+
+def print_level(level: dict):
+    lat = level["latency_ms"]
+    print(f"\n== concurrencia {level['concurrency']}: {level['throughput_rps']} req/s "
+          f"(p50 {lat['p50']} ms, p95 {lat['p95']} ms, p99 {lat['p99']} ms)")
+    print(f"   {'etapa':<16} {'p50':>10} {'p95':>10} {'p99':>10}")
+    for name, s in level["stages_ms"].items():
+        print(f"   {name:<16} {s['p50']:>10.3f} {s['p95']:>10.3f} {s['p99']:>10.3f}")
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Benchmark offline del pipeline RAG")
+    ap.add_argument("--corpus", choices=["raw", "synthetic"], default="synthetic",
+                    help="raw: PDFs de data/raw (requiere pypdf); synthetic: chunks generados")
+    ap.add_argument("--raw", default="data/raw")
+    ap.add_argument("--sources", default="data/sources.csv")
+    ap.add_argument("--chunk-size", type=int, default=900)
+    ap.add_argument("--overlap", type=int, default=120)
+    ap.add_argument("--synthetic-chunks", type=int, default=2000)
+    ap.add_argument("--queries", default="data/gold_set.csv")
+    ap.add_argument("--encoder", choices=["hash", "minilm"], default="hash",
+                    help="hash: encoder determinista sin descargas; minilm: all-MiniLM-L6-v2 real")
+    ap.add_argument("--embed-cache", action="store_true",
+                    help="Mantener el cache LRU de vectores de consulta (desactivado por defecto)")
+    ap.add_argument("--provider", default="openrouter")
+    ap.add_argument("--provider-latency", default="lognormal:800,0.4",
+                    help="fixed:MS | uniform:A,B | normal:MEDIA,STD | lognormal:MEDIANA,SIGMA")
+    ap.add_argument("--k", type=int, default=4)
+    ap.add_argument("--concurrency", default="1,4,16", help="Niveles de concurrencia separados por coma")
+    ap.add_argument("--requests", type=int, default=100, help="Requests por nivel de concurrencia")
+    ap.add_argument("--warmup", type=int, default=5)
+    ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("--output", default="bench/results", help="Directorio del JSON de resultados")
+    args = ap.parse_args()
+
+    queries = load_queries(Path(args.queries))
+    if not queries:
+        print(f"No se encontraron preguntas en {args.queries}")
+        sys.exit(1)
+
+    print("--- Cargando corpus en Qdrant en memoria ---")
+    pipeline, corpus = build_pipeline(args, queries)
+    print(f"{corpus['chunks']} chunks indexados en {corpus['ingest_s']} s")
+
+    for q in queries[:args.warmup]:
+        pipeline.run(query=q, provider=args.provider, k=args.k)
+
+    levels = []
+    for concurrency in [int(c) for c in args.concurrency.split(",") if c.strip()]:
+        level = run_level(pipeline, queries, concurrency, args.requests, args.provider, args.k)
+        print_level(level)
+        levels.append(level)
+
+    commit = git_commit()
+    report = {
+        "meta": {
+            "commit": commit,
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "args": vars(args),
+        },
+        "corpus": corpus,
+        "levels": levels,
+        "peak_rss_mb": round(peak_rss_mb(), 1),
+    }
+
+    out_dir = Path(args.output)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    out_path = out_dir / f"{commit}.json"
+    out_path.write_text(json.dumps(report, ensure_ascii=False, indent=2), encoding="utf-8")
+    print(f"\nRSS máximo: {report['peak_rss_mb']} MB")
+    print(f"Resultados guardados en '{out_path}'")
+
+
+if __name__ == "__main__":
+    main()
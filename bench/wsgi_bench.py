@@ -0,0 +1,39 @@
+# wsgi_bench.py
+"""
+Punto de entrada WSGI para medir el despliegue con Gunicorn sin servicios
+externos: Qdrant en memoria, corpus sintético y proveedores falsos, igual que
+bench/run_bench.py. Sirve para medir memoria por worker
+(scripts/worker_memory.py) y throughput vs número de workers
+(bench/loadgen.py sweep) sin claves de API.
+
+Variables de entorno:
+    BENCH_ENCODER           "hash" (por defecto, sin descargas) o "minilm"
+    BENCH_CHUNKS            Chunks del corpus sintético (por defecto 2000)
+    BENCH_PROVIDER_LATENCY  Latencia del LLM falso (por defecto "fixed:200")
+
+Uso:
+    GUNICORN_WORKERS=2 gunicorn -c gunicorn.conf.py bench.wsgi_bench:app
+"""
+import argparse
+import os
+from pathlib import Path
+
+import rag.pipeline
+from bench.run_bench import build_pipeline, load_queries
+
+_args = argparse.Namespace(
+    encoder=os.environ.get("BENCH_ENCODER", "hash"),
+    corpus="synthetic",
+    synthetic_chunks=int(os.environ.get("BENCH_CHUNKS", 2000)),
+    seed=0,
+    embed_cache=False,
+    provider_latency=os.environ.get("BENCH_PROVIDER_LATENCY", "fixed:200"),
+)
+_pipeline, _ = build_pipeline(_args, load_queries(Path("data/gold_set.csv")))
+
+# flask_app arma su pipeline al importarse: se reemplaza antes por el de prueba
+rag.pipeline.build_default_pipeline = lambda: _pipeline
+
+from flask_app import app  # noqa: E402
+
+__all__ = ["app"]
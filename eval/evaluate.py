@@ -1,14 +1,20 @@
 import sys
 import os
-import csv
+import json
 import time
 import math
+import sqlite3
+import hashlib
+import argparse
+import threading
+import pandas as pd
+from pathlib import Path
+from typing import Dict, List, Optional
 from ragas import evaluate
 from datasets import Dataset
 # Importa las métricas correctas
 from ragas.metrics import faithfulness, answer_relevancy, context_precision, context_recall
-from concurrent.futures import ThreadPoolExecutor
-import functools
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 # 🔑 Nuevos imports
 from dotenv import load_dotenv
@@ -19,7 +25,8 @@ from langchain_community.embeddings import HuggingFaceEmbeddings
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 # Importa tus funciones RAG
-from app import call_rag_chatgpt, call_rag_deepseek
+from app import call_rag_chatgpt, call_rag_deepseek, pipeline
+from eval.retrieval_eval import load_gold_set
 
 # --- Cargar variables de entorno ---
 load_dotenv()
@@ -27,9 +34,11 @@ load_dotenv()
 # --- Configuración de LLM para Ragas ---
 if os.getenv("OPENAI_API_KEY"):
     ragas_llm = ChatOpenAI(model="gpt-4o-mini", temperature=0)
+    ragas_llm_name = "gpt-4o-mini"
 elif os.getenv("OPENROUTER_API_KEY"):
+    ragas_llm_name = os.getenv("OPENROUTER_MODEL", "openai/gpt-4o-mini")
     ragas_llm = ChatOpenAI(
-        model=os.getenv("OPENROUTER_MODEL", "openai/gpt-4o-mini"),
+        model=ragas_llm_name,
         temperature=0,
         openai_api_key=os.getenv("OPENROUTER_API_KEY"),
         openai_api_base="https://openrouter.ai/api/v1"
@@ -40,88 +49,253 @@ else:
 # --- Configuración de Embeddings para Ragas (gratis con HuggingFace) ---
 ragas_embeddings = HuggingFaceEmbeddings(model_name="sentence-transformers/all-MiniLM-L6-v2")
 
-def _process_single_query(row: dict, model_name: str, call_function):
+RAGAS_METRICS = [faithfulness, answer_relevancy, context_precision, context_recall]
+METRIC_NAMES = ["faithfulness", "answer_relevancy", "context_precision", "context_recall"]
+
+# Nombre del modelo -> (función RAG, proveedor)
+MODELS = {
+    "ChatGPT": (call_rag_chatgpt, "openrouter"),
+    "DeepSeek": (call_rag_deepseek, "deepseek"),
+}
+
+
+# -------------------------------
+# Límite de tasa por proveedor
+# -------------------------------
+class TokenBucket:
+    """Token bucket: `rate` requests por segundo con ráfagas de hasta `burst` (rate 0 = sin límite)."""
+
+    def __init__(self, rate: float, burst: int = 1):
+        self.rate = rate
+        self.capacity = max(1, burst)
+        self.tokens = float(self.capacity)
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """Bloquea hasta que haya un token disponible."""
+        if self.rate <= 0:
+            return
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+# -------------------------------
+# Cache en disco (también sirve de checkpoint)
+# -------------------------------
+class EvalCache:
+    """
+    Cache SQLite de salidas RAG y puntajes RAGAS.
+
+    Cada fila se guarda apenas termina, así que una ejecución interrumpida se
+    reanuda desde donde quedó. Las llaves incluyen la versión servida
+    (RAGPipeline.served_version: índice activo y ajustes de recuperación): si
+    cambia el índice o la configuración, las filas se recalculan.
+    """
+
+    def __init__(self, path: Path):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self.conn = sqlite3.connect(str(path), check_same_thread=False)
+        self.lock = threading.Lock()
+        with self.lock, self.conn:
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS rag_outputs ("
+                "key TEXT PRIMARY KEY, question TEXT, provider TEXT, k INTEGER, corpus_version TEXT, "
+                "answer TEXT, contexts TEXT, tokens_used INTEGER, latency REAL, created REAL)"
+            )
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS ragas_scores ("
+                "key TEXT PRIMARY KEY, rag_key TEXT, scores TEXT, created REAL)"
+            )
+
+    @staticmethod
+    def make_key(*parts) -> str:
+        return hashlib.sha256(json.dumps(parts, ensure_ascii=False).encode("utf-8")).hexdigest()
+
+    def get_output(self, key: str) -> Optional[dict]:
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT answer, contexts, tokens_used, latency FROM rag_outputs WHERE key = ?", (key,)
+            ).fetchone()
+        if row is None:
+            return None
+        return {"answer": row[0], "contexts": json.loads(row[1]), "tokens_used": row[2], "latency": row[3]}
+
+    def put_output(self, key: str, question: str, provider: str, k: int, version: str, result: dict):
+        with self.lock, self.conn:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO rag_outputs VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (key, question, provider, k, version, result["answer"],
+                 json.dumps(result["contexts"], ensure_ascii=False), result["tokens_used"],
+                 result["latency"], time.time()),
+            )
+
+    def get_scores(self, key: str) -> Optional[Dict[str, float]]:
+        with self.lock:
+            row = self.conn.execute("SELECT scores FROM ragas_scores WHERE key = ?", (key,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def put_scores(self, key: str, rag_key: str, scores: Dict[str, float]):
+        with self.lock, self.conn:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO ragas_scores VALUES (?, ?, ?, ?)",
+                (key, rag_key, json.dumps(scores), time.time()),
+            )
+
+
+def non_negative_float(value: str) -> float:
+    """Tipo de argparse para --rps: número >= 0."""
+    number = float(value)
+    if number < 0:
+        raise argparse.ArgumentTypeError(f"debe ser >= 0 (recibido {value})")
+    return number
+
+
+def _process_single_query(row: dict, call_function, k: int, bucket: TokenBucket):
     query = row['query']
-    ground_truth = row['ground_truth']
 
+    bucket.acquire()
     start_time = time.time()
     try:
-        generated_answer, retrieved_sources_list, tokens_used = call_function(query)
-        end_time = time.time()
-        latency = end_time - start_time
+        generated_answer, retrieved_sources_list, _citations, tokens_used = call_function(query, k=k)
+        latency = time.time() - start_time
     except Exception as e:
         print(f"Error al procesar la pregunta '{query}': {e}")
-        generated_answer, retrieved_sources_list, latency, tokens_used = "Error en la generación.", [], 0.0, 0
-    
+        return None
+
     return {
-        'question': query,
         'answer': generated_answer,
         'contexts': retrieved_sources_list,
-        'ground_truth': ground_truth,
+        'tokens_used': tokens_used,
         'latency': latency,
-        'tokens_used': tokens_used
     }
 
-def evaluate_rag_model(model_name: str, test_set_path: str):
-    print(f"\n--- Iniciando evaluación para el modelo: {model_name} ---")
 
-    # 1. Cargar el conjunto de datos
-    print("Cargando el conjunto de datos de prueba...")
-    if not os.path.exists(test_set_path):
-        print(f"Error: El archivo '{test_set_path}' no se encuentra.")
-        return
+def generate_outputs(data: List[dict], model_names: List[str], k: int, version: str, cache: EvalCache,
+                     buckets: Dict[str, TokenBucket], max_workers: int) -> Dict[str, List[Optional[dict]]]:
+    """
+    Obtiene la salida RAG de cada (modelo, pregunta): primero del cache y, si
+    falta, llamando al proveedor. Todos los modelos se procesan en el mismo pool
+    y cada proveedor respeta su propio token bucket.
+    """
+    outputs: Dict[str, List[Optional[dict]]] = {name: [None] * len(data) for name in model_names}
+    pending = []
+    for name in model_names:
+        provider = MODELS[name][1]
+        for i, row in enumerate(data):
+            key = cache.make_key(row['query'], provider, k, version)
+            cached = cache.get_output(key)
+            if cached is not None:
+                outputs[name][i] = dict(cached, rag_key=key)
+            else:
+                pending.append((name, i, key))
 
-    with open(test_set_path, 'r', encoding='utf-8') as f:
-        reader = csv.DictReader(f)
-        data = list(reader)
-
-    # 2. Procesar concurrentemente
-    print(f"Procesando {len(data)} preguntas de forma concurrente...")
-    call_function = call_rag_chatgpt if model_name == 'ChatGPT' else call_rag_deepseek
-    
-    with ThreadPoolExecutor(max_workers=os.cpu_count() * 2) as executor:
-        func = functools.partial(_process_single_query, model_name=model_name, call_function=call_function)
-        results = list(executor.map(func, data))
-
-    # 3. Consolidar resultados
-    questions = [res['question'] for res in results]
-    ground_truths = [res['ground_truth'] for res in results]
-    latencies = [res['latency'] for res in results]
-    generated_answers = [res['answer'] for res in results]
-    retrieved_sources = [res['contexts'] for res in results]
-    tokens_used_list = [res['tokens_used'] for res in results]
-
-    dataset = Dataset.from_dict({
-        'question': questions,
-        'answer': generated_answers,
-        'contexts': retrieved_sources,
-        'ground_truth': ground_truths
-    })
-
-    # 4. Evaluar con ragas
-    print("\nEvaluando métricas Ragas (puede tomar unos minutos)...")
-    result = evaluate(
-        dataset,
-        metrics=[faithfulness, answer_relevancy, context_precision, context_recall],
-        llm=ragas_llm,
-        embeddings=ragas_embeddings   # ✅ Ahora usa embeddings de HuggingFace
-    )
+    print(f"Salidas RAG en cache: {len(data) * len(model_names) - len(pending)}; "
+          f"por generar: {len(pending)}")
 
-    df = result.to_pandas()
+    # Un pool por modelo: un proveedor lento o limitado no bloquea al otro
+    executors = {name: ThreadPoolExecutor(max_workers=max_workers) for name in model_names}
+    try:
+        futures = {}
+        for name, i, key in pending:
+            call_function, provider = MODELS[name]
+            future = executors[name].submit(_process_single_query, data[i], call_function, k, buckets[provider])
+            futures[future] = (name, i, key)
+
+        for future in as_completed(futures):
+            name, i, key = futures[future]
+            result = future.result()
+            if result is None:
+                # Los errores no se cachean: se reintentan en la próxima ejecución
+                continue
+            cache.put_output(key, data[i]['query'], MODELS[name][1], k, version, result)
+            outputs[name][i] = dict(result, rag_key=key)
+    finally:
+        for executor in executors.values():
+            executor.shutdown(wait=True)
+
+    return outputs
+
+
+def score_outputs(data: List[dict], outputs: List[Optional[dict]], cache: EvalCache,
+                  batch_size: int) -> List[Optional[Dict[str, float]]]:
+    """Calcula RAGAS solo para las filas sin puntaje en cache, en lotes con checkpoint."""
+    scores: List[Optional[Dict[str, float]]] = [None] * len(data)
+    missing = []
+    for i, out in enumerate(outputs):
+        if out is None:
+            continue
+        key = cache.make_key(out['rag_key'], data[i]['ground_truth'], METRIC_NAMES, ragas_llm_name)
+        cached = cache.get_scores(key)
+        if cached is not None:
+            scores[i] = cached
+        else:
+            missing.append((i, key))
+
+    print(f"Puntajes RAGAS en cache: {sum(s is not None for s in scores)}; por evaluar: {len(missing)}")
+
+    for start in range(0, len(missing), batch_size):
+        chunk = missing[start:start + batch_size]
+        dataset = Dataset.from_dict({
+            'question': [data[i]['query'] for i, _ in chunk],
+            'answer': [outputs[i]['answer'] for i, _ in chunk],
+            'contexts': [outputs[i]['contexts'] for i, _ in chunk],
+            'ground_truth': [data[i]['ground_truth'] for i, _ in chunk],
+        })
+        result = evaluate(
+            dataset,
+            metrics=RAGAS_METRICS,
+            llm=ragas_llm,
+            embeddings=ragas_embeddings   # ✅ Ahora usa embeddings de HuggingFace
+        )
+        df = result.to_pandas()
+        for (i, key), (_, row) in zip(chunk, df.iterrows()):
+            row_scores = {m: float(row[m]) for m in METRIC_NAMES}
+            scores[i] = row_scores
+            # NaN = falló la llamada al juez: no se cachea, se reintenta en la próxima ejecución
+            if any(math.isnan(v) for v in row_scores.values()):
+                continue
+            cache.put_scores(key, outputs[i]['rag_key'], row_scores)
+        print(f"   Checkpoint: {min(start + batch_size, len(missing))}/{len(missing)} filas evaluadas")
 
-    # 5. Métricas adicionales
+    return scores
+
+
+def report_model(model_name: str, data: List[dict], outputs: List[Optional[dict]],
+                 scores: List[Optional[Dict[str, float]]]):
+    rows = []
+    for row, out, sc in zip(data, outputs, scores):
+        if out is None:
+            out = {'answer': "Error en la generación.", 'contexts': [], 'tokens_used': 0, 'latency': 0.0}
+        rows.append(dict(
+            {'question': row['query'], 'answer': out['answer'], 'contexts': out['contexts'],
+             'ground_truth': row['ground_truth'], 'latency': out['latency'], 'tokens_used': out['tokens_used']},
+            **(sc or {m: float('nan') for m in METRIC_NAMES}),
+        ))
+
+    df = pd.DataFrame(rows)
+
+    latencies = df['latency'].tolist()
+    tokens_used_list = df['tokens_used'].tolist()
     avg_latency = sum(latencies) / len(latencies) if latencies else 0
     total_tokens = sum(tokens_used_list)
     avg_tokens = total_tokens / len(tokens_used_list) if tokens_used_list else 0
 
-    # 6. Mostrar resultados
     print("\n--- Resultados de la Evaluación ---")
     print(f"Métricas del Modelo {model_name}:")
     print(f"   Puntaje de Fidelidad: {df['faithfulness'].mean():.2f}")
     print(f"   Puntaje de Relevancia de la Respuesta: {df['answer_relevancy'].mean():.2f}")
     print(f"   Puntaje de Precisión del Contexto: {df['context_precision'].mean():.2f}")
     print(f"   Puntaje de Recall del Contexto: {df['context_recall'].mean():.2f}")
-    print(f"   Latencia Promedio: {avg_latency:.2f} segundos")
+    print(f"   Latencia Promedio (sin cache): {avg_latency:.2f} segundos")
     print(f"   Tokens Totales Usados: {total_tokens}")
     print(f"   Tokens Promedio Usados: {math.floor(avg_tokens)}")
 
@@ -129,11 +303,58 @@ def evaluate_rag_model(model_name: str, test_set_path: str):
     df.to_csv(output_path, index=False)
     print(f"\nResultados detallados guardados en '{output_path}'")
 
+
+def evaluate_rag_models(model_names: List[str], test_set_path: str, k: int = 4, rps: float = 1.0,
+                        burst: int = 2, max_workers: int = 8, cache_path: Path = Path("eval/.cache/eval_cache.sqlite"),
+                        ragas_batch_size: int = 8, raw_dir: Path = Path("data/raw")):
+    print(f"\n--- Iniciando evaluación para: {', '.join(model_names)} ---")
+
+    # 1. Cargar el conjunto de datos
+    print("Cargando el conjunto de datos de prueba...")
+    if not os.path.exists(test_set_path):
+        print(f"Error: El archivo '{test_set_path}' no se encuentra.")
+        return
+
+    # ground_truth trae comas sin comillas: csv.DictReader lo cortaría en la primera
+    raw_files = [p.name for p in raw_dir.iterdir() if p.is_file()] if raw_dir.is_dir() else []
+    data = load_gold_set(Path(test_set_path), raw_files)
+
+    version = pipeline.served_version()
+    print(f"Versión servida: {version}")
+    cache = EvalCache(cache_path)
+    buckets = {MODELS[name][1]: TokenBucket(rps, burst) for name in model_names}
+
+    # 2. Generar (o recuperar del cache) las respuestas de todos los modelos a la vez
+    outputs = generate_outputs(data, model_names, k, version, cache, buckets, max_workers)
+
+    # 3. Evaluar con ragas solo lo que cambió
+    for name in model_names:
+        print(f"\nEvaluando métricas Ragas para {name} (puede tomar unos minutos)...")
+        scores = score_outputs(data, outputs[name], cache, ragas_batch_size)
+        report_model(name, data, outputs[name], scores)
+
+
 if __name__ == "__main__":
-    gold_set_path = os.path.join("data", "gold_set.csv")
-    if not os.path.exists(gold_set_path):
-        print(f"Error: El archivo '{gold_set_path}' no se encuentra.")
+    parser = argparse.ArgumentParser(description="Evaluación RAGAS con cache, límite de tasa y reanudación.")
+    parser.add_argument("--provider", choices=["openrouter", "deepseek", "all"], default="all",
+                        help="Proveedor a evaluar (por defecto ambos, en paralelo).")
+    parser.add_argument("--gold-set", default=os.path.join("data", "gold_set.csv"))
+    parser.add_argument("--raw", type=Path, default=Path("data/raw"),
+                        help="Documentos fuente (para separar ground_truth del archivo de origen).")
+    parser.add_argument("--k", type=int, default=4)
+    parser.add_argument("--rps", type=non_negative_float, default=1.0,
+                        help="Requests por segundo por proveedor (0 = sin límite).")
+    parser.add_argument("--burst", type=int, default=2, help="Ráfaga máxima del token bucket.")
+    parser.add_argument("--workers", type=int, default=8, help="Hilos por proveedor.")
+    parser.add_argument("--cache", type=Path, default=Path("eval/.cache/eval_cache.sqlite"))
+    parser.add_argument("--ragas-batch-size", type=int, default=8, help="Filas por checkpoint de RAGAS.")
+    args = parser.parse_args()
+
+    if not os.path.exists(args.gold_set):
+        print(f"Error: El archivo '{args.gold_set}' no se encuentra.")
         print("Por favor, crea este archivo o verifica la ruta.")
     else:
-        evaluate_rag_model(model_name="ChatGPT", test_set_path=gold_set_path)
-        evaluate_rag_model(model_name="DeepSeek", test_set_path=gold_set_path)
+        names = [name for name, (_, provider) in MODELS.items() if args.provider in ("all", provider)]
+        evaluate_rag_models(names, args.gold_set, k=args.k, rps=args.rps, burst=args.burst,
+                            max_workers=args.workers, cache_path=args.cache,
+                            ragas_batch_size=args.ragas_batch_size, raw_dir=args.raw)
@@ -0,0 +1,468 @@
+#!/usr/bin/env python3
+"""
+Evaluación rápida solo de recuperación (sin LLM): recall@k, MRR y nDCG.
+
+Usa las etiquetas de relevancia de data/gold_set.csv: el documento de origen
+(`source_file`, traducido a doc_id como en rag/ingest.py) y, si el CSV trae
+una última columna `page`, también la página. Todas las preguntas se codifican en un
+solo encode y las métricas se calculan vectorizadas con numpy.
+
+Con --auto-filters se agrega, por cada índice plano, una fila con los filtros
+que QueryClassifier deduce de cada pregunta (rag/filters.py), junto con la
+fracción del corpus que se recorre. Con --routing M1,M2 se agregan filas con
+el ruteo de dos etapas (centroides por documento/sección, rag/routing.py):
+recall del ruteo (¿el documento correcto quedó entre los M?) y latencia
+incluyendo el ruteo, frente a la búsqueda plana.
+
+El modo --sweep recorre una grilla de chunk_size x overlap x tipo de índice.
+Reutiliza la extracción de texto (cache por contenido del PDF) y los
+embeddings (cache por modelo + textos). El resultado es una tabla de calidad vs
+latencia vs tamaño del índice.
+
+Uso:
+    python eval/retrieval_eval.py
+    python eval/retrieval_eval.py --sweep --chunk-sizes 300,600,900 --overlaps 60,120 \\
+        --index-types FlatIP,FlatL2 --output sweep.csv
+    python eval/retrieval_eval.py --sweep --chunk-sizes 900 --overlaps 120 \\
+        --index-types FlatIP,Int8,Int8+rescore,Binary,Binary+rescore
+"""
+import argparse
+import csv
+import hashlib
+import itertools
+import json
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Dict, List, Sequence
+
+import numpy as np
+import faiss
+
+# Añadir el directorio raíz al path para importar módulos
+root_dir = Path(__file__).parent.parent
+sys.path.append(str(root_dir))
+
+from rag.compact import VECTORS_FILE, CompactIndex
+from rag.embed import FAISSIndexBuilder
+from rag.filters import QueryClassifier, filter_columns
+from rag.ingest import build_records, extract_pages, load_sources
+from rag.routing import DocumentRouter, build_centroids
+
+KS = (1, 3, 5, 10)
+
+
+# -------------------------------
+# Gold set
+# -------------------------------
+def load_gold_set(path: Path, raw_filenames: Sequence[str]) -> List[dict]:
+    """
+    Lee el gold set tolerando comas sin comillas en `ground_truth` (y en el
+    nombre del PDF del calendario): el archivo de origen es el sufijo de la
+    fila que coincide con un archivo de data/raw, y `ground_truth` todo lo que
+    queda entre la pregunta y ese sufijo (también lo usa eval/evaluate.py).
+    """
+    raw_set = set(raw_filenames)
+    rows = []
+    with path.open(encoding="utf-8", newline="") as f:
+        reader = csv.reader(f)
+        header = next(reader)
+        # Columna opcional `page` (debe ser la última): relevancia a nivel de página
+        has_page = header[-1].strip() == "page"
+        for row in reader:
+            if len(row) < 4:
+                continue
+            fields = row[:-1] if has_page else row
+            source_start = len(fields) - 1
+            for j in range(2, len(fields)):
+                if ",".join(fields[j:]).strip() in raw_set:
+                    source_start = j
+                    break
+            rows.append({
+                "id": fields[0],
+                "query": fields[1],
+                "ground_truth": ",".join(fields[2:source_start]).strip(),
+                "source_file": ",".join(fields[source_start:]).strip(),
+                "page": int(row[-1]) if has_page and row[-1].strip() else None,
+            })
+    return rows
+
+
+# -------------------------------
+# Caches de extracción y embeddings
+# -------------------------------
+class CachedExtractor:
+    """Envuelve extract_pages con un cache en disco por contenido del archivo."""
+
+    def __init__(self, cache_dir: Path):
+        self.cache_dir = cache_dir / "pages"
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+
+    def __call__(self, fp: Path):
+        digest = hashlib.sha1(fp.read_bytes()).hexdigest()[:16]
+        cached = self.cache_dir / f"{digest}.json"
+        if cached.exists():
+            return json.loads(cached.read_text(encoding="utf-8"))
+        pages = extract_pages(fp)
+        if pages is not None:
+            cached.write_text(json.dumps(pages, ensure_ascii=False), encoding="utf-8")
+        return pages
+
+
+def embed_cached(encoder, model_name: str, texts: List[str], cache_dir: Path) -> np.ndarray:
+    """Codifica `texts` en un solo encode, reutilizando el resultado si ya existe en disco."""
+    h = hashlib.sha1(model_name.encode("utf-8"))
+    for t in texts:
+        h.update(b"\x00" + t.encode("utf-8"))
+    path = cache_dir / "embeddings" / f"{h.hexdigest()[:20]}.npy"
+    if path.exists():
+        return np.load(path)
+    vectors = np.asarray(
+        encoder.encode(texts, batch_size=64, convert_to_numpy=True, show_progress_bar=False),
+        dtype=np.float32,
+    )
+    path.parent.mkdir(parents=True, exist_ok=True)
+    np.save(path, vectors)
+    return vectors
+
+
+# -------------------------------
+# Índices
+# -------------------------------
+class FlatSearcher:
+    """Índice FAISS plano construido con FAISSIndexBuilder (rag/embed.py)."""
+
+    def __init__(self, embeddings: np.ndarray, index_type: str):
+        self.normalize = index_type == "FlatIP"
+        builder = FAISSIndexBuilder(embeddings.shape[1])
+        # build_index normaliza en su lugar para FlatIP: se pasa una copia
+        self.index = builder.build_index(embeddings.copy(), index_type)
+
+    def search(self, queries: np.ndarray, k: int) -> np.ndarray:
+        q = np.ascontiguousarray(queries, dtype=np.float32).copy()
+        if self.normalize:
+            faiss.normalize_L2(q)
+        _, ids = self.index.search(q, k)
+        return ids
+
+    @property
+    def nbytes(self) -> int:
+        return int(faiss.serialize_index(self.index).size)
+
+
+def filtered_search(searcher: FlatSearcher, queries: np.ndarray, masks: np.ndarray, k: int,
+                    fill: bool = True) -> np.ndarray:
+    """
+    Búsqueda con un filtro distinto por pregunta (IDSelector de FAISS). Con
+    `fill`, igual que el pipeline con filtros automáticos: si el filtro deja
+    menos de k chunks, el top-k se completa con la búsqueda sin filtros.
+    """
+    q_all = np.ascontiguousarray(queries, dtype=np.float32).copy()
+    if searcher.normalize:
+        faiss.normalize_L2(q_all)
+    out = np.full((len(q_all), k), -1, dtype=np.int64)
+    for i, (q, mask) in enumerate(zip(q_all, masks)):
+        allowed = np.flatnonzero(mask).astype(np.int64)
+        if len(allowed) == len(mask):
+            out[i] = searcher.index.search(q[None, :], k)[1][0]
+            continue
+        found = []
+        if len(allowed):
+            params = faiss.SearchParameters(sel=faiss.IDSelectorBatch(allowed))
+            found = [j for j in searcher.index.search(q[None, :], min(k, len(allowed)), params=params)[1][0] if j >= 0]
+        if fill and len(found) < k:
+            extra = searcher.index.search(q[None, :], k)[1][0]
+            found += [j for j in extra if j >= 0 and j not in found][:k - len(found)]
+        out[i, :len(found)] = found
+    return out
+
+
+class FilterVariant:
+    """Filtros deducidos por QueryClassifier: una máscara de chunks por pregunta."""
+    name = "filtros"
+
+    def __init__(self, masks: np.ndarray):
+        self.masks = masks
+
+    def search(self, searcher, queries: np.ndarray, rows: slice, k: int) -> np.ndarray:
+        return filtered_search(searcher, queries, self.masks[rows], k)
+
+    def report(self) -> dict:
+        return {"scan_fraction": round(float(self.masks.mean()), 4)}
+
+
+class RoutingVariant:
+    """
+    Ruteo de dos etapas (rag/routing.py): los centroides eligen los M documentos
+    más cercanos y solo se buscan sus chunks. La latencia incluye el ruteo.
+    """
+
+    def __init__(self, router: DocumentRouter, m: int, chunk_docs: np.ndarray, gold_docs: List[str]):
+        self.name = f"ruteo{m}"
+        self.router = router
+        self.m = m
+        self.chunk_docs = chunk_docs
+        self.gold_docs = gold_docs
+        self.routed: List[tuple] = []
+
+    def search(self, searcher, queries: np.ndarray, rows: slice, k: int) -> np.ndarray:
+        routed = [self.router.route(q, self.m) for q in queries]
+        if rows == slice(None):
+            self.routed = routed
+        masks = np.stack([np.isin(self.chunk_docs, docs) for docs in routed])
+        return filtered_search(searcher, queries, masks, k, fill=False)
+
+    def report(self) -> dict:
+        hits = [g in docs for g, docs in zip(self.gold_docs, self.routed)]
+        scanned = [np.isin(self.chunk_docs, docs).mean() for docs in self.routed]
+        return {
+            "routing_recall": round(float(np.mean(hits)), 4),
+            "scan_fraction": round(float(np.mean(scanned)), 4),
+        }
+
+
+class CompactSearcher:
+    """
+    Índice int8 / binario de rag/compact.py. Con `rescore`, los float32 van a
+    un archivo temporal abierto con memmap, como en producción; `nbytes`
+    cuenta solo los códigos que quedan en RAM.
+    """
+
+    def __init__(self, embeddings: np.ndarray, storage: str, rescore: bool):
+        self._tmp = tempfile.TemporaryDirectory(prefix="compact_") if rescore else None
+        vectors_path = Path(self._tmp.name) / VECTORS_FILE if rescore else None
+        self.index = CompactIndex.build(embeddings, storage, vectors_path)
+
+    def search(self, queries: np.ndarray, k: int) -> np.ndarray:
+        q = np.ascontiguousarray(queries, dtype=np.float32).copy()
+        faiss.normalize_L2(q)
+        _, ids = self.index.search(q, k)
+        return ids
+
+    @property
+    def nbytes(self) -> int:
+        return self.index.nbytes
+
+
+# Tipo de índice -> constructor(embeddings, records)
+INDEX_TYPES = {
+    "FlatL2": lambda embeddings, records: FlatSearcher(embeddings, "FlatL2"),
+    "FlatIP": lambda embeddings, records: FlatSearcher(embeddings, "FlatIP"),
+    "Int8": lambda embeddings, records: CompactSearcher(embeddings, "int8", rescore=False),
+    "Int8+rescore": lambda embeddings, records: CompactSearcher(embeddings, "int8", rescore=True),
+    "Binary": lambda embeddings, records: CompactSearcher(embeddings, "binary", rescore=False),
+    "Binary+rescore": lambda embeddings, records: CompactSearcher(embeddings, "binary", rescore=True),
+}
+
+
+# -------------------------------
+# Métricas (vectorizadas sobre todas las preguntas)
+# -------------------------------
+def relevance_matrix(ids: np.ndarray, chunk_docs: np.ndarray, chunk_pages: np.ndarray,
+                     gold_docs: np.ndarray, gold_pages: np.ndarray) -> np.ndarray:
+    """Matriz booleana (n_preguntas, K): ¿el resultado en la posición j es relevante?"""
+    valid = ids >= 0
+    safe = np.where(valid, ids, 0)
+    rel = valid & (chunk_docs[safe] == gold_docs[:, None])
+    has_page = gold_pages >= 0
+    rel &= ~has_page[:, None] | (chunk_pages[safe] == gold_pages[:, None])
+    return rel
+
+
+def retrieval_metrics(rel: np.ndarray, n_relevant: np.ndarray, ks: Sequence[int] = KS) -> Dict[str, float]:
+    """recall@k (al menos un chunk relevante en el top-k), MRR y nDCG@k con ganancias binarias."""
+    K = rel.shape[1]
+    out: Dict[str, float] = {}
+    for k in ks:
+        if k <= K:
+            out[f"recall@{k}"] = float(rel[:, :k].any(axis=1).mean())
+
+    has_hit = rel.any(axis=1)
+    first = rel.argmax(axis=1)
+    out["mrr"] = float(np.where(has_hit, 1.0 / (first + 1), 0.0).mean())
+
+    discounts = 1.0 / np.log2(np.arange(2, K + 2))
+    ideal_cum = np.concatenate([[0.0], np.cumsum(discounts)])
+    for k in ks:
+        if k > K:
+            continue
+        dcg = (rel[:, :k] * discounts[:k]).sum(axis=1)
+        idcg = ideal_cum[np.minimum(n_relevant, k)]
+        out[f"ndcg@{k}"] = float(np.where(idcg > 0, dcg / np.where(idcg > 0, idcg, 1), 0.0).mean())
+    return out
+
+
+def evaluate_config(records: List[dict], embeddings: np.ndarray, query_vectors: np.ndarray,
+                    gold: List[dict], index_type: str, k_max: int, variant=None) -> dict:
+    """
+    Construye el índice, busca todas las preguntas y calcula métricas + latencia + tamaño.
+
+    `variant` (FilterVariant / RoutingVariant) reemplaza la búsqueda plana por
+    una restringida y agrega sus propias columnas (fracción recorrida, etc.).
+    """
+    doc_ids = sorted({r["doc_id"] for r in records} | {g["doc_id"] for g in gold})
+    doc_index = {d: i for i, d in enumerate(doc_ids)}
+    chunk_docs = np.array([doc_index[r["doc_id"]] for r in records])
+    chunk_pages = np.array([int(r["page"]) for r in records])
+    gold_docs = np.array([doc_index[g["doc_id"]] for g in gold])
+    gold_pages = np.array([g["page"] if g["page"] is not None else -1 for g in gold])
+
+    start = time.perf_counter()
+    searcher = INDEX_TYPES[index_type](embeddings, records)
+    build_s = time.perf_counter() - start
+
+    k = min(k_max, len(records))
+    if variant is None:
+        def search(queries, rows):
+            return searcher.search(queries, k)
+    else:
+        def search(queries, rows):
+            return variant.search(searcher, queries, rows, k)
+
+    start = time.perf_counter()
+    ids = search(query_vectors, slice(None))
+    batch_ms = (time.perf_counter() - start) * 1000 / len(gold)
+
+    # Latencia por consulta individual (como en producción: una pregunta a la vez)
+    single = []
+    for i, q in enumerate(query_vectors):
+        t0 = time.perf_counter()
+        search(q[None, :], slice(i, i + 1))
+        single.append((time.perf_counter() - t0) * 1000)
+
+    rel = relevance_matrix(ids, chunk_docs, chunk_pages, gold_docs, gold_pages)
+    match_page = (gold_pages[:, None] < 0) | (chunk_pages[None, :] == gold_pages[:, None])
+    n_relevant = ((chunk_docs[None, :] == gold_docs[:, None]) & match_page).sum(axis=1)
+
+    row = dict(
+        retrieval_metrics(rel, n_relevant),
+        index=index_type if variant is None else f"{index_type}+{variant.name}",
+        chunks=len(records),
+        scan_fraction=1.0,
+        build_s=round(build_s, 4),
+        search_ms_p50=round(float(np.percentile(single, 50)), 4),
+        search_ms_batched=round(batch_ms, 4),
+        index_mb=round(searcher.nbytes / (1024 * 1024), 3),
+    )
+    if variant is not None:
+        row.update(variant.report())
+    return row
+
+
+def print_table(rows: List[dict]):
+    cols = ["chunk_size", "overlap", "index", "chunks", "recall@1", "recall@5", "recall@10",
+            "mrr", "ndcg@10", "search_ms_p50", "index_mb", "scan_fraction", "routing_recall"]
+    print("\n" + "  ".join(f"{c:>13}" for c in cols))
+    for row in rows:
+        cells = []
+        for c in cols:
+            v = row.get(c, "")
+            cells.append(f"{v:>13.4f}" if isinstance(v, float) else f"{str(v):>13}")
+        print("  ".join(cells))
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Evaluación solo de recuperación (recall@k, MRR, nDCG)")
+    ap.add_argument("--gold-set", type=Path, default=Path("data/gold_set.csv"))
+    ap.add_argument("--raw", type=Path, default=Path("data/raw"))
+    ap.add_argument("--sources", type=Path, default=Path("data/sources.csv"))
+    ap.add_argument("--cache-dir", type=Path, default=Path("data/processed/cache"))
+    ap.add_argument("--model-name", default="all-MiniLM-L6-v2")
+    ap.add_argument("--encoder", choices=["minilm", "hash"], default="minilm",
+                    help="hash: encoder determinista de bench/fakes.py (sin descargas)")
+    ap.add_argument("--k", type=int, default=10, help="Profundidad máxima de búsqueda")
+    ap.add_argument("--chunk-size", type=int, default=900)
+    ap.add_argument("--overlap", type=int, default=120)
+    ap.add_argument("--index-type", default="FlatIP")
+    ap.add_argument("--sweep", action="store_true", help="Recorrer la grilla de configuraciones")
+    ap.add_argument("--chunk-sizes", default="300,600,900")
+    ap.add_argument("--overlaps", default="60,120")
+    ap.add_argument("--index-types", default="FlatIP,FlatL2")
+    ap.add_argument("--auto-filters", action="store_true",
+                    help="Agregar filas con los filtros deducidos por QueryClassifier (solo índices Flat)")
+    ap.add_argument("--routing", default="",
+                    help="Valores de M para el ruteo de dos etapas, p. ej. 1,2,3 (solo índices Flat)")
+    ap.add_argument("--output", type=Path, default=None, help="Guardar la tabla como CSV")
+    args = ap.parse_args()
+
+    if args.encoder == "hash":
+        from bench.fakes import HashingEncoder
+        encoder = HashingEncoder()
+    else:
+        from sentence_transformers import SentenceTransformer
+        encoder = SentenceTransformer(args.model_name)
+    model_key = f"{args.encoder}:{args.model_name}"
+
+    sources = load_sources(args.sources)
+    raw_files = [p.name for p in args.raw.iterdir() if p.is_file()]
+    gold = load_gold_set(args.gold_set, raw_files)
+    for g in gold:
+        g["doc_id"] = sources.get(g["source_file"], {}).get("doc_id", Path(g["source_file"]).stem)
+
+    # Un solo encode para todas las preguntas
+    query_vectors = embed_cached(encoder, model_key, [g["query"] for g in gold], args.cache_dir)
+
+    if args.sweep:
+        grid = list(itertools.product(
+            [int(c) for c in args.chunk_sizes.split(",")],
+            [int(o) for o in args.overlaps.split(",")],
+        ))
+        index_types = args.index_types.split(",")
+    else:
+        grid = [(args.chunk_size, args.overlap)]
+        index_types = [args.index_type]
+
+    extractor = CachedExtractor(args.cache_dir)
+    rows = []
+    for chunk_size, overlap in grid:
+        if overlap >= chunk_size:
+            continue
+        records = build_records(args.raw, sources, chunk_size, overlap, extract=extractor)
+        embeddings = embed_cached(encoder, model_key, [r["text"] for r in records], args.cache_dir)
+        variants = []
+        if args.auto_filters:
+            columns = filter_columns(records)
+            classifier = QueryClassifier.from_sources(sources)
+            variants.append(FilterVariant(
+                np.stack([classifier.classify(g["query"]).mask(columns) for g in gold])
+            ))
+        if args.routing:
+            router = DocumentRouter(*build_centroids(records, embeddings))
+            chunk_docs = np.array([r["doc_id"] for r in records], dtype=str)
+            for m in [int(x) for x in args.routing.split(",") if x.strip()]:
+                variants.append(RoutingVariant(router, m, chunk_docs, [g["doc_id"] for g in gold]))
+        for index_type in index_types:
+            row = evaluate_config(records, embeddings, query_vectors, gold, index_type, args.k)
+            rows.append(dict(row, chunk_size=chunk_size, overlap=overlap))
+            if index_type not in ("FlatIP", "FlatL2"):
+                continue
+            for variant in variants:
+                row = evaluate_config(records, embeddings, query_vectors, gold, index_type, args.k, variant)
+                rows.append(dict(row, chunk_size=chunk_size, overlap=overlap))
+
+    print(f"\n{len(gold)} preguntas evaluadas")
+    print_table(rows)
+
+    if args.output:
+        write_rows(args.output, rows)
+
+
+def write_rows(path: Path, rows: List[dict]):
+    """
+    Guarda la tabla como CSV. Las columnas son la unión de las de todas las
+    filas, en orden de aparición: solo las filas de ruteo traen routing_recall.
+    """
+    if not rows:
+        print("\nSin filas: no se escribe la tabla")
+        return
+    fieldnames = list(dict.fromkeys(key for row in rows for key in row))
+    with path.open("w", encoding="utf-8", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=fieldnames, restval="")
+        writer.writeheader()
+        writer.writerows(rows)
+    print(f"\nTabla guardada en '{path}'")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,93 +1,79 @@
+import json
 import os
 import time
 from dotenv import load_dotenv
-from typing import List, Tuple, Dict, Any
-from flask import Flask, render_template, request, jsonify
-
-# Importar los componentes que creaste (Asegúrate que las rutas sean correctas)
-from rag.retrieve import QdrantRetriever
-from providers.deepseek import DeepSeekProvider
-from providers.openrouter import OpenRouterProvider
+from flask import Flask, Response, render_template, request, jsonify
 
 # Cargar las variables de entorno desde el archivo .env
 load_dotenv()
 
+# Pipeline RAG compartido con app.py (rag/pipeline.py)
+from rag.pipeline import build_default_pipeline
+from rag.filters import SearchFilters
+from rag import metrics
+
 # -------------------------------
-# Inicialización global (DUPLICADA para independencia)
+# Inicialización global
 # -------------------------------
-retriever = QdrantRetriever()
-deepseek_provider = DeepSeekProvider()
-openrouter_provider = OpenRouterProvider()
-
-# Definimos el tipo para los metadatos de citación
-CitationMetadata = Dict[str, Any]
+pipeline = build_default_pipeline()
+retriever = pipeline.retriever
 
 # Inicialización de Flask
 app = Flask(__name__)
 
-# -------------------------------
-# Pipeline RAG (DUPLICADO)
-# -------------------------------
-def rag_pipeline(query: str, provider: str = "openrouter", k: int = 4) -> Tuple[str, List[str], List[CitationMetadata], int]:
-    """
-    Ejecuta el pipeline RAG completo para una consulta de usuario.
-    (Copia EXACTA de la función rag_pipeline de tu app.py)
-    """
-    # Seleccionar el proveedor ya inicializado
-    if provider == "deepseek":
-        llm = deepseek_provider
-    else:
-        llm = openrouter_provider
-
-    # Paso de Recuperación (Retrieval)
-    chunks = retriever.retrieve(query, k=k)
-
-    if not chunks:
-        # DEVOLVEMOS LISTA VACÍA DE CITACIONES EN CASO DE NO ENCONTRAR NADA
-        return (
-            "No pude encontrar información relevante en la base de datos para responder a tu pregunta.",
-            [],
-            [],
-            0,
-        )
-
-    # 1. Extraer el contenido de texto para el prompt
-    retrieved_texts = [chunk["text"] for chunk in chunks]
-
-    # 2. LÓGICA DE CITACIÓN: Extraer y filtrar metadatos de citación (para evitar duplicados)
-    unique_citations_set = set()
-    citation_metadata: List[CitationMetadata] = []
-
-    for chunk in chunks:
-        source_key = (chunk.get("title"), chunk.get("page"), chunk.get("url"))
-
-        if source_key not in unique_citations_set:
-            unique_citations_set.add(source_key)
-            citation_metadata.append({
-                "title": chunk.get("title", "Documento Desconocido"),
-                "page": chunk.get("page", "N/D"),
-                "url": chunk.get("url", "#")
-            })
-
-    # Paso de Aumento de Contexto (Augmentation)
-    context = "\n\n".join(retrieved_texts)
-
-    # PROMPT MEJORADO: Política de Abstención más clara
-    augmented_prompt = (
-        f"Basado EXCLUSIVAMENTE en la siguiente información de la normativa de la UFRO, responde la pregunta del usuario. "
-        f"Si la información no es suficiente o no permite una respuesta completa, indica claramente que no puedes responderla con el contexto proporcionado (Política de Abstención).\n\n"
-        f"### Contexto:\n{context}\n\n### Pregunta del usuario:\n{query}"
+# /api/batch: preguntas por request y tope de generaciones simultáneas
+BATCH_MAX_QUERIES = int(os.environ.get("BATCH_MAX_QUERIES", 200))
+BATCH_MAX_CONCURRENCY = int(os.environ.get("BATCH_MAX_CONCURRENCY", 4))
+
+# Topes de servidor para lo que pide el cliente: un k o un presupuesto de
+# expansión enorme se traduce en búsquedas y prompts del mismo tamaño
+MAX_K = int(os.environ.get("MAX_K", 20))
+MAX_EXPAND_TOKENS = int(os.environ.get("MAX_EXPAND_TOKENS", 2000))
+
+
+def _retriever_metrics():
+    """Métricas calculadas al momento del scrape: cache de embeddings y batcher."""
+    info = retriever.cache_info()
+    lookups = info.hits + info.misses
+    lines = metrics.simple_metric_lines(
+        "rag_embedding_cache_requests_total", "Consultas al cache de vectores de consulta.", "counter",
+        [({"result": "hit"}, info.hits), ({"result": "miss"}, info.misses)],
+    )
+    lines += metrics.simple_metric_lines(
+        "rag_embedding_cache_hit_ratio", "Proporción de aciertos del cache de vectores de consulta.", "gauge",
+        [({}, info.hits / lookups if lookups else 0.0)],
+    )
+    lines += metrics.simple_metric_lines(
+        "rag_embedding_cache_size", "Entradas en el cache de vectores de consulta.", "gauge",
+        [({}, info.currsize)],
     )
 
-    # Paso de Generación (Generation)
-    response = llm.chat(messages=[{"role": "user", "content": augmented_prompt}])
+    stats = retriever.batcher.stats()
+    lines += metrics.simple_metric_lines(
+        "rag_embed_batch_queue_depth", "Consultas esperando al batcher de embeddings.", "gauge",
+        [({}, stats["queue_depth"])],
+    )
+    lines += metrics.bucket_histogram_lines(
+        "rag_embed_batch_size", "Tamaño de los lotes codificados.", stats["batch_size_histogram"],
+    )
+    lines += metrics.bucket_histogram_lines(
+        "rag_embed_batch_queue_depth_observed", "Profundidad de cola al armar cada lote.",
+        stats["queue_depth_histogram"],
+    )
 
-    # Estimación de tokens
-    tokens_used = len(augmented_prompt.split()) + len(response.split())
+    index = retriever.index_info()
+    lines += metrics.simple_metric_lines(
+        "rag_index_info", "Versión activa del índice en este worker.", "gauge",
+        [({"version": str(index["index_version"])}, 1)],
+    )
+    lines += metrics.simple_metric_lines(
+        "rag_index_swaps_total", "Cambios de versión del índice sin reiniciar el worker.", "counter",
+        [({}, index["index_swaps"])],
+    )
+    return lines
 
-    # DEVOLVEMOS LOS METADATOS DE CITACIÓN
-    return response, retrieved_texts, citation_metadata, tokens_used
-# -------------------------------
+
+metrics.REGISTRY.register_collector(_retriever_metrics)
 
 
 # RUTAS DE FLASK
@@ -109,44 +95,199 @@ def index():
 @app.route("/api/query", methods=["POST"])
 def api_query():
     """Ruta API para manejar la consulta RAG y devolver una respuesta JSON."""
+    metrics.IN_FLIGHT.inc()
+    start_time = time.time()
+    status = 500
+    try:
+        response, status = _api_query()
+        return response, status
+    finally:
+        _finish_request("/api/query", status, start_time)
+
+
+def _finish_request(endpoint: str, status: int, start_time: float):
+    metrics.IN_FLIGHT.dec()
+    metrics.REQUESTS.inc(endpoint, str(status))
+    metrics.REQUEST_LATENCY.observe(time.time() - start_time, endpoint)
+
+
+def _parse_search_options(data):
+    """
+    k, filtros, auto_filters y expand_tokens comunes a /api/query y /api/batch;
+    (opciones, error). `k` se acota a [1, MAX_K] y `expand_tokens` a
+    [0, MAX_EXPAND_TOKENS].
+    """
+    try:
+        k_int = min(max(1, int(data.get("k", 4))), MAX_K)
+    except (TypeError, ValueError):
+        return None, "El valor de 'k' debe ser un número entero."
+
+    # Filtros opcionales: {"doc_id": ..., "doc_type": ..., "title": ...,
+    # "vigencia_desde": "AAAA-MM-DD", "vigencia_hasta": ..., "vigente_en": ...}
+    try:
+        filters = SearchFilters.from_dict(data.get("filters"))
+    except ValueError as e:
+        return None, f"Filtros inválidos: {e}"
+
+    # Presupuesto de tokens para expandir los hits con sus chunks vecinos
+    # (sin el campo se usa CONTEXT_EXPAND_TOKENS; 0 desactiva la expansión)
+    expand_tokens = data.get("expand_tokens")
+    if expand_tokens is not None:
+        try:
+            expand_tokens = min(max(0, int(expand_tokens)), MAX_EXPAND_TOKENS)
+        except (TypeError, ValueError):
+            return None, "El valor de 'expand_tokens' debe ser un número entero."
+    return {
+        "k": k_int,
+        "filters": filters,
+        "auto_filters": bool(data.get("auto_filters", True)),
+        "expand_tokens": expand_tokens,
+    }, None
+
+
+def _result_metrics(rag_result, latency_ms: float) -> dict:
+    return {
+        "provider": rag_result.provider.upper(),
+        "k": len(rag_result.retrieved_texts),
+        "tokens_used": rag_result.tokens_used,
+        "latency_ms": f"{latency_ms:.2f}",
+        "stages": rag_result.stage_metrics(),
+        "trace_id": rag_result.trace_id,
+        "filters": rag_result.filters.to_dict(),
+        "filters_source": rag_result.filters_source,
+    }
+
+
+def _api_query():
     data = request.json
     query = data.get("query", "")
     provider = data.get("provider", "openrouter")
-    k = data.get("k", 4)
 
-    if not query:
+    if not isinstance(query, str) or not query:
         return jsonify({"error": "No se proporcionó la consulta."}), 400
+    if not isinstance(provider, str):
+        return jsonify({"error": "El valor de 'provider' debe ser un texto."}), 400
 
-    try:
-        k_int = int(k)
-    except ValueError:
-        return jsonify({"error": "El valor de 'k' debe ser un número entero."}), 400
+    options, error = _parse_search_options(data)
+    if error:
+        return jsonify({"error": error}), 400
 
     start_time = time.time()
-    
-    # Llama a la pipeline RAG duplicada en este mismo archivo
-    final_response, retrieved_texts, citations, tokens = rag_pipeline(
-        query=query, 
-        provider=provider, 
-        k=k_int
-    )
-    
+
+    rag_result = pipeline.run(query=query, provider=provider, **options)
+    metrics.observe_result(rag_result)
+
     end_time = time.time()
     latency_ms = (end_time - start_time) * 1000
-    
+
     # Prepara el resultado para la respuesta JSON
     result = {
-        "answer": final_response,
-        "citations": citations,
-        "metrics": {
-            "provider": provider.upper(),
-            "k": len(retrieved_texts),
-            "tokens_used": tokens,
-            "latency_ms": f"{latency_ms:.2f}"
-        }
+        "answer": rag_result.answer,
+        "citations": rag_result.citations,
+        "metrics": _result_metrics(rag_result, latency_ms),
     }
-    
-    return jsonify(result)
+
+    response = jsonify(result)
+    if rag_result.trace_id:
+        response.headers["X-Trace-Id"] = rag_result.trace_id
+    return response, 200
+
+
+@app.route("/api/batch", methods=["POST"])
+def api_batch():
+    """
+    Muchas preguntas en un request: {"queries": [...], "provider", "k",
+    "filters", "auto_filters", "max_concurrency"}. Responde NDJSON, una línea
+    por pregunta apenas termina (con su "index" en la lista original) y una
+    línea final {"done": true, ...}.
+    """
+    metrics.IN_FLIGHT.inc()
+    start_time = time.time()
+    status = 500
+    try:
+        response, status = _api_batch(start_time)
+        return response, status
+    finally:
+        # Con 200 la respuesta recién empieza: se cierra al terminar el stream
+        if status != 200:
+            _finish_request("/api/batch", status, start_time)
+
+
+def _api_batch(start_time: float):
+    data = request.json or {}
+    queries = data.get("queries")
+    provider = data.get("provider", "openrouter")
+
+    if not isinstance(provider, str):
+        return jsonify({"error": "El valor de 'provider' debe ser un texto."}), 400
+    if not isinstance(queries, list) or not queries:
+        return jsonify({"error": "'queries' debe ser una lista no vacía de preguntas."}), 400
+    if not all(isinstance(q, str) and q.strip() for q in queries):
+        return jsonify({"error": "Cada elemento de 'queries' debe ser una pregunta no vacía."}), 400
+    if len(queries) > BATCH_MAX_QUERIES:
+        return jsonify({"error": f"Se aceptan hasta {BATCH_MAX_QUERIES} preguntas por request."}), 400
+
+    options, error = _parse_search_options(data)
+    if error:
+        return jsonify({"error": error}), 400
+    try:
+        max_concurrency = min(int(data.get("max_concurrency", BATCH_MAX_CONCURRENCY)), BATCH_MAX_CONCURRENCY)
+    except (TypeError, ValueError):
+        return jsonify({"error": "El valor de 'max_concurrency' debe ser un número entero."}), 400
+
+    # Embeddings y búsqueda del lote completo ocurren aquí (un error es un 500
+    # normal); las generaciones se consumen mientras se envía la respuesta
+    items = pipeline.run_batch(queries, provider=provider, max_concurrency=max_concurrency, **options)
+
+    def stream():
+        unique = errors = 0
+        for item in items:
+            unique += 1
+            if item.error:
+                errors += 1
+                lines = [{"index": i, "query": queries[i], "error": item.error} for i in item.indices]
+            else:
+                metrics.observe_result(item.result)
+                lines = [
+                    {
+                        "index": i,
+                        "query": queries[i],
+                        "answer": item.result.answer,
+                        "citations": item.result.citations,
+                        "metrics": _result_metrics(item.result, item.result.latency_ms),
+                    }
+                    for i in item.indices
+                ]
+            for line in lines:
+                yield json.dumps(line, ensure_ascii=False) + "\n"
+        yield json.dumps({
+            "done": True,
+            "total": len(queries),
+            "unique": unique,
+            "errors": errors,
+            "latency_ms": f"{(time.time() - start_time) * 1000:.2f}",
+        }) + "\n"
+
+    response = Response(stream(), mimetype="application/x-ndjson")
+    # Se llama también si el cliente se desconecta: deja de lanzar generaciones
+    response.call_on_close(items.close)
+    response.call_on_close(lambda: _finish_request("/api/batch", 200, start_time))
+    return response, 200
+
+
+@app.route("/metrics", methods=["GET"])
+def metrics_endpoint():
+    """Métricas en formato de texto de Prometheus."""
+    return Response(metrics.REGISTRY.render(), mimetype="text/plain; version=0.0.4")
+
+
+@app.route("/healthz", methods=["GET"])
+def healthz():
+    """Readiness: el modelo está cargado y la colección de Qdrant responde."""
+    status = retriever.health()
+    ready = status["model_loaded"] and status["collection_reachable"]
+    status["status"] = "ok" if ready else "unavailable"
+    return jsonify(status), 200 if ready else 503
 
 if __name__ == "__main__":
     # Configuración para Docker - escuchar en todas las interfaces
@@ -0,0 +1,92 @@
+# gunicorn.conf.py
+"""
+Configuración de Gunicorn para servir flask_app con varios workers.
+
+El modelo y los datos de solo lectura se cargan en el maestro (preload_app) y se
+comparten copy-on-write con los workers. Variables de entorno:
+
+    GUNICORN_BIND            Dirección de escucha (por defecto 0.0.0.0:5000)
+    GUNICORN_WORKERS         Número de procesos worker (por defecto 2)
+    GUNICORN_THREADS         Hilos por worker (por defecto 4)
+    GUNICORN_TIMEOUT         Timeout de un request en segundos (por defecto 120)
+    GUNICORN_GRACEFUL_TIMEOUT  Segundos para terminar requests en curso al recargar (por defecto 30)
+    TORCH_NUM_THREADS        Hilos intra-op de torch por worker (por defecto: sin cambio)
+    METRICS_DIR              Directorio donde cada worker vuelca sus métricas para que
+                             /metrics sume todos los workers (por defecto, uno temporal
+                             nuevo por maestro; si se define, se vacía al arrancar)
+
+Recarga sin cortar conexiones: `kill -HUP <pid_maestro>` levanta workers nuevos a
+partir del maestro ya cargado y apaga los antiguos cuando terminan sus requests.
+Como el maestro conserva el modelo precargado, HUP NO relee código ni modelo;
+para eso use `kill -USR2 <pid_maestro>` (nuevo maestro) seguido de `kill -WINCH`
+y `kill -QUIT` sobre el maestro antiguo.
+"""
+import gc
+import os
+import tempfile
+
+bind = os.environ.get("GUNICORN_BIND", "0.0.0.0:5000")
+workers = int(os.environ.get("GUNICORN_WORKERS", 2))
+threads = int(os.environ.get("GUNICORN_THREADS", 4))
+worker_class = "gthread"
+timeout = int(os.environ.get("GUNICORN_TIMEOUT", 120))
+graceful_timeout = int(os.environ.get("GUNICORN_GRACEFUL_TIMEOUT", 30))
+
+# Carga la app (modelo + índice) una sola vez en el maestro
+preload_app = True
+
+# Debe definirse antes de que preload_app importe rag.metrics
+if not os.environ.get("METRICS_DIR"):
+    os.environ["METRICS_DIR"] = tempfile.mkdtemp(prefix="rag_metrics_")
+
+accesslog = "-"
+errorlog = "-"
+
+_gc_frozen = False
+
+
+def on_starting(server):
+    """Descarta las métricas de workers de una ejecución anterior."""
+    from rag.metrics import REGISTRY
+    REGISTRY.clear_directory()
+
+
+def pre_fork(server, worker):
+    """
+    Congela los objetos del maestro antes del primer fork.
+
+    El GC de CPython escribe en la cabecera de cada objeto que recorre; sin
+    gc.freeze() una colección en el worker ensucia las páginas heredadas y el
+    copy-on-write termina duplicando el modelo en cada proceso.
+    """
+    global _gc_frozen
+    if not _gc_frozen:
+        gc.collect()
+        gc.freeze()
+        _gc_frozen = True
+
+
+def post_fork(server, worker):
+    """
+    Ajusta los hilos de torch por worker para no sobrecargar la CPU.
+
+    Las conexiones a Qdrant no se heredan: QdrantRetriever.qdrant_client detecta
+    el cambio de PID y abre un cliente propio en el worker en su primer uso.
+    """
+    torch_threads = os.environ.get("TORCH_NUM_THREADS")
+    if torch_threads:
+        import torch
+        torch.set_num_threads(int(torch_threads))
+    server.log.info(f"Worker {worker.pid} listo (modelo compartido desde el maestro)")
+
+
+def worker_exit(server, worker):
+    """Vuelca las últimas métricas del worker antes de que termine."""
+    from rag.metrics import REGISTRY
+    REGISTRY.flush()
+
+
+def child_exit(server, worker):
+    """En el maestro: conserva los contadores del worker terminado y descarta sus gauges."""
+    from rag.metrics import REGISTRY
+    REGISTRY.mark_process_dead(worker.pid)
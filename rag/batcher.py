@@ -0,0 +1,164 @@
+# batcher.py
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import Dict, List, Optional, Sequence
+
+
+def _bucket_index(bounds: Sequence[float], value: float) -> int:
+    """Devuelve el índice del primer bucket cuyo límite superior es >= value."""
+    for i, bound in enumerate(bounds):
+        if value <= bound:
+            return i
+    return len(bounds)
+
+
+class EmbeddingBatcher:
+    """
+    Agrupa consultas concurrentes para codificarlas en un solo llamado a
+    `SentenceTransformer.encode`.
+
+    Cada hilo que llama a `encode()` deja su texto en una cola y espera un
+    Future. Un hilo de fondo toma lo que llegue durante a lo más `max_wait_ms`
+    desde el primer texto (o hasta juntar `max_batch_size` textos), codifica el
+    lote completo y resuelve el Future de cada llamador. Una consulta sola paga
+    esa espera; `max_wait_ms=0` despacha lo que haya en la cola sin esperar.
+
+    El hilo de fondo se inicia de forma perezosa en el primer `encode()` y se
+    vuelve a crear si el proceso cambió de PID (p. ej. después de un fork de
+    Gunicorn), porque los hilos no sobreviven a un fork.
+    """
+
+    QUEUE_DEPTH_BUCKETS = (0, 1, 2, 4, 8, 16, 32, 64, 128)
+    BATCH_SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128)
+
+    def __init__(self, model, max_wait_ms: Optional[float] = None, max_batch_size: Optional[int] = None):
+        """
+        Args:
+            model: Modelo con método `encode(list[str], ...)` (SentenceTransformer).
+            max_wait_ms: Tiempo máximo que espera el primer texto de un lote
+                antes de codificarlo. Por defecto `EMBED_BATCH_MAX_WAIT_MS` o 5 ms.
+            max_batch_size: Tamaño máximo del lote. Por defecto
+                `EMBED_BATCH_MAX_SIZE` o 32.
+        """
+        if max_wait_ms is None:
+            max_wait_ms = float(os.environ.get("EMBED_BATCH_MAX_WAIT_MS", 5))
+        if max_batch_size is None:
+            max_batch_size = int(os.environ.get("EMBED_BATCH_MAX_SIZE", 32))
+        if max_batch_size < 1:
+            raise ValueError("max_batch_size debe ser >= 1")
+
+        self.model = model
+        self.max_wait_s = max(0.0, max_wait_ms) / 1000.0
+        self.max_batch_size = max_batch_size
+
+        self._queue: "queue.Queue" = queue.Queue()
+        self._thread: Optional[threading.Thread] = None
+        self._pid: Optional[int] = None
+        self._start_lock = threading.Lock()
+
+        # Histogramas (solo los escribe el hilo de fondo)
+        self._queue_depth_counts = [0] * (len(self.QUEUE_DEPTH_BUCKETS) + 1)
+        self._batch_size_counts = [0] * (len(self.BATCH_SIZE_BUCKETS) + 1)
+        self._batches = 0
+        self._items = 0
+
+    # -------------------------------
+    # API pública
+    # -------------------------------
+    def submit(self, text: str) -> Future:
+        """Encola un texto y devuelve un Future que se resuelve con su vector (np.ndarray)."""
+        self._ensure_started()
+        future: Future = Future()
+        self._queue.put((text, future))
+        return future
+
+    def encode(self, text: str, timeout: Optional[float] = None):
+        """Codifica un texto esperando su turno en el lote actual."""
+        return self.submit(text).result(timeout=timeout)
+
+    def stats(self) -> Dict[str, object]:
+        """Devuelve los contadores y histogramas acumulados del batcher."""
+        return {
+            "batches": self._batches,
+            "items": self._items,
+            "queue_depth": self._queue.qsize(),
+            "queue_depth_histogram": dict(zip(
+                [str(b) for b in self.QUEUE_DEPTH_BUCKETS] + ["+Inf"],
+                list(self._queue_depth_counts),
+            )),
+            "batch_size_histogram": dict(zip(
+                [str(b) for b in self.BATCH_SIZE_BUCKETS] + ["+Inf"],
+                list(self._batch_size_counts),
+            )),
+        }
+
+    # -------------------------------
+    # Hilo de fondo
+    # -------------------------------
+    def _ensure_started(self):
+        pid = os.getpid()
+        if self._thread is not None and self._pid == pid:
+            return
+        with self._start_lock:
+            if self._thread is not None and self._pid == pid:
+                return
+            if self._pid is not None and self._pid != pid:
+                # Proceso hijo de un fork: la cola heredada puede tener un lock tomado
+                self._queue = queue.Queue()
+            self._pid = pid
+            self._thread = threading.Thread(target=self._run, name="embedding-batcher", daemon=True)
+            self._thread.start()
+
+    def _collect(self) -> List[tuple]:
+        """
+        Bloquea hasta tener al menos un texto y sigue juntando hasta
+        `max_wait_s` después del primero o hasta `max_batch_size` textos.
+        """
+        batch = [self._queue.get()]
+        # Profundidad de cola vista al armar el lote (sin contar el primero)
+        self._queue_depth_counts[_bucket_index(self.QUEUE_DEPTH_BUCKETS, self._queue.qsize())] += 1
+
+        deadline = time.monotonic() + self.max_wait_s
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                if remaining <= 0:
+                    # Plazo cumplido: se suma solo lo que ya está en la cola
+                    batch.append(self._queue.get_nowait())
+                else:
+                    batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            # Descarta los Futures cancelados por el llamador antes de codificar
+            pending = [(t, f) for t, f in batch if f.set_running_or_notify_cancel()]
+            if not pending:
+                continue
+            texts = [t for t, _ in pending]
+            futures = [f for _, f in pending]
+
+            self._batches += 1
+            self._items += len(texts)
+            self._batch_size_counts[_bucket_index(self.BATCH_SIZE_BUCKETS, len(texts))] += 1
+
+            try:
+                vectors = self.model.encode(
+                    texts,
+                    convert_to_numpy=True,
+                    batch_size=len(texts),
+                    show_progress_bar=False,
+                )
+            except Exception as e:
+                for f in futures:
+                    f.set_exception(e)
+                continue
+
+            for f, vector in zip(futures, vectors):
+                f.set_result(vector)
@@ -0,0 +1,162 @@
+# compact.py
+import json
+import os
+from pathlib import Path
+from typing import Optional, Tuple
+
+import faiss
+import numpy as np
+
+# Formatos de almacenamiento de embeddings
+#   float32: IndexFlatIP (4 bytes por dimensión, todo en RAM)
+#   int8:    IndexScalarQuantizer QT_8bit, rango aprendido por dimensión (1 byte)
+#   binary:  un bit por dimensión (signo respecto de la media), distancia de Hamming
+STORAGE_TYPES = ("float32", "int8", "binary")
+
+MANIFEST = "compact.json"
+VECTORS_FILE = "vectors.f32.npy"
+
+# Candidatos por resultado que se re-puntúan con los vectores float32. Los
+# códigos binarios ordenan peor que int8, por eso necesitan más candidatos.
+DEFAULT_RESCORE_FACTOR = {"int8": 4, "binary": 10}
+
+
+def rescore_factor_for(storage: str) -> int:
+    """Factor de re-puntuación: FAISS_RESCORE_FACTOR o el valor por defecto del formato."""
+    return int(os.environ.get("FAISS_RESCORE_FACTOR", DEFAULT_RESCORE_FACTOR[storage]))
+
+
+def _normalized(x: np.ndarray) -> np.ndarray:
+    x = np.ascontiguousarray(x, dtype=np.float32).copy()
+    faiss.normalize_L2(x)
+    return x
+
+
+class CompactIndex:
+    """
+    Índice de embeddings comprimidos (int8 o binario) con re-puntuación exacta.
+
+    Solo los códigos quedan en RAM. Los vectores float32 van a un archivo .npy
+    que se abre con memmap: el sistema operativo carga las páginas de los
+    candidatos que se re-puntúan (k * factor por consulta), no la matriz
+    entera. Expone `ntotal`, `metric_type` y `search(q, k, params)` como un
+    índice FAISS de producto interno, así FAISSRetriever lo usa sin cambios.
+    """
+
+    metric_type = faiss.METRIC_INNER_PRODUCT
+
+    def __init__(self, storage: str, codes_index, vectors: Optional[np.ndarray] = None,
+                 thresholds: Optional[np.ndarray] = None, rescore_factor: Optional[int] = None):
+        if storage not in ("int8", "binary"):
+            raise ValueError(f"Almacenamiento comprimido no soportado: {storage}")
+        self.storage = storage
+        self.codes_index = codes_index
+        self.vectors = vectors
+        self.thresholds = thresholds
+        if vectors is None:
+            self.rescore_factor = 1
+        else:
+            self.rescore_factor = rescore_factor or rescore_factor_for(storage)
+
+    @classmethod
+    def build(cls, embeddings: np.ndarray, storage: str, vectors_path: Optional[Path] = None,
+              rescore_factor: Optional[int] = None) -> "CompactIndex":
+        """
+        Comprime `embeddings` (se normalizan, como FlatIP). Si se indica
+        `vectors_path`, los float32 se escriben ahí y se reabren con memmap
+        para la re-puntuación; sin ruta no se re-puntúa.
+        """
+        x = _normalized(embeddings)
+        d = x.shape[1]
+        thresholds = None
+        if storage == "int8":
+            index = faiss.IndexScalarQuantizer(d, faiss.ScalarQuantizer.QT_8bit, faiss.METRIC_INNER_PRODUCT)
+            index.train(x)
+            index.add(x)
+        elif storage == "binary":
+            # Umbral por dimensión = media del corpus: bits más balanceados que el signo crudo
+            thresholds = x.mean(axis=0)
+            index = faiss.IndexBinaryFlat(d + (-d % 8))
+            index.add(cls._binary_codes(x, thresholds))
+        else:
+            raise ValueError(f"Almacenamiento comprimido no soportado: {storage}")
+
+        vectors = None
+        if vectors_path is not None:
+            np.save(vectors_path, x)
+            vectors = np.load(vectors_path, mmap_mode="r")
+        return cls(storage, index, vectors, thresholds, rescore_factor)
+
+    @staticmethod
+    def _binary_codes(x: np.ndarray, thresholds: np.ndarray) -> np.ndarray:
+        return np.packbits(x > thresholds, axis=1)
+
+    @property
+    def ntotal(self) -> int:
+        return self.codes_index.ntotal
+
+    @property
+    def nbytes(self) -> int:
+        """Bytes en RAM de los códigos (sin los float32 mapeados en disco)."""
+        if self.storage == "binary":
+            return int(faiss.serialize_index_binary(self.codes_index).size)
+        return int(faiss.serialize_index(self.codes_index).size)
+
+    def search(self, queries: np.ndarray, k: int, params=None) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Busca los k vecinos de `queries` (normalizadas). Devuelve (scores, ids)
+        con similitud coseno exacta si hay vectores float32, o aproximada si no.
+        """
+        q = np.ascontiguousarray(queries, dtype=np.float32)
+        n_candidates = min(self.ntotal, k * self.rescore_factor)
+        if self.storage == "binary":
+            dist, ids = self.codes_index.search(self._binary_codes(q, self.thresholds), n_candidates, params=params)
+            # Hamming: menos bits distintos = más parecido
+            scores = -dist.astype(np.float32)
+        else:
+            scores, ids = self.codes_index.search(q, n_candidates, params=params)
+
+        if self.vectors is None or self.rescore_factor <= 1:
+            return scores[:, :k], ids[:, :k]
+
+        out_scores = np.full((len(q), k), -np.inf, dtype=np.float32)
+        out_ids = np.full((len(q), k), -1, dtype=np.int64)
+        for row, (qv, cand) in enumerate(zip(q, ids)):
+            cand = np.sort(cand[cand >= 0])  # orden de disco: lecturas secuenciales del memmap
+            if not len(cand):
+                continue
+            exact = np.asarray(self.vectors[cand]) @ qv
+            top = np.argsort(-exact, kind="stable")[:k]
+            out_scores[row, :len(top)] = exact[top]
+            out_ids[row, :len(top)] = cand[top]
+        return out_scores, out_ids
+
+    def save(self, directory: Path):
+        """Guarda códigos y manifiesto en `directory` (los float32 ya están en VECTORS_FILE)."""
+        directory = Path(directory)
+        if self.storage == "binary":
+            faiss.write_index_binary(self.codes_index, str(directory / "codes.bin"))
+            np.save(directory / "thresholds.npy", self.thresholds)
+        else:
+            faiss.write_index(self.codes_index, str(directory / "codes.faiss"))
+        manifest = {"storage": self.storage, "ntotal": self.ntotal, "rescore": self.vectors is not None}
+        (directory / MANIFEST).write_text(json.dumps(manifest), encoding="utf-8")
+
+    @classmethod
+    def load(cls, directory: Path, rescore_factor: Optional[int] = None) -> Optional["CompactIndex"]:
+        """Carga un índice guardado con `save` (None si `directory` no tiene manifiesto)."""
+        directory = Path(directory)
+        manifest_path = directory / MANIFEST
+        if not manifest_path.exists():
+            return None
+        manifest = json.loads(manifest_path.read_text(encoding="utf-8"))
+        thresholds = None
+        if manifest["storage"] == "binary":
+            index = faiss.read_index_binary(str(directory / "codes.bin"))
+            thresholds = np.load(directory / "thresholds.npy")
+        else:
+            index = faiss.read_index(str(directory / "codes.faiss"))
+        vectors = None
+        if manifest.get("rescore") and (directory / VECTORS_FILE).exists():
+            vectors = np.load(directory / VECTORS_FILE, mmap_mode="r")
+        return cls(manifest["storage"], index, vectors, thresholds, rescore_factor)
@@ -0,0 +1,25 @@
+# corpus.py
+import hashlib
+from pathlib import Path
+
+
+def corpus_version(raw_dir: Path = Path("data/raw"), sources_path: Path = Path("data/sources.csv")) -> str:
+    """
+    Huella del corpus: contenido de los documentos en `raw_dir` y de sources.csv.
+
+    Sirve como parte de la llave de los caches que dependen de lo indexado
+    (evaluación, resultados de búsqueda): si cambia un documento o sus
+    metadatos, la huella cambia y las entradas antiguas dejan de coincidir.
+    """
+    h = hashlib.sha256()
+    raw_dir = Path(raw_dir)
+    if raw_dir.exists():
+        for fp in sorted(p for p in raw_dir.iterdir() if p.is_file()):
+            h.update(fp.name.encode("utf-8"))
+            with fp.open("rb") as f:
+                for block in iter(lambda: f.read(1 << 20), b""):
+                    h.update(block)
+    sources_path = Path(sources_path)
+    if sources_path.exists():
+        h.update(sources_path.read_bytes())
+    return h.hexdigest()[:16]
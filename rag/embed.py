@@ -4,10 +4,17 @@ from pathlib import Path
 from sentence_transformers import SentenceTransformer
 import faiss
 import json
+import hashlib
 from typing import List, Dict, Tuple
 import time
 import logging
 
+from rag.compact import STORAGE_TYPES, VECTORS_FILE, CompactIndex
+from rag.filters import filter_fields
+from rag.neighbors import link_neighbors
+from rag.routing import DocumentRouter, build_centroids
+from rag.versioning import new_version, prune_index_dirs, publish_index_dir, version_dir
+
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
@@ -110,10 +117,14 @@ class FAISSIndexBuilder:
         logger.info(f"Índice guardado en: {index_path}")
         
         if metadata is not None:
-            metadata_path = index_path.parent / "metadata.json"
-            with open(metadata_path, 'w', encoding='utf-8') as f:
-                json.dump(metadata, f, ensure_ascii=False, indent=2)
-            logger.info(f"Metadatos guardados en: {metadata_path}")
+            save_metadata(index_path.parent, metadata)
+
+def save_metadata(output_dir: Path, metadata: List[Dict]):
+    """Guarda los metadatos de los chunks (metadata.json) junto al índice"""
+    metadata_path = output_dir / "metadata.json"
+    with open(metadata_path, 'w', encoding='utf-8') as f:
+        json.dump(metadata, f, ensure_ascii=False, indent=2)
+    logger.info(f"Metadatos guardados en: {metadata_path}")
 
 def load_chunks_data(chunks_path: Path) -> Tuple[List[str], List[Dict]]:
     """
@@ -136,15 +147,22 @@ def load_chunks_data(chunks_path: Path) -> Tuple[List[str], List[Dict]]:
     
     metadata = []
     for _, row in df.iterrows():
-        metadata.append({
+        entry = {
             'chunk_id': row['chunk_id'],
             'doc_id': row['doc_id'],
             'title': row['title'],
-            'page': row['page'],
+            'page': int(row['page']),
             'url': row['url'],
             'vigencia': row['vigencia'],
-            'filename': row['filename']
-        })
+            'filename': row['filename'],
+            # FAISSRetriever (rag/retrieve.py) devuelve el texto desde los metadatos
+            'text': row['text'],
+        }
+        # Campos para filtrar por tipo de documento y vigencia
+        entry.update(filter_fields(entry))
+        metadata.append(entry)
+    # prev/next chunk_id por documento para la expansión de contexto
+    link_neighbors(metadata)
     
     logger.info(f"Cargados {len(texts)} chunks con sus metadatos")
     return texts, metadata
@@ -162,22 +180,47 @@ def main():
     parser.add_argument('--index-type', type=str, default='FlatL2',
                        choices=['FlatL2', 'FlatIP'],
                        help='Tipo de índice FAISS a construir')
+    parser.add_argument('--storage', type=str, default='float32', choices=list(STORAGE_TYPES),
+                       help='Formato de los embeddings: float32, int8 o binary (con re-puntuación float32 desde disco)')
+    parser.add_argument('--keep', type=int, default=2,
+                       help='Versiones del índice a conservar en output-dir/versions')
     
     args = parser.parse_args()
     
-    args.output_dir.mkdir(parents=True, exist_ok=True)
-    
     try:
         texts, metadata = load_chunks_data(args.chunks_path)
         
+        # Cada ejecución escribe una versión nueva (versions/<versión>) y al final
+        # mueve el symlink output-dir/current: FAISSRetriever cambia sin reiniciar
+        fingerprint = hashlib.sha256(args.chunks_path.read_bytes()).hexdigest()[:16]
+        out_dir = version_dir(args.output_dir, new_version(fingerprint))
+        out_dir.mkdir(parents=True, exist_ok=True)
+        
         embedder = EmbeddingGenerator(args.model_name)
         embeddings = embedder.generate_embeddings(texts)
         
-        index_builder = FAISSIndexBuilder(embeddings.shape[1])
-        index = index_builder.build_index(embeddings, args.index_type)
-        
-        index_path = args.output_dir / "index.faiss"
-        index_builder.save_index(index_path, metadata)
+        if args.storage == "float32":
+            index_builder = FAISSIndexBuilder(embeddings.shape[1])
+            index = index_builder.build_index(embeddings, args.index_type)
+            
+            index_path = out_dir / "index.faiss"
+            index_builder.save_index(index_path, metadata)
+        else:
+            # Códigos int8/binarios en RAM; los float32 quedan en disco para re-puntuar (memmap)
+            compact = CompactIndex.build(embeddings, args.storage, out_dir / VECTORS_FILE)
+            compact.save(out_dir)
+            save_metadata(out_dir, metadata)
+            logger.info(f"Índice {args.storage} guardado ({compact.nbytes / 1024:.1f} KB en RAM)")
+
+        # Centroides por documento/sección para el ruteo de dos etapas (rag/routing.py)
+        centroids, labels = build_centroids(metadata, embeddings)
+        DocumentRouter(centroids, labels).save(out_dir / "routing")
+        logger.info(f"Router guardado con {len(labels)} centroides")
+
+        publish_index_dir(args.output_dir, out_dir)
+        logger.info(f"Versión publicada: {args.output_dir / 'current'} -> {out_dir}")
+        for old in prune_index_dirs(args.output_dir, keep=args.keep):
+            logger.info(f"Versión antigua eliminada: {old}")
         
         logger.info("Proceso H3 (Embeddings & FAISS) completado exitosamente")
         
@@ -0,0 +1,304 @@
+# filters.py
+import re
+from dataclasses import dataclass
+from datetime import date
+from typing import Any, Dict, Iterable, Optional, Tuple
+
+import numpy as np
+
+# Las fechas de vigencia se guardan como enteros AAAAMMDD: Qdrant los indexa
+# como INTEGER y los rangos se comparan sin parsear fechas en cada consulta.
+# Un documento sin fecha de inicio o de término queda abierto por ese lado.
+VIGENCIA_MIN = 0
+VIGENCIA_MAX = 99991231
+
+MONTHS = {
+    "enero": 1, "febrero": 2, "marzo": 3, "abril": 4, "mayo": 5, "junio": 6,
+    "julio": 7, "agosto": 8, "septiembre": 9, "setiembre": 9, "octubre": 10,
+    "noviembre": 11, "diciembre": 12,
+}
+
+# Tipo de documento según palabras del título (la primera regla que calza gana)
+DOC_TYPE_RULES = (
+    ("calendario", ("calendario",)),
+    ("reglamento", ("reglamento",)),
+    ("politica", ("política", "politica")),
+    ("resolucion", ("resolución", "resolucion", "res-ex", "res. ex")),
+)
+DEFAULT_DOC_TYPE = "otro"
+
+_YEAR = r"(19\d{2}|20\d{2})"
+_MONTH = "(" + "|".join(MONTHS) + ")"
+_RANGE_RE = re.compile(_YEAR + r"\s*[-–/]\s*" + _YEAR)
+_DESDE_RE = re.compile(r"(?:desde|a partir de)\s+(?:el\s+)?(?:\d{1,2}\s+de\s+)?(?:" + _MONTH + r"\s+(?:de(?:l)?\s+)?)?" + _YEAR)
+_HASTA_RE = re.compile(r"hasta\s+(?:el\s+)?(?:\d{1,2}\s+de\s+)?(?:" + _MONTH + r"\s+(?:de(?:l)?\s+)?)?" + _YEAR)
+_MONTH_YEAR_RE = re.compile(_MONTH + r"\s+(?:de(?:l)?\s+)?" + _YEAR)
+_YEAR_RE = re.compile(r"\b" + _YEAR + r"\b")
+
+
+def date_to_int(d: date) -> int:
+    return d.year * 10000 + d.month * 100 + d.day
+
+
+def _month_start(year: str, month: Optional[str]) -> int:
+    return int(year) * 10000 + MONTHS.get(month or "enero", 1) * 100 + 1
+
+
+def _month_end(year: str, month: Optional[str]) -> int:
+    # Día 31 para cualquier mes: solo se usa como cota superior de un rango
+    return int(year) * 10000 + MONTHS.get(month or "diciembre", 12) * 100 + 31
+
+
+def parse_vigencia(text: Optional[str]) -> Tuple[int, int]:
+    """
+    Convierte la columna `vigencia` de sources.csv en (desde, hasta) AAAAMMDD.
+
+    Formatos reconocidos: "Desde mayo de 2023", "2025-2030", "Año académico 2025",
+    "Noviembre 2024" (fecha de emisión: vigente desde ese mes) y "hasta ... AAAA".
+    Lo que no se reconoce queda abierto (VIGENCIA_MIN, VIGENCIA_MAX), de modo
+    que un filtro por fecha nunca descarta documentos sin vigencia declarada.
+    """
+    txt = (text or "").strip().lower()
+    desde, hasta = VIGENCIA_MIN, VIGENCIA_MAX
+    if not txt:
+        return desde, hasta
+
+    m = _RANGE_RE.search(txt)
+    if m:
+        return _month_start(m.group(1), None), _month_end(m.group(2), None)
+
+    m_desde = _DESDE_RE.search(txt)
+    m_hasta = _HASTA_RE.search(txt)
+    if m_desde:
+        desde = _month_start(m_desde.group(2), m_desde.group(1))
+    if m_hasta:
+        hasta = _month_end(m_hasta.group(2), m_hasta.group(1))
+    if m_desde or m_hasta:
+        return desde, hasta
+
+    m = _MONTH_YEAR_RE.search(txt)
+    if m:
+        return _month_start(m.group(2), m.group(1)), VIGENCIA_MAX
+
+    m = _YEAR_RE.search(txt)
+    if m:
+        return _month_start(m.group(1), None), _month_end(m.group(1), None)
+    return desde, hasta
+
+
+def doc_type_of(title: Optional[str], doc_id: Optional[str] = None) -> str:
+    """Clasifica el documento (reglamento, calendario, política...) por su título."""
+    haystack = f"{title or ''} {doc_id or ''}".lower()
+    for doc_type, keywords in DOC_TYPE_RULES:
+        if any(kw in haystack for kw in keywords):
+            return doc_type
+    return DEFAULT_DOC_TYPE
+
+
+def filter_fields(record: Dict[str, Any]) -> Dict[str, Any]:
+    """Campos derivados que se indexan en el payload para filtrar búsquedas."""
+    desde, hasta = parse_vigencia(record.get("vigencia"))
+    return {
+        "doc_type": doc_type_of(record.get("title"), record.get("doc_id")),
+        "vigencia_desde": desde,
+        "vigencia_hasta": hasta,
+    }
+
+
+def filter_columns(rows: Iterable[Dict[str, Any]]) -> Dict[str, np.ndarray]:
+    """
+    Columnas numpy para `SearchFilters.mask`, una fila por chunk. Los registros
+    sin campos derivados (índices anteriores a los filtros) se completan aquí.
+    """
+    rows = [
+        {**r, **{key: value for key, value in filter_fields(r).items() if r.get(key) is None}}
+        for r in rows
+    ]
+    return {
+        "doc_id": np.array([r.get("doc_id") or "" for r in rows], dtype=str),
+        "doc_type": np.array([r["doc_type"] for r in rows], dtype=str),
+        "title_lower": np.array([(r.get("title") or "").lower() for r in rows], dtype=str),
+        "vigencia_desde": np.array([r["vigencia_desde"] for r in rows], dtype=np.int64),
+        "vigencia_hasta": np.array([r["vigencia_hasta"] for r in rows], dtype=np.int64),
+    }
+
+
+def _as_tuple(value) -> Tuple[str, ...]:
+    if value is None or value == "":
+        return ()
+    if isinstance(value, str):
+        return (value,)
+    if isinstance(value, (list, tuple)) and all(isinstance(v, str) for v in value):
+        return tuple(value)
+    raise ValueError(f"Se esperaba un texto o una lista de textos: {value!r}")
+
+
+def _as_date(value) -> Optional[date]:
+    if value is None or value == "":
+        return None
+    if isinstance(value, date):
+        return value
+    try:
+        return date.fromisoformat(str(value))
+    except ValueError:
+        raise ValueError(f"Fecha inválida (se espera AAAA-MM-DD): {value!r}")
+
+
+@dataclass(frozen=True)
+class SearchFilters:
+    """
+    Restricciones de una búsqueda: documentos, tipos, título y vigencia.
+
+    `vigencia_desde` / `vigencia_hasta` describen el período consultado: se
+    aceptan los documentos cuya vigencia se superpone con él. Es inmutable y
+    hashable para poder usarse como llave de cache.
+    """
+    doc_ids: Tuple[str, ...] = ()
+    doc_types: Tuple[str, ...] = ()
+    title: Optional[str] = None
+    vigencia_desde: Optional[date] = None
+    vigencia_hasta: Optional[date] = None
+
+    @classmethod
+    def from_dict(cls, data: Optional[Dict[str, Any]]) -> "SearchFilters":
+        """
+        Construye los filtros desde el JSON de la API. Claves aceptadas:
+        doc_id, doc_type (texto o lista), title, vigencia_desde, vigencia_hasta
+        y vigente_en (atajo para un solo día). Lanza ValueError si algo no calza.
+        """
+        if not data:
+            return cls()
+        if not isinstance(data, dict):
+            raise ValueError("'filters' debe ser un objeto JSON.")
+        unknown = set(data) - {"doc_id", "doc_type", "title", "vigencia_desde", "vigencia_hasta", "vigente_en"}
+        if unknown:
+            raise ValueError(f"Filtros desconocidos: {', '.join(sorted(unknown))}")
+
+        desde = _as_date(data.get("vigencia_desde"))
+        hasta = _as_date(data.get("vigencia_hasta"))
+        vigente_en = _as_date(data.get("vigente_en"))
+        if vigente_en is not None:
+            desde = hasta = vigente_en
+        if desde and hasta and desde > hasta:
+            raise ValueError("'vigencia_desde' es posterior a 'vigencia_hasta'.")
+
+        title = data.get("title")
+        if title is not None and not isinstance(title, str):
+            raise ValueError("'title' debe ser un texto.")
+        return cls(
+            doc_ids=_as_tuple(data.get("doc_id")),
+            doc_types=_as_tuple(data.get("doc_type")),
+            title=title.strip() or None if title else None,
+            vigencia_desde=desde,
+            vigencia_hasta=hasta,
+        )
+
+    def is_empty(self) -> bool:
+        return not (self.doc_ids or self.doc_types or self.title
+                    or self.vigencia_desde or self.vigencia_hasta)
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Representación JSON (solo los filtros activos)."""
+        out: Dict[str, Any] = {}
+        if self.doc_ids:
+            out["doc_id"] = list(self.doc_ids)
+        if self.doc_types:
+            out["doc_type"] = list(self.doc_types)
+        if self.title:
+            out["title"] = self.title
+        if self.vigencia_desde:
+            out["vigencia_desde"] = self.vigencia_desde.isoformat()
+        if self.vigencia_hasta:
+            out["vigencia_hasta"] = self.vigencia_hasta.isoformat()
+        return out
+
+    def to_qdrant(self):
+        """Filtro de Qdrant sobre los campos indexados del payload (None si no hay filtros)."""
+        if self.is_empty():
+            return None
+        from qdrant_client import models
+
+        must = []
+        if self.doc_ids:
+            must.append(models.FieldCondition(key="doc_id", match=models.MatchAny(any=list(self.doc_ids))))
+        if self.doc_types:
+            must.append(models.FieldCondition(key="doc_type", match=models.MatchAny(any=list(self.doc_types))))
+        if self.title:
+            must.append(models.FieldCondition(key="title", match=models.MatchText(text=self.title)))
+        # Superposición de intervalos: el documento empieza antes de que termine
+        # el período consultado y termina después de que este empieza
+        if self.vigencia_hasta:
+            must.append(models.FieldCondition(
+                key="vigencia_desde", range=models.Range(lte=date_to_int(self.vigencia_hasta))))
+        if self.vigencia_desde:
+            must.append(models.FieldCondition(
+                key="vigencia_hasta", range=models.Range(gte=date_to_int(self.vigencia_desde))))
+        return models.Filter(must=must)
+
+    def mask(self, columns: Dict[str, np.ndarray]) -> np.ndarray:
+        """
+        Máscara booleana sobre columnas de metadatos (backend FAISS).
+
+        `columns` viene de `filter_columns`: una fila por vector del índice.
+        """
+        keep = np.ones(len(columns["doc_id"]), dtype=bool)
+        if self.doc_ids:
+            keep &= np.isin(columns["doc_id"], self.doc_ids)
+        if self.doc_types:
+            keep &= np.isin(columns["doc_type"], self.doc_types)
+        if self.title:
+            keep &= np.char.find(columns["title_lower"], self.title.lower()) >= 0
+        if self.vigencia_hasta:
+            keep &= columns["vigencia_desde"] <= date_to_int(self.vigencia_hasta)
+        if self.vigencia_desde:
+            keep &= columns["vigencia_hasta"] >= date_to_int(self.vigencia_desde)
+        return keep
+
+
+NO_FILTERS = SearchFilters()
+
+# Expresiones temporales que piden lo vigente "hoy"
+_CURRENT_RE = re.compile(r"\b(vigentes?|actual(es|mente)?|este año|hoy|ahora)\b")
+
+
+class QueryClassifier:
+    """
+    Clasificador liviano por reglas que deduce filtros desde la pregunta.
+
+    - Un año explícito ("calendario 2025") restringe la vigencia a ese año.
+    - "vigente", "actual", "este año"... restringen a lo vigente hoy.
+    - Nombrar un tipo de documento ("reglamento", "calendario", "política")
+      restringe a ese tipo, solo si existe en el corpus.
+
+    Es conservador a propósito: si nada calza no se filtra, y el pipeline
+    vuelve a buscar sin filtros cuando los deducidos dejan menos de k chunks.
+    """
+
+    def __init__(self, doc_types: Optional[Iterable[str]] = None):
+        """
+        Args:
+            doc_types: Tipos presentes en el corpus. None acepta cualquiera.
+        """
+        self.doc_types = set(doc_types) if doc_types is not None else None
+
+    @classmethod
+    def from_sources(cls, sources: Dict[str, Dict[str, str]]) -> "QueryClassifier":
+        """Crea el clasificador a partir de sources.csv (ver rag.ingest.load_sources)."""
+        return cls({doc_type_of(r.get("title"), r.get("doc_id")) for r in sources.values()})
+
+    def classify(self, query: str, today: Optional[date] = None) -> SearchFilters:
+        q = query.lower()
+        desde = hasta = None
+
+        years = sorted({int(y) for y in _YEAR_RE.findall(q)})
+        if years:
+            desde, hasta = date(years[0], 1, 1), date(years[-1], 12, 31)
+        elif _CURRENT_RE.search(q):
+            desde = hasta = today or date.today()
+
+        doc_types = []
+        for doc_type, keywords in DOC_TYPE_RULES:
+            if any(kw in q for kw in keywords) and (self.doc_types is None or doc_type in self.doc_types):
+                doc_types.append(doc_type)
+
+        return SearchFilters(doc_types=tuple(doc_types), vigencia_desde=desde, vigencia_hasta=hasta)
@@ -6,10 +6,17 @@ from pypdf import PdfReader
 from bs4 import BeautifulSoup
 import csv
 import os
+import uuid
 from dotenv import load_dotenv
 from qdrant_client import QdrantClient, models
 from sentence_transformers import SentenceTransformer
 
+from rag.corpus import corpus_version
+from rag.filters import filter_fields
+from rag.neighbors import link_neighbors
+from rag.routing import build_centroids, docs_collection_name
+from rag.versioning import flip_alias, new_version, prune_collections, versioned_collection
+
 # Cargar las variables de entorno
 load_dotenv()
 
@@ -55,62 +62,54 @@ def load_sources(path: Path):
                 out[fname] = r
     return out
 
-def main():
-    ap = argparse.ArgumentParser()
-    ap.add_argument("--raw", default="data/raw")
-    ap.add_argument("--sources", default="data/sources.csv")
-    ap.add_argument("--chunk-size", type=int, default=900)
-    ap.add_argument("--overlap", type=int, default=120)
-    args = ap.parse_args()
+def extract_pages(fp: Path):
+    """Extrae el texto por página según la extensión (None si no se soporta)."""
+    ext = fp.suffix.lower()
+    if ext == ".pdf":
+        return extract_pdf_text(fp)
+    elif ext in (".html", ".htm"):
+        return extract_html_text(fp)
+    elif ext in (".txt", ".md"):
+        return [fp.read_text(encoding="utf-8")]
+    return None
 
-    raw = Path(args.raw)
-    sources = load_sources(Path(args.sources))
-    records = []
-
-    # Inicializar el cliente de Qdrant y el modelo de embeddings
-    qdrant_client = QdrantClient(
-        url=os.environ.get("QDRANT_HOST"),
-        api_key=os.environ.get("QDRANT_API_KEY")
-    )
-    embedding_model = SentenceTransformer('all-MiniLM-L6-v2')
-    
-    collection_name = "ufro_normativa"
-    # Recrear la colección para empezar de cero y asegurarnos que tiene el texto
-    qdrant_client.recreate_collection(
-        collection_name=collection_name,
-        vectors_config=models.VectorParams(size=embedding_model.get_sentence_embedding_dimension(), distance=models.Distance.COSINE)
-    )
+def build_records(raw: Path, sources: dict, chunk_size: int = 900, overlap: int = 120, extract=extract_pages,
+                  files=None):
+    """
+    Recorre `raw` y devuelve los chunks con sus metadatos (sin embeddings).
 
-    for fp in sorted(raw.glob("*")):
+    `extract` permite reemplazar la extracción de texto (p. ej. por una versión
+    con cache en eval/retrieval_eval.py). `files` limita el recorrido a esos
+    nombres de archivo (indexación incremental, ver rag/watch.py).
+    """
+    records = []
+    paths = raw.glob("*") if files is None else (raw / name for name in files)
+    for fp in sorted(paths):
         if not fp.is_file():
             continue
-        ext = fp.suffix.lower()
         print(f"Procesando: {fp.name}")
 
         try:
-            if ext == ".pdf":
-                pages = extract_pdf_text(fp)
-            elif ext in (".html", ".htm"):
-                pages = extract_html_text(fp)
-            elif ext in (".txt", ".md"):
-                pages = [fp.read_text(encoding="utf-8")]
-            else:
-                continue
+            pages = extract(fp)
         except Exception as e:
             print(f"Error extrayendo {fp.name}: {e}")
             continue
+        if pages is None:
+            continue
 
         meta = sources.get(fp.name, {})
         doc_id = meta.get("doc_id", fp.stem)
         title = meta.get("title", fp.stem)
         url = meta.get("url", "")
         vigencia = meta.get("vigencia", "")
+        # doc_type y vigencia_desde/hasta: campos indexados para filtrar búsquedas
+        derived = filter_fields({"doc_id": doc_id, "title": title, "vigencia": vigencia})
 
         for pno, ptext in enumerate(pages, start=1):
             text = clean_text(ptext)
             if not text:
                 continue
-            chs = chunks_by_words(text, args.chunk_size, args.overlap)
+            chs = chunks_by_words(text, chunk_size, overlap)
             for i, ch in enumerate(chs):
                 records.append({
                     "chunk_id": f"{doc_id}_p{pno}_c{i}",
@@ -120,38 +119,157 @@ def main():
                     "url": url,
                     "vigencia": vigencia,
                     "text": ch,
-                    "filename": fp.name
+                    "filename": fp.name,
+                    **derived,
                 })
+    # prev/next chunk_id dentro de cada documento (expansión de contexto, rag/neighbors.py)
+    return link_neighbors(records)
+
+# Campos del payload con índice: Qdrant los usa para filtrar antes de comparar
+# vectores, en vez de recorrer la colección completa (ver rag.filters)
+PAYLOAD_INDEXES = {
+    "doc_id": models.PayloadSchemaType.KEYWORD,
+    "doc_type": models.PayloadSchemaType.KEYWORD,
+    "title": models.PayloadSchemaType.TEXT,
+    "vigencia_desde": models.PayloadSchemaType.INTEGER,
+    "vigencia_hasta": models.PayloadSchemaType.INTEGER,
+    # Para reemplazar o borrar los chunks de un archivo (rag/watch.py)
+    "filename": models.PayloadSchemaType.KEYWORD,
+    # Para traer los chunks vecinos de un hit (rag/neighbors.py)
+    "chunk_id": models.PayloadSchemaType.KEYWORD,
+}
+
+# Ids de punto estables entre procesos (hash() de Python cambia en cada
+# ejecución): reindexar un chunk sobrescribe su punto en vez de duplicarlo
+POINT_NAMESPACE = uuid.uuid5(uuid.NAMESPACE_URL, "ufro_normativa")
+
+def point_id(key: str) -> str:
+    return str(uuid.uuid5(POINT_NAMESPACE, key))
+
+def create_collection(qdrant_client: QdrantClient, collection_name: str, dimension: int):
+    """Recrea la colección para empezar de cero, con los índices de payload."""
+    qdrant_client.recreate_collection(
+        collection_name=collection_name,
+        vectors_config=models.VectorParams(size=dimension, distance=models.Distance.COSINE)
+    )
+    for field_name, schema in PAYLOAD_INDEXES.items():
+        qdrant_client.create_payload_index(
+            collection_name=collection_name,
+            field_name=field_name,
+            field_schema=schema,
+        )
+
+def encode_records(records, embedding_model, batch_size: int = 64):
+    """Genera los embeddings de los chunks en lotes (un solo encode por lote, no por chunk)."""
+    return embedding_model.encode(
+        [record["text"] for record in records],
+        batch_size=batch_size,
+        convert_to_numpy=True,
+        show_progress_bar=False,
+    )
+
+def upload_records(qdrant_client: QdrantClient, collection_name: str, records, embedding_model,
+                   batch_size: int = 64, vectors=None):
+    """Codifica los chunks en lotes (salvo que se pasen `vectors`) y los sube como puntos a Qdrant."""
+    if vectors is None:
+        vectors = encode_records(records, embedding_model, batch_size)
+
+    # Mantener el registro completo como payload, incluyendo el texto
+    points = [
+        models.PointStruct(
+            id=point_id(record["chunk_id"]),
+            vector=vector.tolist(),
+            payload=record.copy()
+        )
+        for record, vector in zip(records, vectors)
+    ]
+
+    # wait=True: al volver, los puntos ya son buscables (antes de mover el alias)
+    qdrant_client.upload_points(
+        collection_name=collection_name,
+        points=points,
+        wait=True
+    )
+    return len(points)
+
+def upload_centroids(qdrant_client: QdrantClient, collection_name: str, records, vectors):
+    """
+    Recrea `<colección>_docs` con un centroide por documento y por sección,
+    usado por el ruteo de dos etapas (rag/routing.py, ROUTING_TOP_DOCS).
+    """
+    points = centroid_points(records, vectors)
+    docs_collection = docs_collection_name(collection_name)
+    create_collection(qdrant_client, docs_collection, len(points[0].vector) if points else len(vectors[0]))
+    qdrant_client.upload_points(collection_name=docs_collection, points=points, wait=True)
+    return len(points)
+
+def centroid_points(records, vectors):
+    """Centroides de documento/sección como puntos, con id estable por (doc_id, nivel, página)."""
+    centroids, labels = build_centroids(records, vectors)
+    return [
+        models.PointStruct(
+            id=point_id(f"{label['doc_id']}/{label['level']}/{label.get('first_page', 0)}"),
+            vector=vector.tolist(),
+            payload=label,
+        )
+        for vector, label in zip(centroids, labels)
+    ]
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--raw", default="data/raw")
+    ap.add_argument("--sources", default="data/sources.csv")
+    ap.add_argument("--chunk-size", type=int, default=900)
+    ap.add_argument("--overlap", type=int, default=120)
+    ap.add_argument("--collection", default="ufro_normativa",
+                    help="Alias que consultan los retrievers; cada ingesta crea '<alias>__<versión>'")
+    ap.add_argument("--keep", type=int, default=2,
+                    help="Versiones a conservar (la activa y la anterior, por defecto)")
+    args = ap.parse_args()
+
+    raw = Path(args.raw)
+    sources = load_sources(Path(args.sources))
+
+    # Inicializar el cliente de Qdrant y el modelo de embeddings
+    qdrant_client = QdrantClient(
+        url=os.environ.get("QDRANT_HOST"),
+        api_key=os.environ.get("QDRANT_API_KEY")
+    )
+    embedding_model = SentenceTransformer('all-MiniLM-L6-v2')
+
+    records = build_records(raw, sources, args.chunk_size, args.overlap)
 
     if not records:
         print("No se generaron chunks. Verifique sus archivos de origen y sources.csv.")
         return
 
-    # Preparar los puntos para subir a Qdrant
-    points = []
-    for record in records:
-        # Generar el embedding del texto
-        vector = embedding_model.encode(record["text"]).tolist()
-        
-        # Mantener el registro completo como payload, incluyendo el texto
-        payload = record.copy()
-
-        points.append(models.PointStruct(
-            id=hash(record["chunk_id"]) % (2**63 - 1),
-            vector=vector,
-            payload=payload
-        ))
+    # La nueva versión se construye al lado de la activa: las consultas siguen
+    # respondiendo con la anterior hasta que se mueve el alias
+    alias = args.collection
+    version = new_version(corpus_version(raw, Path(args.sources)))
+    collection_name = versioned_collection(alias, version)
+    create_collection(qdrant_client, collection_name, embedding_model.get_sentence_embedding_dimension())
 
     # Subir los puntos a Qdrant
-    print(f"Subiendo {len(points)} chunks a la colección '{collection_name}'...")
+    print(f"Subiendo {len(records)} chunks a la colección '{collection_name}'...")
     try:
-        qdrant_client.upload_points(
-            collection_name=collection_name,
-            points=points
-        )
-        print("¡Ingesta completada con éxito! 🎉 Los chunks están en Qdrant.")
+        vectors = encode_records(records, embedding_model)
+        upload_records(qdrant_client, collection_name, records, embedding_model, vectors=vectors)
+        n_centroids = upload_centroids(qdrant_client, collection_name, records, vectors)
+        print(f"{n_centroids} centroides de documento/sección en '{docs_collection_name(collection_name)}'")
     except Exception as e:
         print(f"Error al subir los chunks a Qdrant: {e}")
+        # La versión incompleta nunca se publica
+        for name in (collection_name, docs_collection_name(collection_name)):
+            if qdrant_client.collection_exists(name):
+                qdrant_client.delete_collection(name)
+        return
+
+    previous = flip_alias(qdrant_client, alias, collection_name)
+    print(f"Alias '{alias}' -> '{collection_name}' (antes: {previous or 'ninguna'})")
+    for name in prune_collections(qdrant_client, alias, keep=args.keep):
+        print(f"Versión antigua eliminada: {name}")
+    print("¡Ingesta completada con éxito! 🎉 Los chunks están en Qdrant.")
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,369 @@
+# metrics.py
+"""
+Métricas operacionales en formato de texto de Prometheus (sin dependencias).
+
+Cada hilo escribe en su propio shard (threading.local), así que registrar una
+observación no toma ningún lock ni crea objetos nuevos una vez que la serie
+existe. El lock solo se usa al registrar el shard de un hilo nuevo y al
+exportar (`/metrics`), donde se suman los shards de todos los hilos.
+
+Con Gunicorn (METRICS_DIR definido, ver gunicorn.conf.py) cada worker vuelca
+su snapshot a METRICS_DIR/<pid>.json cada METRICS_FLUSH_S segundos y `/metrics`
+suma los archivos de todos los workers, así que cualquier worker que atienda el
+scrape devuelve los totales del despliegue. Los contadores e histogramas de un
+worker que terminó se conservan; sus gauges se descartan (mark_process_dead).
+Los collectors (batcher, cache, índice) siguen siendo del worker que respondió
+(etiqueta `pid` en rag_process_info).
+"""
+import json
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+# Buckets de latencia en segundos (del encoder ~ms al LLM ~decenas de s)
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                   1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+LabelValues = Tuple[str, ...]
+
+
+class _Shard:
+    """Valores escritos por un solo hilo: {(métrica, labels): [valores]}."""
+    __slots__ = ("thread", "values")
+
+    def __init__(self, thread: threading.Thread):
+        self.thread = thread
+        self.values: Dict[Tuple[str, LabelValues], List[float]] = {}
+
+
+class MetricsRegistry:
+    """Registro de métricas con un shard por hilo."""
+
+    # Al superar esta cantidad de shards se fusionan los de hilos terminados
+    # (el servidor de desarrollo de Flask crea un hilo por request).
+    COMPACT_THRESHOLD = 64
+
+    def __init__(self, directory: Optional[str] = None, flush_interval: float = 5.0):
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._shards: List[_Shard] = []
+        self._retired: Dict[Tuple[str, LabelValues], List[float]] = {}
+        self._metrics: List["_Metric"] = []
+        self._collectors: List[Callable[[], Iterable[str]]] = []
+        # Modo multiproceso: un archivo por worker en `directory`
+        self.directory = Path(directory) if directory else None
+        self.flush_interval = flush_interval
+        self._flush_pid: Optional[int] = None
+
+    # -------------------------------
+    # Escritura (camino rápido)
+    # -------------------------------
+    def _values(self, key: Tuple[str, LabelValues], size: int) -> List[float]:
+        shard = getattr(self._local, "shard", None)
+        if shard is None:
+            shard = self._new_shard()
+        values = shard.values.get(key)
+        if values is None:
+            values = shard.values[key] = [0.0] * size
+        return values
+
+    def _new_shard(self) -> _Shard:
+        shard = _Shard(threading.current_thread())
+        with self._lock:
+            if len(self._shards) >= self.COMPACT_THRESHOLD:
+                self._compact()
+            self._shards.append(shard)
+            if self.directory is not None and self._flush_pid != os.getpid():
+                self._start_flusher()
+        self._local.shard = shard
+        return shard
+
+    def _compact(self):
+        """Fusiona en `_retired` los shards de hilos que ya terminaron (con el lock tomado)."""
+        alive = []
+        for shard in self._shards:
+            if shard.thread.is_alive():
+                alive.append(shard)
+                continue
+            for key, values in shard.values.items():
+                _add_into(self._retired, key, values)
+        self._shards = alive
+
+    # -------------------------------
+    # Registro y exportación
+    # -------------------------------
+    def register(self, metric: "_Metric") -> "_Metric":
+        self._metrics.append(metric)
+        return metric
+
+    def register_collector(self, collector: Callable[[], Iterable[str]]):
+        """Agrega una función que devuelve líneas ya formateadas (p. ej. stats del batcher)."""
+        self._collectors.append(collector)
+
+    def snapshot(self) -> Dict[Tuple[str, LabelValues], List[float]]:
+        """Suma los valores de todos los hilos."""
+        with self._lock:
+            merged = {key: list(values) for key, values in self._retired.items()}
+            shards = list(self._shards)
+        for shard in shards:
+            for key, values in list(shard.values.items()):
+                _add_into(merged, key, values)
+        return merged
+
+    # -------------------------------
+    # Varios procesos (METRICS_DIR)
+    # -------------------------------
+    def _start_flusher(self):
+        """
+        Arranca el hilo que vuelca el snapshot de este proceso (con el lock
+        tomado). Se crea con el primer shard del proceso: con preload_app el
+        maestro no escribe métricas y un hilo suyo no pasaría a los workers.
+        """
+        self._flush_pid = os.getpid()
+        threading.Thread(target=self._flush_loop, name="metrics-flush", daemon=True).start()
+
+    def _flush_loop(self):
+        while True:
+            time.sleep(self.flush_interval)
+            try:
+                self.flush()
+            except OSError as e:
+                print(f"[Metrics] No se pudo escribir {self._path(os.getpid())}: {e}")
+
+    def _path(self, pid: int) -> Path:
+        return self.directory / f"{pid}.json"
+
+    def flush(self):
+        """Escribe el snapshot de este proceso en METRICS_DIR/<pid>.json (reemplazo atómico)."""
+        if self.directory is None:
+            return
+        self._write(self._path(os.getpid()), self.snapshot())
+
+    @staticmethod
+    def _write(path: Path, data: Dict[Tuple[str, LabelValues], List[float]]):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_name(f".{path.name}.{threading.get_ident()}.tmp")
+        tmp.write_text(json.dumps([[name, list(labels), values] for (name, labels), values in data.items()]),
+                       encoding="utf-8")
+        os.replace(tmp, path)
+
+    @staticmethod
+    def _read(path: Path) -> Dict[Tuple[str, LabelValues], List[float]]:
+        try:
+            entries = json.loads(path.read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            return {}
+        return {(name, tuple(labels)): values for name, labels, values in entries}
+
+    def mark_process_dead(self, pid: int):
+        """
+        Worker terminado (hook child_exit del maestro): conserva sus contadores
+        e histogramas, que son acumulados, y borra sus gauges (p. ej. requests
+        en curso), que ya no describen nada vivo.
+        """
+        if self.directory is None:
+            return
+        path = self._path(pid)
+        if not path.exists():
+            return
+        gauges = {m.name for m in self._metrics if m.kind == "gauge"}
+        data = {key: values for key, values in self._read(path).items() if key[0] not in gauges}
+        self._write(path, data)
+
+    def clear_directory(self):
+        """Borra los archivos de una ejecución anterior (hook on_starting del maestro)."""
+        if self.directory is None:
+            return
+        for path in self.directory.glob("*.json"):
+            path.unlink()
+
+    def collect(self) -> Dict[Tuple[str, LabelValues], List[float]]:
+        """Valores a exportar: los de este proceso, o la suma de todos los workers."""
+        if self.directory is None:
+            return self.snapshot()
+        self.flush()
+        merged: Dict[Tuple[str, LabelValues], List[float]] = {}
+        for path in self.directory.glob("*.json"):
+            for key, values in self._read(path).items():
+                _add_into(merged, key, values)
+        return merged
+
+    def render(self) -> str:
+        """Texto en formato de exposición de Prometheus (version=0.0.4)."""
+        data = self.collect()
+        lines: List[str] = []
+        for metric in self._metrics:
+            lines.extend(metric.render(data))
+        for collector in self._collectors:
+            try:
+                lines.extend(collector())
+            except Exception as e:
+                lines.append(f"# collector error: {type(e).__name__}")
+        return "\n".join(lines) + "\n"
+
+
+def _add_into(target: Dict, key, values: List[float]):
+    current = target.get(key)
+    if current is None:
+        target[key] = list(values)
+    else:
+        for i, v in enumerate(values):
+            current[i] += v
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_value(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(value)
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 registry: Optional[MetricsRegistry] = None):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.registry = registry or REGISTRY
+        self.registry.register(self)
+
+    def _key(self, labels: Sequence[str]) -> Tuple[str, LabelValues]:
+        if len(labels) != len(self.labelnames):
+            raise ValueError(f"{self.name} espera labels {self.labelnames}")
+        return self.name, tuple(str(v) for v in labels)
+
+    def _header(self) -> List[str]:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+
+    def _series(self, data) -> List[Tuple[LabelValues, List[float]]]:
+        return sorted((labels, v) for (name, labels), v in data.items() if name == self.name)
+
+
+class Counter(_Metric):
+    """Contador monotónico."""
+    kind = "counter"
+
+    def inc(self, *labels: str, amount: float = 1.0):
+        self.registry._values(self._key(labels), 1)[0] += amount
+
+    def render(self, data) -> List[str]:
+        lines = self._header()
+        for labels, v in self._series(data):
+            lines.append(f"{self.name}{_format_labels(self.labelnames, labels)} {_format_value(v[0])}")
+        return lines
+
+
+class Gauge(_Metric):
+    """Valor que sube y baja (p. ej. requests en curso)."""
+    kind = "gauge"
+
+    def inc(self, *labels: str, amount: float = 1.0):
+        self.registry._values(self._key(labels), 1)[0] += amount
+
+    def dec(self, *labels: str, amount: float = 1.0):
+        self.registry._values(self._key(labels), 1)[0] -= amount
+
+    def render(self, data) -> List[str]:
+        lines = self._header()
+        for labels, v in self._series(data):
+            lines.append(f"{self.name}{_format_labels(self.labelnames, labels)} {_format_value(v[0])}")
+        return lines
+
+
+class Histogram(_Metric):
+    """Histograma con buckets fijos: [conteo por bucket..., suma, total]."""
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = LATENCY_BUCKETS, registry: Optional[MetricsRegistry] = None):
+        super().__init__(name, documentation, labelnames, registry)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, *labels: str):
+        values = self.registry._values(self._key(labels), len(self.buckets) + 3)
+        i = 0
+        for bound in self.buckets:
+            if value <= bound:
+                break
+            i += 1
+        values[i] += 1
+        values[-2] += value
+        values[-1] += 1
+
+    def render(self, data) -> List[str]:
+        lines = self._header()
+        for labels, v in self._series(data):
+            cumulative = 0.0
+            for bound, count in zip(list(self.buckets) + [float("inf")], v[:-2]):
+                cumulative += count
+                le = 'le="+Inf"' if bound == float("inf") else f'le="{bound!r}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, labels, le)} "
+                             f"{_format_value(cumulative)}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, labels)} {_format_value(v[-2])}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, labels)} {_format_value(v[-1])}")
+        return lines
+
+
+def simple_metric_lines(name: str, documentation: str, kind: str,
+                        samples: Iterable[Tuple[Dict[str, str], float]]) -> List[str]:
+    """Formatea muestras calculadas al vuelo (para collectors)."""
+    lines = [f"# HELP {name} {documentation}", f"# TYPE {name} {kind}"]
+    for labels, value in samples:
+        lines.append(f"{name}{_format_labels(list(labels), list(labels.values()))} {_format_value(value)}")
+    return lines
+
+
+def bucket_histogram_lines(name: str, documentation: str, bucket_counts: Dict[str, int]) -> List[str]:
+    """Formatea un histograma a partir de conteos por bucket no acumulados ({le: conteo})."""
+    lines = [f"# HELP {name} {documentation}", f"# TYPE {name} histogram"]
+    cumulative = 0
+    for le, count in bucket_counts.items():
+        cumulative += count
+        lines.append(f'{name}_bucket{{le="{le}"}} {cumulative}')
+    lines.append(f"{name}_count {cumulative}")
+    return lines
+
+
+# -------------------------------
+# Registro global y métricas de la aplicación
+# -------------------------------
+REGISTRY = MetricsRegistry(os.environ.get("METRICS_DIR") or None,
+                           flush_interval=float(os.environ.get("METRICS_FLUSH_S", 5)))
+
+REQUESTS = Counter("rag_requests_total", "Requests HTTP atendidos.", ("endpoint", "status"))
+REQUEST_LATENCY = Histogram("rag_request_latency_seconds", "Latencia de extremo a extremo por endpoint.", ("endpoint",))
+IN_FLIGHT = Gauge("rag_inflight_requests", "Requests en curso.")
+STAGE_LATENCY = Histogram("rag_stage_latency_seconds", "Latencia por etapa del pipeline RAG.", ("stage",))
+PROVIDER_LATENCY = Histogram("rag_provider_latency_seconds", "Latencia de la llamada al LLM por proveedor.", ("provider",))
+TOKENS = Counter("rag_tokens_total", "Tokens estimados (prompt + respuesta) por proveedor.", ("provider",))
+QDRANT_REQUESTS = Counter("rag_qdrant_requests_total", "Búsquedas enviadas a Qdrant.", ("operation",))
+QDRANT_ERRORS = Counter("rag_qdrant_errors_total", "Búsquedas a Qdrant que fallaron.", ("operation",))
+
+
+def observe_result(result):
+    """Registra las métricas de un RAGResult (etapas, proveedor y tokens)."""
+    for stage in result.stages:
+        STAGE_LATENCY.observe(stage.ms / 1000.0, stage.name)
+        if stage.name == "llm_call":
+            PROVIDER_LATENCY.observe(stage.ms / 1000.0, result.provider)
+    TOKENS.inc(result.provider, amount=result.tokens_used)
+
+
+def _process_info() -> List[str]:
+    return simple_metric_lines("rag_process_info", "Proceso (worker) que respondió el scrape.", "gauge",
+                               [({"pid": str(os.getpid())}, 1)])
+
+
+REGISTRY.register_collector(_process_info)
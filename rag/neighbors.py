@@ -0,0 +1,195 @@
+# neighbors.py
+import re
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+# chunks_by_words corta en posiciones fijas: el mejor chunk suele quedar sin
+# la oración anterior o siguiente. Cada chunk guarda el chunk_id de sus
+# vecinos dentro del documento (prev/next, cruzando páginas) y la expansión
+# de contexto agrega palabras de esos vecinos hasta un presupuesto de tokens,
+# en vez de subir k y traer chunks de otros temas.
+PREV_FIELD = "prev_chunk_id"
+NEXT_FIELD = "next_chunk_id"
+
+_CHUNK_INDEX = re.compile(r"_c(\d+)$")
+
+
+def _position(record: dict):
+    match = _CHUNK_INDEX.search(str(record.get("chunk_id", "")))
+    return int(record.get("page") or 0), int(match.group(1)) if match else 0
+
+
+def link_neighbors(records: List[dict]) -> List[dict]:
+    """
+    Agrega a cada registro el chunk_id anterior y siguiente de su documento
+    (orden por página y número de chunk; None en los extremos). Modifica
+    `records` en el lugar y los devuelve.
+    """
+    by_doc: Dict[str, List[dict]] = {}
+    for r in records:
+        by_doc.setdefault(r["doc_id"], []).append(r)
+    for chunks in by_doc.values():
+        chunks.sort(key=_position)
+        for i, r in enumerate(chunks):
+            r[PREV_FIELD] = chunks[i - 1]["chunk_id"] if i > 0 else None
+            r[NEXT_FIELD] = chunks[i + 1]["chunk_id"] if i + 1 < len(chunks) else None
+    return records
+
+
+def overlap_length(left: Sequence[str], right: Sequence[str]) -> int:
+    """Largo del sufijo de `left` que se repite como prefijo de `right` (el solape de chunks_by_words)."""
+    for size in range(min(len(left), len(right)), 0, -1):
+        if left[-size] == right[0] and list(left[-size:]) == list(right[:size]):
+            return size
+    return 0
+
+
+class _Passage:
+    """Ventana de texto contigua de un documento alrededor de uno o más hits."""
+
+    def __init__(self, hit: dict):
+        self.hits = [hit]
+        self.words = hit["text"].split()
+        self.chunk_ids = [hit["chunk_id"]]
+        self.pages = [hit.get("page")]
+        self.prev_id = hit.get(PREV_FIELD)
+        self.next_id = hit.get(NEXT_FIELD)
+        # Posición donde retomar un vecino que entró solo en parte
+        self._next_resume: Optional[int] = None
+        self._prev_resume: Optional[int] = None
+
+    def append(self, chunk: dict, limit: Optional[int] = None) -> int:
+        """
+        Agrega hasta `limit` palabras de `chunk` a la derecha; devuelve cuántas.
+        Si el vecino no entra completo, `next_id` sigue apuntándolo y la
+        próxima llamada continúa donde quedó.
+        """
+        words = chunk["text"].split()
+        start = self._next_resume if self._next_resume is not None else overlap_length(self.words, words)
+        end = len(words) if limit is None else min(len(words), start + limit)
+        if self._next_resume is None:
+            self.pages.append(chunk.get("page"))
+        self.words += words[start:end]
+        if end == len(words):
+            # El vecino entró completo: la ventana puede seguir creciendo desde él
+            self.chunk_ids.append(chunk["chunk_id"])
+            self.next_id = chunk.get(NEXT_FIELD)
+            self._next_resume = None
+        else:
+            self._next_resume = end
+        return end - start
+
+    def prepend(self, chunk: dict, limit: Optional[int] = None) -> int:
+        """Agrega hasta `limit` palabras de `chunk` a la izquierda; devuelve cuántas (ver append)."""
+        words = chunk["text"].split()
+        end = self._prev_resume if self._prev_resume is not None else len(words) - overlap_length(words, self.words)
+        start = 0 if limit is None else max(0, end - limit)
+        if self._prev_resume is None:
+            self.pages.insert(0, chunk.get("page"))
+        self.words = words[start:end] + self.words
+        if start == 0:
+            self.chunk_ids.insert(0, chunk["chunk_id"])
+            self.prev_id = chunk.get(PREV_FIELD)
+            self._prev_resume = None
+        else:
+            self._prev_resume = start
+        return end - start
+
+    def as_chunk(self) -> dict:
+        best = max(self.hits, key=lambda h: h.get("score") or 0.0)
+        pages = [p for p in self.pages if p is not None]
+        page = best.get("page")
+        if pages and min(pages) != max(pages):
+            page = f"{min(pages)}-{max(pages)}"
+        return {**best, "text": " ".join(self.words), "page": page, "chunk_ids": list(self.chunk_ids)}
+
+
+def expand_context(hits: List[dict], fetch: Callable[[Iterable[str]], Dict[str, dict]],
+                   budget_tokens: int) -> List[dict]:
+    """
+    Expande los hits con el texto de sus chunks vecinos hasta `budget_tokens`
+    (tokens estimados como palabras, igual que estimate_tokens del pipeline).
+
+    1. Los hits contiguos del mismo documento se unen en un solo pasaje.
+    2. El presupuesto que dejan los hits se reparte entre los dos lados de cada
+       pasaje, en orden de score; lo que un lado no usa pasa a los siguientes
+       y, en una pasada más, a los lados anteriores que aún tienen vecinos.
+    3. Al unir dos chunks se quita el texto solapado (overlap de chunks_by_words).
+
+    `fetch(chunk_ids)` devuelve {chunk_id: chunk} con `text`, `page` y los
+    campos prev/next. Los pasajes salen ordenados por su mejor score.
+    """
+    if budget_tokens <= 0 or not hits:
+        return hits
+
+    by_id = {h["chunk_id"]: h for h in hits}
+    passages: List[_Passage] = []
+    covered = set()
+    for hit in hits:
+        if hit["chunk_id"] in covered:
+            continue
+        # Empezar por el hit más a la izquierda de una racha contigua
+        start = hit
+        while start.get(PREV_FIELD) in by_id and start[PREV_FIELD] not in covered:
+            start = by_id[start[PREV_FIELD]]
+        passage = _Passage(start)
+        covered.add(start["chunk_id"])
+        while passage.next_id in by_id and passage.next_id not in covered:
+            nxt = by_id[passage.next_id]
+            passage.append(nxt)
+            passage.hits.append(nxt)
+            covered.add(nxt["chunk_id"])
+        passages.append(passage)
+    passages.sort(key=lambda p: max(h.get("score") or 0.0 for h in p.hits), reverse=True)
+
+    remaining = budget_tokens - sum(len(p.words) for p in passages)
+    cache: Dict[str, dict] = {}
+
+    # Vecino que un lado empezó a consumir: ningún otro lado puede tomarlo,
+    # aunque todavía no haya entrado completo
+    claimed: Dict[str, Tuple[_Passage, str]] = {}
+
+    def next_neighbor(passage: _Passage, side: str) -> Optional[str]:
+        neighbor_id = passage.next_id if side == "next" else passage.prev_id
+        if neighbor_id is None or neighbor_id in covered:
+            return None
+        owner = claimed.get(neighbor_id)
+        if owner is not None and (owner[0] is not passage or owner[1] != side):
+            return None
+        return neighbor_id
+
+    # Cada pasada reparte lo que queda entre los lados que aún tienen vecinos;
+    # un lado que llega al borde del documento (o a otro pasaje) deja su parte
+    # a los demás en la pasada siguiente.
+    slots = [(p, side) for p in passages for side in ("next", "prev")]
+    while remaining > 0 and slots:
+        added_in_pass = 0
+        for i, (passage, side) in enumerate(slots):
+            allowance = remaining // (len(slots) - i)
+            while allowance > 0:
+                neighbor_id = next_neighbor(passage, side)
+                if neighbor_id is None:
+                    break
+                if neighbor_id not in cache:
+                    # Se piden juntos los vecinos inmediatos de todos los lados pendientes
+                    pending = {next_neighbor(p, s) for p, s in slots[i:]}
+                    cache.update(fetch([c for c in pending | {neighbor_id} if c and c not in cache]))
+                neighbor = cache.get(neighbor_id)
+                if neighbor is None:
+                    # El vecino ya no está en el índice: ese lado no crece más
+                    if side == "next":
+                        passage.next_id = None
+                    else:
+                        passage.prev_id = None
+                    break
+                claimed[neighbor_id] = (passage, side)
+                added = passage.append(neighbor, allowance) if side == "next" else passage.prepend(neighbor, allowance)
+                allowance -= added
+                remaining -= added
+                added_in_pass += added
+                if passage.chunk_ids[-1 if side == "next" else 0] != neighbor_id:
+                    break  # entró solo una parte del vecino; se retoma en la próxima pasada
+                covered.add(neighbor_id)
+        if added_in_pass == 0:
+            break
+        slots = [(p, side) for p, side in slots if next_neighbor(p, side) is not None]
+    return [p.as_chunk() for p in passages]
@@ -0,0 +1,435 @@
+# pipeline.py
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
+
+from rag.filters import NO_FILTERS, QueryClassifier, SearchFilters
+from rag.neighbors import expand_context
+from rag.prompts import NO_CONTEXT_ANSWER, build_augmented_prompt
+from rag.tracing import ROOT_SPAN_NAME, Tracer, tracer_from_env
+
+# Definimos el tipo para los metadatos de citación
+CitationMetadata = Dict[str, Any]
+
+# Etapas del pipeline, en orden de ejecución
+STAGES = (
+    "classify_query",
+    "embed_query",
+    "vector_search",
+    "expand_context",
+    "build_citations",
+    "build_prompt",
+    "llm_call",
+    "post_process",
+)
+
+
+@dataclass
+class StageTiming:
+    """Duración y asignaciones de memoria de una etapa del pipeline."""
+    name: str
+    ms: float
+    # Diferencia de bloques asignados por el intérprete (sys.getallocatedblocks).
+    # Es una medida de todo el proceso: con requests concurrentes es aproximada.
+    alloc_blocks: int
+
+
+@dataclass
+class RAGResult:
+    """Resultado de una ejecución del pipeline con su desglose por etapa."""
+    answer: str
+    retrieved_texts: List[str]
+    citations: List[CitationMetadata]
+    tokens_used: int
+    provider: str
+    stages: List[StageTiming] = field(default_factory=list)
+    latency_ms: float = 0.0
+    trace_id: Optional[str] = None
+    # Filtros aplicados a la búsqueda (explícitos o deducidos de la pregunta)
+    filters: SearchFilters = NO_FILTERS
+    filters_source: str = "none"
+
+    def as_tuple(self) -> Tuple[str, List[str], List[CitationMetadata], int]:
+        """Formato histórico de rag_pipeline: (respuesta, textos, citas, tokens)."""
+        return self.answer, self.retrieved_texts, self.citations, self.tokens_used
+
+    def stage_metrics(self) -> Dict[str, Dict[str, float]]:
+        """Desglose por etapa listo para serializar en JSON."""
+        return {
+            s.name: {"ms": round(s.ms, 3), "alloc_blocks": s.alloc_blocks}
+            for s in self.stages
+        }
+
+
+@dataclass
+class BatchItem:
+    """Resultado de una pregunta de un lote; `indices` son sus posiciones (las repetidas se responden una vez)."""
+    query: str
+    indices: List[int]
+    result: Optional[RAGResult] = None
+    error: Optional[str] = None
+
+
+class _StageRecorder:
+    """
+    Mide cada etapa con un reloj monotónico y el contador de bloques asignados,
+    y abre un span de traza con el mismo nombre.
+    """
+
+    def __init__(self, tracer: Tracer):
+        self.tracer = tracer
+        self.stages: List[StageTiming] = []
+
+    def add(self, name: str, ms: float, alloc_blocks: int = 0):
+        """Registra una etapa medida fuera del recorder (p. ej. compartida por un lote)."""
+        self.stages.append(StageTiming(name=name, ms=ms, alloc_blocks=alloc_blocks))
+
+    @contextmanager
+    def stage(self, name: str, **attributes: Any):
+        blocks_start = sys.getallocatedblocks()
+        start = time.perf_counter()
+        try:
+            with self.tracer.span(name, **attributes) as span:
+                yield span
+        finally:
+            elapsed_ms = (time.perf_counter() - start) * 1000
+            self.stages.append(StageTiming(
+                name=name,
+                ms=elapsed_ms,
+                alloc_blocks=sys.getallocatedblocks() - blocks_start,
+            ))
+
+
+def build_citations(chunks: List[Dict[str, Any]]) -> List[CitationMetadata]:
+    """Extrae los metadatos de citación sin duplicar (título, página, URL)."""
+    unique_citations_set = set()
+    citation_metadata: List[CitationMetadata] = []
+
+    for chunk in chunks:
+        source_key = (chunk.get("title"), chunk.get("page"), chunk.get("url"))
+
+        if source_key not in unique_citations_set:
+            unique_citations_set.add(source_key)
+            citation_metadata.append({
+                "title": chunk.get("title", "Documento Desconocido"),
+                "page": chunk.get("page", "N/D"),
+                "url": chunk.get("url", "#")
+            })
+
+    return citation_metadata
+
+
+def estimate_tokens(prompt: str, response: str) -> int:
+    """Estimación de tokens (puedes reemplazarlo con tiktoken si usas OpenAI-compatible)."""
+    return len(prompt.split()) + len(response.split())
+
+
+class RAGPipeline:
+    """
+    Pipeline RAG único para la CLI (app.py) y la API (flask_app.py).
+
+    Etapas: classify_query -> embed_query -> vector_search -> expand_context
+    (solo con presupuesto de expansión) -> build_citations -> build_prompt ->
+    llm_call -> post_process. Cada una queda registrada en `RAGResult.stages`.
+    """
+
+    def __init__(self, retriever, providers: Dict[str, Any], default_provider: str = "openrouter",
+                 tracer: Optional[Tracer] = None, classifier: Optional[QueryClassifier] = None,
+                 expand_tokens: int = 0):
+        """
+        Args:
+            retriever: Objeto con `embed(query)` y `search(vector, k, filters)`
+                (QdrantRetriever o FAISSRetriever).
+            providers: Proveedores LLM ya inicializados, por nombre.
+            default_provider: Proveedor usado si se pide uno desconocido.
+            tracer: Tracer para exportar spans (por defecto, trazas desactivadas).
+            classifier: Deduce filtros desde la pregunta cuando no se pasan
+                explícitos. None desactiva los filtros automáticos.
+            expand_tokens: Presupuesto de tokens para completar los chunks
+                recuperados con el texto de sus vecinos (0 = sin expansión).
+        """
+        if default_provider not in providers:
+            raise ValueError(f"Proveedor por defecto desconocido: {default_provider}")
+        self.retriever = retriever
+        self.providers = providers
+        self.default_provider = default_provider
+        self.tracer = tracer or Tracer(None, enabled=False)
+        self.classifier = classifier
+        self.expand_tokens = expand_tokens
+
+    def resolve_provider(self, provider: str) -> str:
+        """
+        Nombre del proveedor que realmente responde: el pedido si existe, si no
+        el por defecto. Es el que va en RAGResult.provider y en las etiquetas de
+        métricas, así un nombre inventado no crea series nuevas.
+        """
+        return provider if provider in self.providers else self.default_provider
+
+    def served_version(self) -> str:
+        """
+        Versión de lo que responde el pipeline: índice servido (con su revisión)
+        más los ajustes que cambian el contexto recuperado. Sirve de llave para
+        caches de respuestas (eval/evaluate.py); la huella de data/raw no basta,
+        porque ROUTING_TOP_DOCS, RAG_AUTO_FILTERS o CONTEXT_EXPAND_TOKENS
+        cambian las respuestas con el mismo corpus.
+        """
+        index_info = getattr(self.retriever, "index_info", dict)()
+        return "|".join([
+            f"index={index_info.get('index_source') or 'sin-version'}",
+            f"route={getattr(self.retriever, 'route_top_docs', 0)}",
+            f"auto_filters={int(self.classifier is not None)}",
+            f"expand={self.expand_tokens}",
+        ])
+
+    def get_provider(self, provider: str):
+        """Devuelve el proveedor pedido o el proveedor por defecto."""
+        return self.providers[self.resolve_provider(provider)]
+
+    def run(self, query: str, provider: str = "openrouter", k: int = 4,
+            filters: Optional[SearchFilters] = None, auto_filters: bool = True,
+            expand_tokens: Optional[int] = None) -> RAGResult:
+        """
+        Ejecuta el pipeline RAG completo para una consulta de usuario.
+
+        Args:
+            query: La pregunta del usuario.
+            provider: El nombre del proveedor LLM a usar ("deepseek" u "openrouter").
+            k: Número de fragmentos a recuperar.
+            filters: Filtros explícitos de la búsqueda (se respetan tal cual).
+            auto_filters: Si no hay filtros explícitos, deducirlos de la pregunta.
+            expand_tokens: Presupuesto de expansión con chunks vecinos (None =
+                el del pipeline, CONTEXT_EXPAND_TOKENS).
+        """
+        provider = self.resolve_provider(provider)
+        with self.tracer.span(ROOT_SPAN_NAME, query=query, provider=provider, k=k) as root:
+            result = self._run(query, provider, k, filters, auto_filters, expand_tokens)
+            root.set(tokens_used=result.tokens_used, n_chunks=len(result.retrieved_texts),
+                     filters=result.filters.to_dict(), filters_source=result.filters_source)
+        result.trace_id = root.trace_id
+        return result
+
+    def run_batch(self, queries: Sequence[str], provider: str = "openrouter", k: int = 4,
+                  filters: Optional[SearchFilters] = None, auto_filters: bool = True,
+                  max_concurrency: Optional[int] = None, expand_tokens: Optional[int] = None) -> Iterator[BatchItem]:
+        """
+        Ejecuta muchas preguntas juntas (/api/batch, `app.py --batch`).
+
+        Las preguntas repetidas se procesan una sola vez. Todas se codifican
+        en un solo llamado al modelo y se buscan en un solo request al
+        retriever; después las generaciones corren con a lo más
+        `max_concurrency` llamadas al LLM simultáneas (BATCH_MAX_CONCURRENCY,
+        por defecto 4).
+
+        La recuperación ocurre antes de devolver el iterador, así sus errores
+        se propagan de inmediato. Los BatchItem salen en el orden en que
+        terminan; un error del LLM queda en `BatchItem.error` y no corta el lote.
+        En cada RAGResult, embed_query y vector_search miden el lote completo.
+        """
+        if max_concurrency is None:
+            max_concurrency = int(os.environ.get("BATCH_MAX_CONCURRENCY", 4))
+        positions: Dict[str, List[int]] = {}
+        for i, query in enumerate(queries):
+            positions.setdefault(query.strip(), []).append(i)
+        unique = list(positions)
+        provider = self.resolve_provider(provider)
+        llm = self.get_provider(provider)
+        start = time.perf_counter()
+
+        recorders, classified = [], []
+        for query in unique:
+            recorder = _StageRecorder(self.tracer)
+            t0 = time.perf_counter()
+            classified.append(self._classify(query, filters, auto_filters))
+            recorder.add("classify_query", (time.perf_counter() - t0) * 1000)
+            recorders.append(recorder)
+
+        t0, blocks = time.perf_counter(), sys.getallocatedblocks()
+        vectors = self.retriever.embed_many(unique)
+        embed_ms, embed_blocks = (time.perf_counter() - t0) * 1000, sys.getallocatedblocks() - blocks
+
+        t0, blocks = time.perf_counter(), sys.getallocatedblocks()
+        results = self._search_many(vectors, k, [f for f, _ in classified], [s for _, s in classified])
+        search_ms, search_blocks = (time.perf_counter() - t0) * 1000, sys.getallocatedblocks() - blocks
+
+        for recorder in recorders:
+            recorder.add("embed_query", embed_ms, embed_blocks)
+            recorder.add("vector_search", search_ms, search_blocks)
+
+        def generate(query, chunks, recorder, item_filters, source):
+            with self.tracer.span(ROOT_SPAN_NAME, query=query, provider=provider, k=k,
+                                  batch_size=len(unique)) as root:
+                result = self._generate(query, provider, llm, chunks, recorder, start, item_filters, source,
+                                        expand_tokens)
+                root.set(tokens_used=result.tokens_used, n_chunks=len(result.retrieved_texts),
+                         filters=result.filters.to_dict(), filters_source=result.filters_source)
+            result.trace_id = root.trace_id
+            return result
+
+        def completed():
+            pool = ThreadPoolExecutor(max_workers=max(1, max_concurrency), thread_name_prefix="rag-batch")
+            try:
+                futures = {
+                    pool.submit(generate, query, chunks, recorder, f, source): query
+                    for query, chunks, recorder, (f, source) in zip(unique, results, recorders, classified)
+                }
+                for future in as_completed(futures):
+                    query = futures[future]
+                    try:
+                        yield BatchItem(query, positions[query], result=future.result())
+                    except Exception as e:
+                        yield BatchItem(query, positions[query], error=f"{type(e).__name__}: {e}")
+            finally:
+                # Si el consumidor deja de leer (cliente desconectado), no se lanzan más generaciones
+                pool.shutdown(wait=False, cancel_futures=True)
+
+        return completed()
+
+    def _classify(self, query: str, filters: Optional[SearchFilters], auto_filters: bool):
+        """Devuelve (filtros, origen): explícitos, deducidos ("auto") o ninguno."""
+        if filters is not None and not filters.is_empty():
+            return filters, "explicit"
+        if auto_filters and self.classifier is not None:
+            inferred = self.classifier.classify(query)
+            if not inferred.is_empty():
+                return inferred, "auto"
+        return NO_FILTERS, "none"
+
+    def _search(self, query_vector, k: int, filters: SearchFilters, source: str):
+        chunks = self.retriever.search(query_vector, k=k, filters=None if filters.is_empty() else filters)
+        if source == "auto" and len(chunks) < k:
+            # Los filtros deducidos pueden equivocarse: se completa el top-k con
+            # la búsqueda sin filtros, manteniendo primero los chunks filtrados
+            chunks = _fill(chunks, self.retriever.search(query_vector, k=k), k)
+        return chunks
+
+    def _search_many(self, query_vectors, k: int, filters: List[SearchFilters], sources: List[str]):
+        """Como `_search` para un lote: una búsqueda agrupada y otra para completar los filtros "auto"."""
+        results = self.retriever.search_many(
+            query_vectors, k=k, filters=[None if f.is_empty() else f for f in filters],
+        )
+        short = [i for i, (chunks, source) in enumerate(zip(results, sources)) if source == "auto" and len(chunks) < k]
+        if short:
+            extra = self.retriever.search_many([query_vectors[i] for i in short], k=k)
+            for i, more in zip(short, extra):
+                results[i] = _fill(results[i], more, k)
+        return results
+
+    def _run(self, query: str, provider: str, k: int, filters: Optional[SearchFilters] = None,
+             auto_filters: bool = True, expand_tokens: Optional[int] = None) -> RAGResult:
+        llm = self.get_provider(provider)
+        recorder = _StageRecorder(self.tracer)
+        start = time.perf_counter()
+
+        with recorder.stage("classify_query") as span:
+            filters, filters_source = self._classify(query, filters, auto_filters)
+            span.set(filters=filters.to_dict(), filters_source=filters_source)
+
+        # Paso de Recuperación (Retrieval)
+        with recorder.stage("embed_query"):
+            query_vector = self.retriever.embed(query)
+        with recorder.stage("vector_search", k=k) as span:
+            chunks = self._search(query_vector, k, filters, filters_source)
+            span.set(
+                scores=[round(c.get("score") or 0.0, 4) for c in chunks],
+                chunk_ids=[c.get("chunk_id") for c in chunks],
+            )
+
+        return self._generate(query, provider, llm, chunks, recorder, start, filters, filters_source,
+                              expand_tokens)
+
+    def _generate(self, query: str, provider: str, llm, chunks: List[Dict[str, Any]], recorder: _StageRecorder,
+                  start: float, filters: SearchFilters, filters_source: str,
+                  expand_tokens: Optional[int] = None) -> RAGResult:
+        """Etapas posteriores a la búsqueda: expansión, citas, prompt, LLM y post-proceso."""
+        budget = self.expand_tokens if expand_tokens is None else expand_tokens
+        if chunks and budget > 0:
+            with recorder.stage("expand_context", budget=budget) as span:
+                chunks = expand_context(chunks, self.retriever.get_chunks, budget)
+                span.set(words=sum(len(c["text"].split()) for c in chunks),
+                         chunk_ids=[c.get("chunk_ids") for c in chunks])
+
+        if not chunks:
+            return RAGResult(
+                answer=NO_CONTEXT_ANSWER,
+                retrieved_texts=[],
+                citations=[],
+                tokens_used=0,
+                provider=provider,
+                stages=recorder.stages,
+                latency_ms=(time.perf_counter() - start) * 1000,
+                filters=filters,
+                filters_source=filters_source,
+            )
+
+        with recorder.stage("build_citations"):
+            retrieved_texts = [chunk["text"] for chunk in chunks]
+            citations = build_citations(chunks)
+
+        # Paso de Aumento de Contexto (Augmentation)
+        with recorder.stage("build_prompt"):
+            augmented_prompt = build_augmented_prompt(query, retrieved_texts)
+
+        # Paso de Generación (Generation)
+        with recorder.stage("llm_call", provider=provider, model=getattr(llm, "name", provider),
+                            prompt_words=len(augmented_prompt.split())):
+            response = llm.chat(messages=[{"role": "user", "content": augmented_prompt}])
+
+        with recorder.stage("post_process"):
+            response = response.strip()
+            tokens_used = estimate_tokens(augmented_prompt, response)
+
+        return RAGResult(
+            answer=response,
+            retrieved_texts=retrieved_texts,
+            citations=citations,
+            tokens_used=tokens_used,
+            provider=provider,
+            stages=recorder.stages,
+            latency_ms=(time.perf_counter() - start) * 1000,
+            filters=filters,
+            filters_source=filters_source,
+        )
+
+
+def _fill(chunks: List[Dict[str, Any]], extra: List[Dict[str, Any]], k: int) -> List[Dict[str, Any]]:
+    """Completa `chunks` hasta k con los de `extra` que no estén repetidos."""
+    seen = {c.get("chunk_id") for c in chunks}
+    return chunks + [c for c in extra if c.get("chunk_id") not in seen][:k - len(chunks)]
+
+
+def classifier_from_env() -> Optional[QueryClassifier]:
+    """
+    Clasificador de filtros automáticos. RAG_AUTO_FILTERS=0 lo desactiva; los
+    tipos de documento disponibles se leen de RAG_SOURCES (data/sources.csv).
+    """
+    if os.environ.get("RAG_AUTO_FILTERS", "1").lower() in ("0", "false", "no"):
+        return None
+    sources_path = Path(os.environ.get("RAG_SOURCES", "data/sources.csv"))
+    if not sources_path.exists():
+        return QueryClassifier()
+    from rag.ingest import load_sources
+    return QueryClassifier.from_sources(load_sources(sources_path))
+
+
+def build_default_pipeline(retriever=None, providers: Optional[Dict[str, Any]] = None) -> RAGPipeline:
+    """
+    Crea el pipeline con el retriever de RETRIEVER_BACKEND (Qdrant por defecto)
+    y los proveedores DeepSeek / OpenRouter.
+    """
+    if retriever is None:
+        from rag.retrieve import retriever_from_env
+        retriever = retriever_from_env()
+    if providers is None:
+        from providers.deepseek import DeepSeekProvider
+        from providers.openrouter import OpenRouterProvider
+        providers = {
+            "deepseek": DeepSeekProvider(),
+            "openrouter": OpenRouterProvider(),
+        }
+    return RAGPipeline(retriever, providers, tracer=tracer_from_env(), classifier=classifier_from_env(),
+                       expand_tokens=int(os.environ.get("CONTEXT_EXPAND_TOKENS", 0)))
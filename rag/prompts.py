@@ -0,0 +1,17 @@
+# prompts.py
+from typing import List
+
+# PROMPT MEJORADO: Política de Abstención más clara
+RAG_PROMPT_TEMPLATE = (
+    "Basado EXCLUSIVAMENTE en la siguiente información de la normativa de la UFRO, responde la pregunta del usuario. "
+    "Si la información no es suficiente o no permite una respuesta completa, indica claramente que no puedes responderla con el contexto proporcionado (Política de Abstención).\n\n"
+    "### Contexto:\n{context}\n\n### Pregunta del usuario:\n{query}"
+)
+
+NO_CONTEXT_ANSWER = "No pude encontrar información relevante en la base de datos para responder a tu pregunta."
+
+
+def build_augmented_prompt(query: str, retrieved_texts: List[str]) -> str:
+    """Arma el prompt aumentado con los fragmentos recuperados."""
+    context = "\n\n".join(retrieved_texts)
+    return RAG_PROMPT_TEMPLATE.format(context=context, query=query)
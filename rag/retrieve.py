@@ -1,57 +1,413 @@
 # retrieve.py
+import json
 import os
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import replace
+from functools import lru_cache
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Sequence
+
+import numpy as np
 from dotenv import load_dotenv
-from qdrant_client import QdrantClient
+from qdrant_client import QdrantClient, models
 from sentence_transformers import SentenceTransformer
 
+from rag.batcher import EmbeddingBatcher
+from rag.filters import NO_FILTERS, SearchFilters, filter_columns
+from rag.routing import DocumentRouter, docs_collection_name
+from rag.versioning import IndexGeneration, collection_revision, resolve_alias, resolve_index_dir, version_of
+from rag.metrics import QDRANT_ERRORS, QDRANT_REQUESTS
+
 # Cargar variables de entorno (.env)
 load_dotenv()
 
 
-class QdrantRetriever:
+class _EmbeddingRetriever:
+    """
+    Parte común de los retrievers: modelo de embeddings, batcher, cache LRU
+    de vectores de consulta y la versión activa del índice (IndexGeneration).
+
+    Las subclases implementan `_current_source` (qué versión está publicada),
+    `_load_generation` (cargarla), `search` y `health`. Un hilo de fondo por
+    proceso revisa cada INDEX_REFRESH_S segundos si se publicó otra versión;
+    si es así la carga al lado, cambia el puntero y la anterior se libera
+    cuando terminan sus consultas en curso. Las consultas solo leen el
+    puntero. Los workers no se reinician.
+    """
+
+    def __init__(self, embedding_model=None):
+        # ⚡ Cargar el modelo de embeddings una sola vez
+        self.embedding_model = embedding_model or SentenceTransformer('all-MiniLM-L6-v2')
+
+        # Las consultas concurrentes se codifican juntas en un solo lote
+        # (EMBED_BATCH_MAX_WAIT_MS / EMBED_BATCH_MAX_SIZE)
+        self.batcher = EmbeddingBatcher(self.embedding_model)
+
+        # Cache LRU de vectores de consulta (preguntas repetidas no pasan por el modelo).
+        # Depende solo del modelo, no del corpus: sobrevive a los cambios de versión.
+        cache_size = int(os.environ.get("EMBED_CACHE_SIZE", 1024))
+        self._embed_cached = lru_cache(maxsize=cache_size)(self._embed_uncached)
+
+        # Ruteo de dos etapas: buscar solo en los M documentos más cercanos
+        # (0 = búsqueda plana). El router es parte de cada versión del índice.
+        self.route_top_docs = int(os.environ.get("ROUTING_TOP_DOCS", 0))
+
+        self.refresh_interval = float(os.environ.get("INDEX_REFRESH_S", 30))
+        self.drain_timeout = float(os.environ.get("INDEX_DRAIN_TIMEOUT_S", 60))
+        self._generation: Optional[IndexGeneration] = None
+        self._swap_lock = threading.Lock()
+        # Avisa a las consultas que leyeron una versión recién retirada
+        self._installed = threading.Condition()
+        self._refresh_lock = threading.Lock()
+        self._refresh_pid: Optional[int] = None
+        self.swaps = 0
+
+    def _embed_uncached(self, query: str) -> tuple:
+        return tuple(self.batcher.encode(query).tolist())
+
+    def embed(self, query: str) -> list:
+        """Convierte la consulta en un vector (cache LRU + batcher)."""
+        return list(self._embed_cached(query))
+
+    def embed_many(self, queries: Sequence[str]) -> List[list]:
+        """
+        Codifica varias consultas en un solo llamado al modelo (modo batch,
+        /api/batch): no pasa por el batcher ni por el cache LRU.
+        """
+        if not queries:
+            return []
+        vectors = self.embedding_model.encode(
+            list(queries),
+            convert_to_numpy=True,
+            batch_size=self.batcher.max_batch_size,
+            show_progress_bar=False,
+        )
+        return [v.tolist() for v in vectors]
+
+    def cache_info(self):
+        """Aciertos / fallos del cache de vectores de consulta (functools.lru_cache)."""
+        return self._embed_cached.cache_info()
+
+    # --- Versiones del índice ---
+    def _current_source(self) -> str:
+        raise NotImplementedError
+
+    def _load_generation(self, source: str) -> IndexGeneration:
+        raise NotImplementedError
+
+    @property
+    def router(self) -> Optional[DocumentRouter]:
+        return self._generation.resources.get("router") if self._generation else None
+
+    def refresh(self) -> bool:
+        """
+        Revisa si cambió la versión publicada y, si cambió, la carga y la
+        activa. Devuelve True si hubo cambio. La llaman el constructor y el
+        hilo de fondo (_refresh_loop), nunca una consulta.
+        """
+        with self._swap_lock:
+            try:
+                source = self._current_source()
+                if self._generation is not None and source == self._generation.source:
+                    return False
+                generation = self._load_generation(source)
+            except Exception as e:
+                if self._generation is None:
+                    raise
+                # Se sigue sirviendo la versión actual; se reintenta en el próximo ciclo
+                print(f"[Retriever] No se pudo cargar la nueva versión del índice: {type(e).__name__}: {e}")
+                return False
+            self._install(generation)
+            return True
+
+    def _ensure_refreshing(self):
+        """
+        Arranca el hilo de refresco en el proceso actual. Igual que el batcher
+        de embeddings, se crea en la primera consulta: con preload_app el
+        maestro no atiende consultas y un hilo suyo no pasaría a los workers.
+        """
+        pid = os.getpid()
+        if self._refresh_pid == pid or self.refresh_interval <= 0:
+            return
+        with self._refresh_lock:
+            if self._refresh_pid == pid:
+                return
+            self._refresh_pid = pid
+            threading.Thread(target=self._refresh_loop, name="index-refresh", daemon=True).start()
+
+    def _refresh_loop(self):
+        while True:
+            time.sleep(self.refresh_interval)
+            try:
+                self.refresh()
+            except Exception as e:
+                print(f"[Retriever] Error al revisar la versión del índice: {type(e).__name__}: {e}")
+
+    def _install(self, generation: IndexGeneration):
+        old = self._generation
+        with self._installed:
+            self._generation = generation
+            self._installed.notify_all()
+        if old is None:
+            return
+        self.swaps += 1
+        old.retire()
+        print(f"[Retriever] Índice {old.version} -> {generation.version} ({old.in_flight} consultas en curso)")
+        threading.Thread(target=self._drain, args=(old,), daemon=True).start()
+
+    def _drain(self, old: IndexGeneration):
+        if not old.drain(timeout=self.drain_timeout):
+            print(f"[Retriever] La versión {old.version} sigue con {old.in_flight} consultas tras "
+                  f"{self.drain_timeout:.0f} s; se liberará cuando termine la última")
+        old.close()
+
+    @contextmanager
+    def _generation_in_use(self):
+        """Toma la versión activa durante una búsqueda (no se libera hasta soltarla)."""
+        self._ensure_refreshing()
+        while True:
+            generation = self._generation
+            if generation.acquire():
+                break
+            # Se leyó una versión ya retirada: esperar (sin girar) a que el
+            # puntero cambie; _install lo cambia antes de retirar la anterior
+            with self._installed:
+                self._installed.wait_for(lambda: self._generation is not generation, timeout=1.0)
+        try:
+            yield generation
+        finally:
+            generation.release()
+
+    def index_info(self) -> dict:
+        generation = self._generation
+        return {
+            "index_version": generation.version if generation else None,
+            "index_source": generation.source if generation else None,
+            "index_loaded_at": generation.loaded_at if generation else None,
+            "index_swaps": self.swaps,
+        }
+
+    # --- Búsqueda ---
+    def route(self, query_vector: list, filters: Optional[SearchFilters] = None,
+              router: Optional[DocumentRouter] = None) -> Optional[SearchFilters]:
+        """
+        Primera etapa: restringe `filters` a los ROUTING_TOP_DOCS documentos
+        cuyos centroides están más cerca de la consulta. Sin router, o si el
+        corpus no tiene más documentos que M, devuelve los filtros intactos.
+        """
+        router = router or self.router
+        if router is None or self.route_top_docs <= 0 or router.n_docs <= self.route_top_docs:
+            return filters
+        doc_ids = router.route(query_vector, self.route_top_docs, filters)
+        if not doc_ids:
+            return filters
+        return replace(filters or NO_FILTERS, doc_ids=doc_ids)
+
+    def search(self, query_vector: list, k: int = 4, filters: Optional[SearchFilters] = None):
+        raise NotImplementedError
+
+    def search_many(self, query_vectors: Sequence[list], k: int = 4,
+                    filters: Optional[Sequence[Optional[SearchFilters]]] = None) -> List[list]:
+        """Busca varias consultas; `filters` trae un filtro (o None) por consulta."""
+        filters = filters or [None] * len(query_vectors)
+        return [self.search(v, k=k, filters=f) for v, f in zip(query_vectors, filters)]
+
+    def get_chunks(self, chunk_ids: Iterable[str]) -> Dict[str, dict]:
+        """Chunks por chunk_id (vecinos para la expansión de contexto, rag/neighbors.py)."""
+        raise NotImplementedError
+
+    def retrieve(self, query: str, k: int = 4, filters: Optional[SearchFilters] = None):
+        """
+        Realiza búsqueda semántica y devuelve los chunks relevantes.
+
+        Args:
+            filters: Restringe la búsqueda por documento, tipo, título o vigencia.
+        """
+        # 1. Convertir la query a vector
+        query_vector = self.embed(query)
+
+        # 2. Buscar en el índice
+        return self.search(query_vector, k=k, filters=filters)
+
+
+class QdrantRetriever(_EmbeddingRetriever):
     """
     Cliente para recuperar chunks desde Qdrant usando embeddings.
     El modelo de embeddings se carga solo una vez.
+
+    `collection_name` puede ser un alias (rag.ingest publica cada versión como
+    "<alias>__<versión>" y mueve el alias): el retriever lo resuelve a la
+    colección concreta, de modo que una consulta usa una sola versión de
+    principio a fin.
     """
 
-    def __init__(self, collection_name="ufro_normativa"):
-        # Conectar a Qdrant
-        self.qdrant_client = QdrantClient(
+    def __init__(self, collection_name="ufro_normativa", qdrant_client=None, embedding_model=None):
+        """
+        Args:
+            collection_name: Colección o alias de Qdrant a consultar.
+            qdrant_client: Cliente ya creado (p. ej. QdrantClient(":memory:") en bench/).
+                Por defecto se conecta a QDRANT_HOST.
+            embedding_model: Modelo ya cargado. Por defecto all-MiniLM-L6-v2.
+        """
+        # Conectar a Qdrant. El cliente propio se crea por proceso (ver qdrant_client)
+        self._owns_client = qdrant_client is None
+        self._client = qdrant_client or self._connect()
+        self._client_pid = os.getpid()
+        self._client_lock = threading.Lock()
+        super().__init__(embedding_model)
+
+        self.collection_name = collection_name
+        self.refresh()
+        print(f"[Retriever] Conectado a Qdrant en colección '{self._generation.collection}'")
+
+    @staticmethod
+    def _connect() -> QdrantClient:
+        return QdrantClient(
             url=os.environ.get("QDRANT_HOST"),
             api_key=os.environ.get("QDRANT_API_KEY")
         )
 
-        # ⚡ Cargar el modelo de embeddings una sola vez
-        self.embedding_model = SentenceTransformer('all-MiniLM-L6-v2')
+    @property
+    def qdrant_client(self) -> QdrantClient:
+        """
+        Cliente de Qdrant del proceso actual. Con preload_app el maestro crea el
+        cliente y los workers lo heredan en el fork junto con las conexiones
+        abiertas de su pool httpx: dos procesos escribiendo en el mismo socket
+        mezclan respuestas. Igual que EmbeddingBatcher, si cambió el PID se crea
+        un cliente nuevo; el heredado no se cierra para no cortar las conexiones
+        del maestro. Un cliente pasado al constructor se usa tal cual.
+        """
+        pid = os.getpid()
+        if self._client_pid != pid and self._owns_client:
+            with self._client_lock:
+                if self._client_pid != pid:
+                    self._client = self._connect()
+                    self._client_pid = pid
+        return self._client
 
-        self.collection_name = collection_name
-        print(f"[Retriever] Conectado a Qdrant en colección '{self.collection_name}'")
+    def _current_source(self) -> str:
+        # "<colección>@r<n>" si rag/watch.py la modificó en el lugar: el
+        # router se recarga aunque el alias siga apuntando a la misma colección
+        collection = resolve_alias(self.qdrant_client, self.collection_name) or self.collection_name
+        revision = collection_revision(self.qdrant_client, collection)
+        return f"{collection}@r{revision}" if revision else collection
+
+    def _load_generation(self, source: str) -> IndexGeneration:
+        collection = source.split("@", 1)[0]
+        router = None
+        if self.route_top_docs > 0:
+            docs_collection = docs_collection_name(collection)
+            router = DocumentRouter.from_qdrant(self.qdrant_client, docs_collection)
+            if router is None:
+                print(f"[Retriever] Sin centroides en '{docs_collection}': búsqueda plana")
+            else:
+                print(f"[Retriever] Ruteo a {self.route_top_docs} de {router.n_docs} documentos")
+        version = (version_of(collection) or collection) + source[len(collection):]
+        return IndexGeneration(version, source, collection=collection, router=router)
 
-    def retrieve(self, query: str, k: int = 4):
+    def search(self, query_vector: list, k: int = 4, filters: Optional[SearchFilters] = None):
         """
-        Realiza búsqueda semántica en Qdrant y devuelve los chunks relevantes.
+        Busca en Qdrant los k chunks más cercanos a un vector ya calculado.
+
+        Con `filters`, Qdrant restringe la búsqueda usando los índices de payload
+        (doc_id, doc_type, title, vigencia_desde/hasta; ver rag.ingest).
         """
-        # 1. Convertir la query a vector
-        query_vector = self.embedding_model.encode(query).tolist()
-
-        # 2. Buscar en la colección de Qdrant
-        search_result = self.qdrant_client.search(
-            collection_name=self.collection_name,
-            query_vector=query_vector,
-            limit=k,
-            with_payload=True
-        )
+        with self._generation_in_use() as generation:
+            filters = self.route(query_vector, filters, generation.router)
+            QDRANT_REQUESTS.inc("search")
+            try:
+                search_result = self.qdrant_client.query_points(
+                    collection_name=generation.collection,
+                    query=query_vector,
+                    query_filter=filters.to_qdrant() if filters else None,
+                    limit=k,
+                    with_payload=True
+                ).points
+            except Exception:
+                QDRANT_ERRORS.inc("search")
+                raise
+        return self._format(search_result)
+
+    def search_many(self, query_vectors: Sequence[list], k: int = 4,
+                    filters: Optional[Sequence[Optional[SearchFilters]]] = None) -> List[list]:
+        """Todas las búsquedas en un solo request a Qdrant (query_batch_points)."""
+        if not query_vectors:
+            return []
+        filters = filters or [None] * len(query_vectors)
+        with self._generation_in_use() as generation:
+            requests = []
+            for vector, f in zip(query_vectors, filters):
+                f = self.route(vector, f, generation.router)
+                requests.append(models.QueryRequest(
+                    query=vector,
+                    filter=f.to_qdrant() if f else None,
+                    limit=k,
+                    with_payload=True,
+                ))
+            QDRANT_REQUESTS.inc("search_batch")
+            try:
+                responses = self.qdrant_client.query_batch_points(
+                    collection_name=generation.collection,
+                    requests=requests,
+                )
+            except Exception:
+                QDRANT_ERRORS.inc("search_batch")
+                raise
+        return [self._format(r.points) for r in responses]
 
-        # 3. Formatear resultados
+    def get_chunks(self, chunk_ids: Iterable[str]) -> Dict[str, dict]:
+        """Trae los chunks por el índice de payload `chunk_id` en un solo request."""
+        chunk_ids = list(chunk_ids)
+        if not chunk_ids:
+            return {}
+        with self._generation_in_use() as generation:
+            QDRANT_REQUESTS.inc("get_chunks")
+            try:
+                points, _ = self.qdrant_client.scroll(
+                    collection_name=generation.collection,
+                    scroll_filter=models.Filter(must=[
+                        models.FieldCondition(key="chunk_id", match=models.MatchAny(any=chunk_ids)),
+                    ]),
+                    limit=len(chunk_ids),
+                    with_payload=True,
+                    with_vectors=False,
+                )
+            except Exception:
+                QDRANT_ERRORS.inc("get_chunks")
+                raise
+        return {c["chunk_id"]: c for c in self._format(points)}
+
+    def health(self) -> dict:
+        """Verifica que el modelo esté cargado y que la colección responda."""
+        status = {"model_loaded": self.embedding_model is not None, "collection_reachable": False}
+        status.update(self.index_info())
+        try:
+            info = self.qdrant_client.get_collection(self._generation.collection)
+            status["collection_reachable"] = True
+            status["points_count"] = info.points_count
+        except Exception as e:
+            QDRANT_ERRORS.inc("health")
+            status["error"] = f"{type(e).__name__}: {e}"
+        return status
+
+    @staticmethod
+    def _format(search_result):
+        """Convierte los puntos de Qdrant en diccionarios de chunk."""
         retrieved_chunks = [
             {
                 "text": r.payload.get("text"),
-                "score": r.score,
+                # scroll (get_chunks) devuelve puntos sin score
+                "score": getattr(r, "score", None),
+                "chunk_id": r.payload.get("chunk_id"),
                 "doc_id": r.payload.get("doc_id"),
                 "title": r.payload.get("title"),
                 "page": r.payload.get("page"),
                 "url": r.payload.get("url"),
                 "vigencia": r.payload.get("vigencia"),
+                "prev_chunk_id": r.payload.get("prev_chunk_id"),
+                "next_chunk_id": r.payload.get("next_chunk_id"),
             }
             for r in search_result
         ]
@@ -59,12 +415,140 @@ class QdrantRetriever:
         return retrieved_chunks
 
 
-# ✅ Crear una sola instancia global del retriever
-retriever = QdrantRetriever()
+class FAISSRetriever(_EmbeddingRetriever):
+    """
+    Recupera chunks desde el índice FAISS generado por rag/embed.py
+    (index.faiss o el índice comprimido de --storage int8/binary, más
+    metadata.json), con la misma interfaz que QdrantRetriever.
 
+    `index_dir` puede contener el symlink `current` que publica rag/embed.py
+    (versions/<versión>/); si no, se usa el directorio tal cual.
+
+    Los filtros se resuelven sobre columnas numpy de los metadatos y se pasan
+    a FAISS como un IDSelector: solo se comparan los vectores seleccionados.
+    """
+
+    def __init__(self, index_dir="data/processed", embedding_model=None, filter_cache_size: int = 256):
+        import faiss
+
+        self._faiss = faiss
+        self.index_dir = Path(index_dir)
+        self.filter_cache_size = filter_cache_size
+
+        super().__init__(embedding_model)
+        self.collection_name = str(self.index_dir)
+        self.refresh()
+        print(f"[Retriever] Índice FAISS cargado desde '{self._generation.source}' ({self.index.ntotal} vectores)")
+
+    @property
+    def index(self):
+        return self._generation.index
+
+    def _current_source(self) -> str:
+        return str(resolve_index_dir(self.index_dir))
+
+    def _load_generation(self, source: str) -> IndexGeneration:
+        from rag.compact import CompactIndex
+
+        path = Path(source)
+        # Índice comprimido (int8 / binario, rag/compact.py) si existe; si no, el float32
+        index = CompactIndex.load(path) or self._faiss.read_index(str(path / "index.faiss"))
+        with (path / "metadata.json").open(encoding="utf-8") as f:
+            metadata = json.load(f)
+        if len(metadata) != index.ntotal:
+            raise ValueError(f"metadata.json tiene {len(metadata)} entradas y el índice {index.ntotal} vectores")
+
+        # Columnas de metadatos para resolver los filtros sin recorrer dicts.
+        # Los filtros se repiten mucho (el clasificador produce pocos distintos),
+        # así que los selectores se cachean; el cache muere con la versión.
+        columns = filter_columns(metadata)
+        selector = lru_cache(maxsize=self.filter_cache_size)(
+            lambda filters: self._build_selector(columns, filters)
+        )
+        router = DocumentRouter.load(path / "routing") if self.route_top_docs > 0 else None
+        return IndexGeneration(
+            path.name if path != self.index_dir else None, source,
+            index=index,
+            metadata=metadata,
+            # FlatIP se construye con vectores normalizados: la consulta también debe estarlo
+            normalize=index.metric_type == self._faiss.METRIC_INNER_PRODUCT,
+            rows={m["chunk_id"]: i for i, m in enumerate(metadata)},
+            selector=selector,
+            router=router,
+        )
+
+    def _build_selector(self, columns, filters: SearchFilters):
+        ids = np.flatnonzero(filters.mask(columns)).astype(np.int64)
+        selector = self._faiss.IDSelectorBatch(ids) if len(ids) else None
+        return ids, selector
+
+    def search(self, query_vector: list, k: int = 4, filters: Optional[SearchFilters] = None):
+        """Busca en FAISS los k chunks más cercanos, restringidos por `filters`."""
+        with self._generation_in_use() as generation:
+            q = np.asarray([query_vector], dtype=np.float32)
+            if generation.normalize:
+                self._faiss.normalize_L2(q)
+
+            filters = self.route(query_vector, filters, generation.router)
+            params = None
+            limit = generation.index.ntotal
+            if filters and not filters.is_empty():
+                ids, selector = generation.selector(filters)
+                if selector is None:
+                    return []
+                params = self._faiss.SearchParameters(sel=selector)
+                limit = len(ids)
+
+            distances, idx = generation.index.search(q, min(k, limit), params=params)
+            results = []
+            for dist, i in zip(distances[0], idx[0]):
+                if i < 0:
+                    continue
+                # Con L2 menor es mejor: se invierte el signo para que score más alto = más relevante
+                score = float(dist) if generation.normalize else -float(dist)
+                results.append({**generation.metadata[i], "score": score})
+        return self._format(results)
+
+    def get_chunks(self, chunk_ids: Iterable[str]) -> Dict[str, dict]:
+        """Chunks por chunk_id desde los metadatos en memoria."""
+        with self._generation_in_use() as generation:
+            rows = [generation.rows[c] for c in chunk_ids if c in generation.rows]
+            return {c["chunk_id"]: c for c in self._format([generation.metadata[i] for i in rows])}
+
+    def health(self) -> dict:
+        """El índice está en memoria: basta con verificar que tenga vectores."""
+        status = {
+            "model_loaded": self.embedding_model is not None,
+            "collection_reachable": self.index.ntotal > 0,
+            "points_count": self.index.ntotal,
+        }
+        status.update(self.index_info())
+        return status
+
+    @staticmethod
+    def _format(rows):
+        keys = ("text", "score", "chunk_id", "doc_id", "title", "page", "url", "vigencia",
+                "prev_chunk_id", "next_chunk_id")
+        return [{key: r.get(key) for key in keys} for r in rows]
+
+
+def retriever_from_env():
+    """
+    Crea el retriever configurado por entorno: RETRIEVER_BACKEND=qdrant (por
+    defecto) o faiss, con el índice en FAISS_INDEX_DIR (data/processed).
+    """
+    backend = os.environ.get("RETRIEVER_BACKEND", "qdrant").lower()
+    if backend == "faiss":
+        return FAISSRetriever(os.environ.get("FAISS_INDEX_DIR", "data/processed"))
+    if backend != "qdrant":
+        raise ValueError(f"RETRIEVER_BACKEND desconocido: {backend}")
+    return QdrantRetriever()
 
 if __name__ == "__main__":
-    # Test rápido en terminal
+    # Test rápido en terminal. No se crea una instancia global al importar el
+    # módulo: app.py / flask_app.py ya crean la suya y, con Gunicorn en modo
+    # preload, una segunda copia del modelo quedaría duplicada en cada worker.
+    retriever = QdrantRetriever()
     query = "¿Qué es el Periodo de Inactividad Académica (PIA)?"
     chunks = retriever.retrieve(query, k=3)
 
@@ -0,0 +1,130 @@
+# routing.py
+import json
+import os
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from rag.filters import SearchFilters, filter_columns
+
+# Páginas por sección: el corpus no trae estructura de capítulos, así que una
+# "sección" es una ventana de páginas consecutivas del mismo documento
+SECTION_PAGES = int(os.environ.get("ROUTING_SECTION_PAGES", 5))
+
+# Metadatos de documento que se copian a cada centroide (para filtrar el ruteo)
+DOC_FIELDS = ("doc_id", "title", "vigencia", "doc_type", "vigencia_desde", "vigencia_hasta")
+
+
+def _normalize(x: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(x, axis=1, keepdims=True)
+    return x / np.where(norms > 0, norms, 1)
+
+
+def build_centroids(records: List[dict], vectors: np.ndarray,
+                    section_pages: int = SECTION_PAGES) -> Tuple[np.ndarray, List[dict]]:
+    """
+    Vectores resumen del corpus: un centroide por documento y uno por sección
+    (ventana de `section_pages` páginas), promediando los chunks normalizados.
+
+    Returns:
+        (matriz float32 normalizada, etiquetas con doc_id, nivel y páginas)
+    """
+    unit = _normalize(np.asarray(vectors, dtype=np.float32))
+    groups: Dict[Tuple[str, str, int], List[int]] = {}
+    for i, r in enumerate(records):
+        groups.setdefault((r["doc_id"], "doc", 0), []).append(i)
+        if section_pages > 0:
+            section = (int(r["page"]) - 1) // section_pages
+            groups.setdefault((r["doc_id"], "section", section), []).append(i)
+
+    rows, labels = [], []
+    for (doc_id, level, section), idx in groups.items():
+        first = records[idx[0]]
+        label = {f: first.get(f) for f in DOC_FIELDS}
+        label["level"] = level
+        label["chunks"] = len(idx)
+        if level == "section":
+            label["first_page"] = section * section_pages + 1
+            label["last_page"] = (section + 1) * section_pages
+        rows.append(unit[idx].mean(axis=0))
+        labels.append(label)
+    matrix = _normalize(np.vstack(rows)) if rows else np.zeros((0, unit.shape[1]), dtype=np.float32)
+    return matrix.astype(np.float32), labels
+
+
+class DocumentRouter:
+    """
+    Índice de centroides en memoria (unos pocos KB por documento): elige los
+    M documentos más cercanos a la consulta antes de buscar entre los chunks.
+
+    El puntaje de un documento es la mejor similitud coseno entre su centroide
+    y los de sus secciones, así un documento largo no queda diluido por su promedio.
+    """
+
+    def __init__(self, vectors: np.ndarray, labels: List[dict]):
+        self.vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+        self.labels = labels
+        self.doc_ids, self._doc_of_row = np.unique(
+            np.array([l["doc_id"] for l in labels], dtype=str), return_inverse=True
+        )
+        self.columns = filter_columns(labels)
+
+    @property
+    def n_docs(self) -> int:
+        return len(self.doc_ids)
+
+    def route(self, query_vector: Sequence[float], m: int,
+              filters: Optional[SearchFilters] = None) -> Tuple[str, ...]:
+        """Devuelve los doc_id de los `m` documentos más cercanos que cumplen `filters`."""
+        q = np.asarray(query_vector, dtype=np.float32)
+        norm = np.linalg.norm(q)
+        scores = self.vectors @ (q / norm if norm > 0 else q)
+        if filters is not None and not filters.is_empty():
+            scores = np.where(filters.mask(self.columns), scores, -np.inf)
+
+        doc_scores = np.full(self.n_docs, -np.inf, dtype=np.float32)
+        np.maximum.at(doc_scores, self._doc_of_row, scores)
+        valid = np.flatnonzero(np.isfinite(doc_scores))
+        top = valid[np.argsort(-doc_scores[valid], kind="stable")[:m]]
+        return tuple(self.doc_ids[top].tolist())
+
+    def save(self, path: Path):
+        """Guarda los centroides (.npy) y sus etiquetas (.json) junto al índice FAISS."""
+        path = Path(path)
+        np.save(path.with_suffix(".npy"), self.vectors)
+        path.with_suffix(".json").write_text(json.dumps(self.labels, ensure_ascii=False), encoding="utf-8")
+
+    @classmethod
+    def load(cls, path: Path) -> Optional["DocumentRouter"]:
+        """Carga un router guardado con `save` (None si no existe)."""
+        path = Path(path)
+        if not path.with_suffix(".npy").exists():
+            return None
+        labels = json.loads(path.with_suffix(".json").read_text(encoding="utf-8"))
+        return cls(np.load(path.with_suffix(".npy")), labels)
+
+    @classmethod
+    def from_qdrant(cls, qdrant_client, collection_name: str) -> Optional["DocumentRouter"]:
+        """Lee todos los centroides de la colección `<colección>_docs` (None si no existe)."""
+        if not qdrant_client.collection_exists(collection_name):
+            return None
+        vectors, labels, offset = [], [], None
+        while True:
+            points, offset = qdrant_client.scroll(
+                collection_name=collection_name, limit=1024, offset=offset,
+                with_payload=True, with_vectors=True,
+            )
+            for p in points:
+                vectors.append(p.vector)
+                labels.append(p.payload)
+            if offset is None:
+                break
+        if not vectors:
+            return None
+        return cls(np.asarray(vectors, dtype=np.float32), labels)
+
+
+def docs_collection_name(collection_name: str) -> str:
+    """Colección de Qdrant con los centroides de `collection_name`."""
+    return f"{collection_name}_docs"
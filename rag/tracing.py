@@ -0,0 +1,248 @@
+# tracing.py
+"""
+Trazas livianas del pipeline RAG exportadas a JSONL.
+
+Cada ejecución de `RAGPipeline.run` abre una traza (span raíz `rag_pipeline`)
+con un span hijo por etapa. Los spans se guardan en memoria hasta que termina
+la traza y recién ahí se decide si se exportan (muestreo por cola):
+
+    - siempre si la traza duró más de TRACE_SLOW_MS o terminó con error,
+    - si no, con probabilidad TRACE_SAMPLE_RATE.
+
+El archivo (TRACE_FILE) rota por tamaño y tiene un span por línea; cada proceso
+escribe el suyo (`{pid}`), porque RotatingFileHandler no coordina la rotación
+entre workers de Gunicorn. El span raíz guarda `query`, `provider`, `k`, la hora
+de inicio, el motivo del muestreo y `sample_rate` (probabilidad con que se
+guardó), así que el log puede reproducirse con bench/loadgen.py.
+
+Variables de entorno:
+    TRACE_ENABLED       "0" desactiva las trazas (por defecto "1")
+    TRACE_FILE          Ruta del JSONL; admite {pid} (por defecto logs/traces.{pid}.jsonl)
+    TRACE_SLOW_MS       Umbral de request lento en ms (por defecto 3000)
+    TRACE_SAMPLE_RATE   Fracción de requests normales que se guardan (por defecto 0.01)
+    TRACE_MAX_BYTES     Tamaño máximo antes de rotar (por defecto 10 MB)
+    TRACE_BACKUP_COUNT  Archivos rotados que se conservan (por defecto 5)
+"""
+import glob
+import json
+import logging
+import os
+import random
+import time
+import uuid
+from contextlib import contextmanager
+from contextvars import ContextVar
+from logging.handlers import RotatingFileHandler
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+ROOT_SPAN_NAME = "rag_pipeline"
+
+_current_span: ContextVar[Optional["Span"]] = ContextVar("current_span", default=None)
+
+
+class Span:
+    """Una operación medida dentro de una traza."""
+    __slots__ = ("trace", "span_id", "parent_id", "name", "start", "_t0", "duration_ms",
+                 "attributes", "status")
+
+    def __init__(self, trace: "_Trace", name: str, parent_id: Optional[str], attributes: Dict[str, Any]):
+        self.trace = trace
+        self.span_id = uuid.uuid4().hex[:16]
+        self.parent_id = parent_id
+        self.name = name
+        self.start = time.time()
+        self._t0 = time.perf_counter()
+        self.duration_ms = 0.0
+        self.attributes = dict(attributes)
+        self.status = "ok"
+
+    @property
+    def trace_id(self) -> str:
+        return self.trace.trace_id
+
+    def set(self, **attributes: Any):
+        """Agrega atributos al span (k, scores, chunk_ids, ...)."""
+        self.attributes.update(attributes)
+
+    def _finish(self, error: Optional[BaseException] = None):
+        self.duration_ms = (time.perf_counter() - self._t0) * 1000
+        if error is not None:
+            self.status = "error"
+            self.attributes["error"] = f"{type(error).__name__}: {error}"
+            self.trace.error = True
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "trace_id": self.trace.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "name": self.name,
+            "start": self.start,
+            "duration_ms": round(self.duration_ms, 3),
+            "status": self.status,
+            "attributes": self.attributes,
+        }
+
+
+class _NoopSpan:
+    """Span vacío cuando las trazas están desactivadas."""
+    trace_id = None
+
+    def set(self, **attributes: Any):
+        pass
+
+
+_NOOP_SPAN = _NoopSpan()
+
+
+class _Trace:
+    """Spans de un request mientras se decide si se exportan."""
+    __slots__ = ("trace_id", "spans", "error")
+
+    def __init__(self):
+        self.trace_id = uuid.uuid4().hex
+        self.spans: List[Span] = []
+        self.error = False
+
+
+class JsonlSpanExporter:
+    """
+    Escribe spans como JSONL en un archivo que rota por tamaño.
+
+    El archivo se abre en el primer export del proceso: con Gunicorn en modo
+    preload el exporter se crea en el maestro, y `{pid}` en la ruta debe
+    resolverse con el PID de cada worker.
+    """
+
+    def __init__(self, path: str, max_bytes: int = 10 * 1024 * 1024, backup_count: int = 5):
+        self.path_template = path
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self._pid: Optional[int] = None
+        self._logger: Optional[logging.Logger] = None
+
+    def _ensure_logger(self) -> logging.Logger:
+        pid = os.getpid()
+        if self._logger is not None and self._pid == pid:
+            return self._logger
+        path = Path(self.path_template.format(pid=pid))
+        path.parent.mkdir(parents=True, exist_ok=True)
+        logger = logging.getLogger(f"rag.tracing.{path}")
+        logger.propagate = False
+        logger.setLevel(logging.INFO)
+        if not logger.handlers:
+            # RotatingFileHandler ya resuelve la rotación y el lock entre hilos
+            handler = RotatingFileHandler(path, maxBytes=self.max_bytes,
+                                          backupCount=self.backup_count, encoding="utf-8")
+            handler.setFormatter(logging.Formatter("%(message)s"))
+            logger.addHandler(handler)
+        self._pid, self._logger = pid, logger
+        return logger
+
+    def export(self, spans: List[Span]):
+        logger = self._ensure_logger()
+        for span in spans:
+            logger.info(json.dumps(span.to_dict(), ensure_ascii=False, default=str))
+
+
+class Tracer:
+    """Crea trazas y spans; aplica el muestreo por cola al cerrar la traza raíz."""
+
+    def __init__(self, exporter: Optional[JsonlSpanExporter], slow_ms: float = 3000.0,
+                 sample_rate: float = 0.01, enabled: bool = True):
+        self.exporter = exporter
+        self.slow_ms = slow_ms
+        self.sample_rate = sample_rate
+        self.enabled = enabled and exporter is not None
+
+    @contextmanager
+    def span(self, name: str, **attributes: Any):
+        """
+        Abre un span hijo del span actual. Si no hay una traza activa, abre una
+        nueva (el span pasa a ser la raíz).
+        """
+        if not self.enabled:
+            yield _NOOP_SPAN
+            return
+
+        parent = _current_span.get()
+        trace = parent.trace if parent is not None else _Trace()
+        span = Span(trace, name, parent.span_id if parent is not None else None, attributes)
+        token = _current_span.set(span)
+        error = None
+        try:
+            yield span
+        except BaseException as e:
+            error = e
+            raise
+        finally:
+            _current_span.reset(token)
+            span._finish(error)
+            trace.spans.append(span)
+            if parent is None:
+                self._end_trace(trace, span)
+
+    def _end_trace(self, trace: _Trace, root: Span):
+        keep = (
+            trace.error
+            or root.duration_ms >= self.slow_ms
+            or random.random() < self.sample_rate
+        )
+        if not keep:
+            return
+        reason = "error" if trace.error else "slow" if root.duration_ms >= self.slow_ms else "random"
+        root.attributes["sampled_reason"] = reason
+        # Los lentos y con error se guardan siempre: quien reproduzca el log
+        # debe filtrarlos o reponderarlos para no sobrerrepresentarlos
+        root.attributes["sample_rate"] = self.sample_rate if reason == "random" else 1.0
+        try:
+            self.exporter.export(trace.spans)
+        except Exception as e:
+            logging.getLogger(__name__).warning(f"No se pudo exportar la traza {trace.trace_id}: {e}")
+
+
+def current_trace_id() -> Optional[str]:
+    """trace_id de la traza activa en este contexto (o None)."""
+    span = _current_span.get()
+    return span.trace_id if span is not None else None
+
+
+def tracer_from_env() -> Tracer:
+    """Construye el Tracer según las variables de entorno TRACE_*."""
+    if os.environ.get("TRACE_ENABLED", "1") == "0":
+        return Tracer(None, enabled=False)
+    exporter = JsonlSpanExporter(
+        os.environ.get("TRACE_FILE", "logs/traces.{pid}.jsonl"),
+        max_bytes=int(os.environ.get("TRACE_MAX_BYTES", 10 * 1024 * 1024)),
+        backup_count=int(os.environ.get("TRACE_BACKUP_COUNT", 5)),
+    )
+    return Tracer(
+        exporter,
+        slow_ms=float(os.environ.get("TRACE_SLOW_MS", 3000)),
+        sample_rate=float(os.environ.get("TRACE_SAMPLE_RATE", 0.01)),
+    )
+
+
+def load_traces(path: str) -> List[Dict[str, Any]]:
+    """
+    Lee un JSONL de spans y devuelve los spans raíz ordenados por inicio, cada
+    uno con sus hijos en `children`. Pensado para reproducir el tráfico.
+
+    `path` puede ser un patrón glob (p. ej. "logs/traces.*.jsonl*") para
+    juntar los archivos de todos los workers y sus rotaciones.
+    """
+    paths = sorted(glob.glob(path)) or [path]
+    spans: List[Dict[str, Any]] = []
+    for file_path in paths:
+        with open(file_path, encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if line:
+                    spans.append(json.loads(line))
+
+    roots = {s["trace_id"]: dict(s, children=[]) for s in spans if s.get("parent_id") is None}
+    for s in spans:
+        if s.get("parent_id") is not None and s["trace_id"] in roots:
+            roots[s["trace_id"]]["children"].append(s)
+    return sorted(roots.values(), key=lambda r: r["start"])
@@ -0,0 +1,229 @@
+# versioning.py
+import os
+import shutil
+import threading
+import time
+from pathlib import Path
+from typing import Any, Optional
+
+from qdrant_client import QdrantClient, models
+
+# Cada ingesta escribe una versión nueva y después mueve un puntero:
+#   Qdrant: colección "<alias>__<versión>" + alias "<alias>" (cambio atómico)
+#   FAISS:  directorio "<base>/versions/<versión>" + symlink "<base>/current"
+# Así las consultas nunca ven una colección a medio cargar.
+VERSION_SEPARATOR = "__"
+CURRENT_LINK = "current"
+VERSIONS_DIR = "versions"
+
+
+def new_version(fingerprint: str) -> str:
+    """Nombre de versión: huella del corpus + marca de tiempo (ordenable)."""
+    return f"{fingerprint}-{time.strftime('%Y%m%d%H%M%S')}"
+
+
+def version_timestamp(version: str) -> str:
+    return version.rsplit("-", 1)[-1]
+
+
+def versioned_collection(alias: str, version: str) -> str:
+    return f"{alias}{VERSION_SEPARATOR}{version}"
+
+
+def version_of(collection_name: str) -> Optional[str]:
+    """Versión codificada en el nombre de la colección (None si no es versionada)."""
+    if VERSION_SEPARATOR not in collection_name:
+        return None
+    return collection_name.split(VERSION_SEPARATOR, 1)[1]
+
+
+# -------------------------------
+# Qdrant: colecciones versionadas + alias
+# -------------------------------
+def resolve_alias(qdrant_client: QdrantClient, alias: str) -> Optional[str]:
+    """Colección a la que apunta `alias` (None si no existe el alias)."""
+    for description in qdrant_client.get_aliases().aliases:
+        if description.alias_name == alias:
+            return description.collection_name
+    return None
+
+
+def flip_alias(qdrant_client: QdrantClient, alias: str, collection_name: str) -> Optional[str]:
+    """
+    Apunta `alias` a `collection_name` en una sola operación (borrar + crear
+    el alias se aplican juntas). Devuelve la colección anterior.
+
+    Si existe una colección real con el nombre del alias (ingestas anteriores
+    a las versiones), se borra justo antes: es la única vez que hay un corte.
+    """
+    previous = resolve_alias(qdrant_client, alias)
+    operations = []
+    if previous is not None:
+        operations.append(models.DeleteAliasOperation(delete_alias=models.DeleteAlias(alias_name=alias)))
+    elif qdrant_client.collection_exists(alias):
+        print(f"[Ingesta] La colección '{alias}' no es un alias: se elimina para migrar a versiones")
+        qdrant_client.delete_collection(alias)
+    operations.append(models.CreateAliasOperation(
+        create_alias=models.CreateAlias(collection_name=collection_name, alias_name=alias)
+    ))
+    qdrant_client.update_collection_aliases(change_aliases_operations=operations)
+    return previous
+
+
+def collection_revision(qdrant_client: QdrantClient, collection_name: str) -> int:
+    """
+    Revisión de una colección dentro de su versión: rag/watch.py la aumenta
+    cada vez que agrega, reemplaza o borra documentos en la colección activa.
+
+    Se guarda en la metadata de la colección, que existe desde Qdrant 1.16:
+    cliente y servidor deben ser 1.16 o superior.
+    """
+    if not qdrant_client.collection_exists(collection_name):
+        return 0
+    metadata = getattr(qdrant_client.get_collection(collection_name).config, "metadata", None) or {}
+    return int(metadata.get("revision", 0))
+
+
+def bump_revision(qdrant_client: QdrantClient, collection_name: str) -> int:
+    revision = collection_revision(qdrant_client, collection_name) + 1
+    qdrant_client.update_collection(collection_name, metadata={"revision": revision, "updated_at": time.time()})
+    return revision
+
+
+def prune_collections(qdrant_client: QdrantClient, alias: str, keep: int = 2, suffixes=("", "_docs")):
+    """
+    Borra las versiones más antiguas de `alias` y conserva las `keep` más
+    recientes (nunca la activa). La anterior se conserva por defecto: los
+    workers que aún no cambiaron de versión terminan sus consultas en ella.
+    """
+    active = resolve_alias(qdrant_client, alias)
+    prefix = f"{alias}{VERSION_SEPARATOR}"
+    names = {c.name for c in qdrant_client.get_collections().collections}
+    versions = sorted(
+        {n for n in names if n.startswith(prefix) and not n.endswith("_docs")},
+        key=lambda n: version_timestamp(version_of(n)),
+        reverse=True,
+    )
+    removed = []
+    for name in versions[max(keep, 1):]:
+        if name == active:
+            continue
+        for suffix in suffixes:
+            if name + suffix in names:
+                qdrant_client.delete_collection(name + suffix)
+                removed.append(name + suffix)
+    return removed
+
+
+# -------------------------------
+# FAISS: directorios versionados + symlink
+# -------------------------------
+def version_dir(base_dir: Path, version: str) -> Path:
+    return Path(base_dir) / VERSIONS_DIR / version
+
+
+def publish_index_dir(base_dir: Path, target: Path):
+    """
+    Cambia `<base>/current` para que apunte a `target`: se crea un symlink
+    temporal y se renombra encima del anterior (rename es atómico en POSIX).
+    """
+    base_dir = Path(base_dir)
+    link = base_dir / CURRENT_LINK
+    tmp = base_dir / f".{CURRENT_LINK}.{os.getpid()}.tmp"
+    if tmp.is_symlink() or tmp.exists():
+        tmp.unlink()
+    os.symlink(os.path.relpath(target, base_dir), tmp)
+    os.replace(tmp, link)
+
+
+def resolve_index_dir(base_dir: Path) -> Path:
+    """Directorio activo: destino de `<base>/current` o `base_dir` si no está versionado."""
+    base_dir = Path(base_dir)
+    link = base_dir / CURRENT_LINK
+    return link.resolve() if link.exists() else base_dir
+
+
+def prune_index_dirs(base_dir: Path, keep: int = 2):
+    """Borra los directorios de versiones más antiguos (nunca el activo)."""
+    versions_root = Path(base_dir) / VERSIONS_DIR
+    if not versions_root.exists():
+        return []
+    active = resolve_index_dir(base_dir)
+    dirs = sorted((d for d in versions_root.iterdir() if d.is_dir()),
+                  key=lambda d: version_timestamp(d.name), reverse=True)
+    removed = []
+    for d in dirs[max(keep, 1):]:
+        if d.resolve() != active:
+            shutil.rmtree(d)
+            removed.append(d)
+    return removed
+
+
+# -------------------------------
+# Generaciones del índice en el retriever
+# -------------------------------
+class IndexGeneration:
+    """
+    Una versión cargada del índice y lo que depende de ella (router, caches).
+
+    Cada consulta la toma con `acquire` y la suelta con `release`. Al cambiar
+    de versión, la anterior se retira: ya no acepta consultas nuevas y `drain`
+    espera a que terminen las que estaban en curso antes de liberarla. Si
+    `close` llega con consultas todavía en curso, los recursos los suelta la
+    última en llamar a `release`.
+    """
+
+    def __init__(self, version: Optional[str], source: str, **resources: Any):
+        self.version = version
+        self.source = source
+        self.resources = resources
+        self.loaded_at = time.time()
+        self._in_flight = 0
+        self._retired = False
+        self._closing = False
+        self._cond = threading.Condition()
+
+    def __getattr__(self, name):
+        try:
+            return self.__dict__["resources"][name]
+        except KeyError:
+            raise AttributeError(name)
+
+    def acquire(self) -> bool:
+        with self._cond:
+            if self._retired:
+                return False
+            self._in_flight += 1
+            return True
+
+    def release(self):
+        with self._cond:
+            self._in_flight -= 1
+            if self._in_flight == 0:
+                self._cond.notify_all()
+                if self._closing:
+                    self.resources.clear()
+
+    @property
+    def in_flight(self) -> int:
+        return self._in_flight
+
+    def retire(self):
+        with self._cond:
+            self._retired = True
+
+    def drain(self, timeout: Optional[float] = None) -> bool:
+        """Espera a que no queden consultas en curso; True si se vació a tiempo."""
+        with self._cond:
+            return self._cond.wait_for(lambda: self._in_flight == 0, timeout=timeout)
+
+    def close(self):
+        """
+        Suelta índice, memmaps y caches aunque alguien conserve la referencia.
+        Con consultas en curso se posterga hasta el último `release`: cerrar
+        antes les quitaría el índice a mitad de una búsqueda.
+        """
+        with self._cond:
+            self._closing = True
+            if self._in_flight == 0:
+                self.resources.clear()
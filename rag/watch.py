@@ -0,0 +1,341 @@
+# watch.py
+"""
+Indexación incremental de data/raw.
+
+Proceso de larga duración que revisa el directorio cada WATCH_POLL_S segundos
+(un solo `os.scandir` por ciclo, sin hilos ni inotify) y, cuando un archivo
+nuevo, modificado o eliminado lleva WATCH_DEBOUNCE_S segundos sin cambiar,
+actualiza solo esos documentos en la colección activa de Qdrant:
+
+    1. agrega a sources.csv las filas de los archivos nuevos (igual que
+       scripts/fill_sources_filenames.py; las filas existentes no se tocan),
+    2. extrae, divide en chunks y codifica solo los archivos del lote,
+    3. sobrescribe sus puntos (ids estables por chunk_id) y borra los que
+       sobran, y lo mismo con sus centroides en `<colección>_docs`,
+    4. aumenta la revisión de la colección para que los retrievers recarguen
+       el router (rag.versioning.collection_revision).
+
+Por cada lote informa la latencia desde que apareció el cambio en disco
+hasta que los chunks son buscables, desglosada por etapa.
+
+Uso:
+    python -m rag.watch --collection ufro_normativa
+
+Variables de entorno:
+    WATCH_POLL_S       Intervalo entre revisiones del directorio (por defecto 2)
+    WATCH_DEBOUNCE_S   Tiempo sin cambios antes de indexar un archivo (por defecto 3)
+    WATCH_MAX_DELAY_S  Espera máxima de un archivo listo mientras otros siguen
+                       cambiando (por defecto 30)
+"""
+import argparse
+import csv
+import os
+import time
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from dotenv import load_dotenv
+from qdrant_client import QdrantClient, models
+from sentence_transformers import SentenceTransformer
+
+from rag.ingest import (
+    build_records, centroid_points, encode_records, load_sources, point_id, upload_records,
+)
+from rag.routing import docs_collection_name
+from rag.versioning import bump_revision, resolve_alias
+from scripts.fill_sources_filenames import FIELDNAMES, generate_title, slugify
+
+load_dotenv()
+
+# Extensiones que build_records sabe leer (rag.ingest.extract_pages)
+SUPPORTED_EXTENSIONS = (".pdf", ".html", ".htm", ".txt", ".md")
+
+# (tamaño, mtime_ns) de un archivo; None = eliminado
+Signature = Optional[Tuple[int, int]]
+
+
+def scan(raw: Path) -> Dict[str, Tuple[int, int]]:
+    """Estado del directorio en un solo recorrido: nombre -> (tamaño, mtime_ns)."""
+    state = {}
+    with os.scandir(raw) as entries:
+        for entry in entries:
+            if entry.name.startswith(".") or not entry.name.lower().endswith(SUPPORTED_EXTENSIONS):
+                continue
+            if entry.is_file():
+                st = entry.stat()
+                state[entry.name] = (st.st_size, st.st_mtime_ns)
+    return state
+
+
+@dataclass
+class PendingChange:
+    signature: Signature
+    dropped_at: float      # cuándo apareció el cambio en disco (inicio de la latencia)
+    last_change: float     # última vez que se vio cambiar (para el debounce)
+
+
+class ChangeBatcher:
+    """
+    Acumula los cambios vistos en cada revisión y arma lotes.
+
+    Un archivo está listo cuando su firma no cambió durante `debounce`
+    segundos (una copia en curso sigue cambiando de tamaño). El lote sale
+    cuando todos los pendientes están listos, o cuando el más antiguo de los
+    listos ya esperó `max_delay` aunque otros sigan cambiando.
+    """
+
+    def __init__(self, indexed: Dict[str, Tuple[int, int]], debounce: float, max_delay: float):
+        self.indexed = dict(indexed)
+        self.debounce = debounce
+        self.max_delay = max_delay
+        self.pending: Dict[str, PendingChange] = {}
+        self._last_scan = time.time()
+
+    def observe(self, state: Dict[str, Tuple[int, int]], now: float):
+        for name in set(state) | set(self.indexed) | set(self.pending):
+            signature = state.get(name)
+            if signature == self.indexed.get(name):
+                self.pending.pop(name, None)  # volvió al estado indexado (p. ej. creado y borrado)
+                continue
+            change = self.pending.get(name)
+            if change is None:
+                self.pending[name] = PendingChange(signature, self._dropped_at(signature, now), now)
+            elif change.signature != signature:
+                change.signature = signature
+                change.last_change = now
+        self._last_scan = now
+
+    def _dropped_at(self, signature: Signature, now: float) -> float:
+        # El mtime es la hora real de escritura si cae entre esta revisión y la
+        # anterior; si no (p. ej. `cp -p` conserva el original), la de detección
+        if signature is not None and self._last_scan <= signature[1] / 1e9 <= now:
+            return signature[1] / 1e9
+        return now
+
+    def ready(self, now: float) -> Dict[str, PendingChange]:
+        stable = {n: c for n, c in self.pending.items() if now - c.last_change >= self.debounce}
+        if not stable:
+            return {}
+        if len(stable) == len(self.pending) or now - min(c.dropped_at for c in stable.values()) >= self.max_delay:
+            return stable
+        return {}
+
+    def done(self, batch: Dict[str, PendingChange]):
+        for name, change in batch.items():
+            if self.pending.get(name) is change:
+                del self.pending[name]
+            if change.signature is None:
+                self.indexed.pop(name, None)
+            else:
+                self.indexed[name] = change.signature
+
+
+def add_sources(sources_path: Path, filenames: List[str]) -> List[str]:
+    """Agrega a sources.csv una fila por archivo nuevo, como scripts/fill_sources_filenames.py."""
+    if not sources_path.exists() or sources_path.stat().st_size == 0:
+        with sources_path.open("w", encoding="utf-8", newline="") as f:
+            csv.DictWriter(f, fieldnames=FIELDNAMES).writeheader()
+    existing = load_sources(sources_path)
+    new_files = sorted(f for f in filenames if f not in existing)
+    if not new_files:
+        return []
+    with sources_path.open("rb") as f:
+        f.seek(-1, os.SEEK_END)
+        # data/sources.csv no termina en salto de línea: sin esto la fila nueva
+        # se pega a la última y ninguna de las dos se lee bien
+        needs_newline = f.read(1) not in (b"\n", b"\r")
+    with sources_path.open("a", encoding="utf-8", newline="") as f:
+        if needs_newline:
+            f.write("\r\n")
+        writer = csv.DictWriter(f, fieldnames=FIELDNAMES)
+        for filename in new_files:
+            writer.writerow({
+                "filename": filename,
+                # slugify solo quita ".pdf": con el stem, html/txt/md quedan igual de limpios
+                "doc_id": slugify(Path(filename).stem),
+                "title": generate_title(filename),
+                "url": "",
+                "vigencia": "",
+            })
+    return new_files
+
+
+def _match(field: str, values) -> models.FieldCondition:
+    return models.FieldCondition(key=field, match=models.MatchAny(any=list(values)))
+
+
+class IncrementalIndexer:
+    """Reemplaza o borra en la colección activa los chunks y centroides de unos pocos archivos."""
+
+    def __init__(self, qdrant_client: QdrantClient, alias: str, embedding_model, raw: Path, sources_path: Path,
+                 chunk_size: int = 900, overlap: int = 120):
+        self.qdrant_client = qdrant_client
+        self.alias = alias
+        self.embedding_model = embedding_model
+        self.raw = raw
+        self.sources_path = sources_path
+        self.chunk_size = chunk_size
+        self.overlap = overlap
+
+    @property
+    def collection(self) -> str:
+        """Colección activa (se resuelve en cada lote: una ingesta completa puede mover el alias)."""
+        collection = resolve_alias(self.qdrant_client, self.alias) or self.alias
+        if not self.qdrant_client.collection_exists(collection):
+            raise RuntimeError(f"La colección '{collection}' no existe: ejecute primero `python -m rag.ingest`")
+        return collection
+
+    def indexed_files(self) -> set:
+        """Nombres de archivo con chunks en la colección activa."""
+        names, offset = set(), None
+        while True:
+            points, offset = self.qdrant_client.scroll(
+                collection_name=self.collection, limit=1024, offset=offset,
+                with_payload=["filename"], with_vectors=False,
+            )
+            names.update(p.payload.get("filename") for p in points)
+            if offset is None:
+                return names - {None}
+
+    def _doc_ids(self, collection: str, filenames: List[str]) -> set:
+        """doc_id con que están indexados `filenames` (puede no coincidir con sources.csv actual)."""
+        points, _ = self.qdrant_client.scroll(
+            collection_name=collection,
+            scroll_filter=models.Filter(must=[_match("filename", filenames)]),
+            limit=10_000, with_payload=["doc_id"], with_vectors=False,
+        )
+        return {p.payload["doc_id"] for p in points}
+
+    def apply(self, changed: List[str], removed: List[str]) -> dict:
+        """
+        Indexa `changed` y borra `removed`. Primero se escriben los puntos
+        nuevos y después se borran los que sobran, así un documento
+        modificado nunca queda sin chunks durante la actualización.
+        """
+        collection = self.collection
+        docs_collection = docs_collection_name(collection)
+        timings = {}
+
+        t0 = time.perf_counter()
+        new_sources = add_sources(self.sources_path, changed)
+        records = build_records(self.raw, load_sources(self.sources_path), self.chunk_size, self.overlap,
+                                files=changed) if changed else []
+        timings["extract_s"] = time.perf_counter() - t0
+
+        t0 = time.perf_counter()
+        vectors = encode_records(records, self.embedding_model) if records else []
+        timings["encode_s"] = time.perf_counter() - t0
+
+        t0 = time.perf_counter()
+        affected = changed + removed
+        old_doc_ids = self._doc_ids(collection, affected)
+        keep_ids = [point_id(r["chunk_id"]) for r in records]
+        if records:
+            upload_records(self.qdrant_client, collection, records, self.embedding_model, vectors=vectors)
+        self.qdrant_client.delete(
+            collection_name=collection,
+            points_selector=models.FilterSelector(filter=models.Filter(
+                must=[_match("filename", affected)],
+                must_not=[models.HasIdCondition(has_id=keep_ids)],
+            )),
+            wait=True,
+        )
+
+        if self.qdrant_client.collection_exists(docs_collection):
+            points = centroid_points(records, vectors) if records else []
+            if points:
+                self.qdrant_client.upsert(collection_name=docs_collection, points=points, wait=True)
+            doc_ids = old_doc_ids | {r["doc_id"] for r in records}
+            if doc_ids:
+                self.qdrant_client.delete(
+                    collection_name=docs_collection,
+                    points_selector=models.FilterSelector(filter=models.Filter(
+                        must=[_match("doc_id", doc_ids)],
+                        must_not=[models.HasIdCondition(has_id=[p.id for p in points])],
+                    )),
+                    wait=True,
+                )
+        revision = bump_revision(self.qdrant_client, collection)
+        timings["upload_s"] = time.perf_counter() - t0
+
+        return {"collection": collection, "revision": revision, "chunks": len(records),
+                "new_sources": new_sources, **timings}
+
+
+def watch(indexer: IncrementalIndexer, poll: float, debounce: float, max_delay: float, once: bool = False):
+    """
+    Bucle principal. Al iniciar compara data/raw con los archivos que tiene la
+    colección: los que faltan se indexan y los que ya no están se borran (los
+    modificados mientras el watcher estaba detenido requieren `rag.ingest`).
+    Con `once` procesa esas diferencias sin esperar y termina.
+    """
+    state = scan(indexer.raw)
+    indexed = {name: state.get(name, (0, 0)) for name in indexer.indexed_files()}
+    batcher = ChangeBatcher(indexed, 0 if once else debounce, max_delay)
+    print(f"[Watch] Vigilando '{indexer.raw}' ({len(state)} archivos, {len(indexed)} indexados) "
+          f"cada {poll:g} s, debounce {debounce:g} s")
+
+    batches = 0
+    while True:
+        now = time.time()
+        batcher.observe(scan(indexer.raw), now)
+        batch = batcher.ready(now)
+        if batch:
+            changed = sorted(n for n, c in batch.items() if c.signature is not None)
+            removed = sorted(n for n, c in batch.items() if c.signature is None)
+            try:
+                stats = indexer.apply(changed, removed)
+            except Exception as e:
+                print(f"[Watch] Error indexando {changed + removed}: {type(e).__name__}: {e}")
+                for change in batch.values():
+                    change.last_change = time.time()  # reintentar tras otro debounce
+            else:
+                batcher.done(batch)
+                batches += 1
+                searchable_at = time.time()
+                latencies = [searchable_at - c.dropped_at for c in batch.values()]
+                waited = now - min(c.dropped_at for c in batch.values())
+                for filename in stats["new_sources"]:
+                    print(f"[Watch] Añadido a sources.csv: {filename}")
+                print(f"[Watch] Lote {batches}: {len(changed)} nuevos/modificados, {len(removed)} eliminados, "
+                      f"{stats['chunks']} chunks -> '{stats['collection']}' (revisión {stats['revision']})")
+                print(f"[Watch]   caída -> buscable: máx {max(latencies):.2f} s, "
+                      f"media {sum(latencies) / len(latencies):.2f} s | espera {waited:.2f} s, "
+                      f"extracción {stats['extract_s']:.2f} s, embeddings {stats['encode_s']:.2f} s, "
+                      f"Qdrant {stats['upload_s']:.2f} s")
+        if once and not batcher.pending:
+            return batches
+        time.sleep(poll)
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Indexación incremental de data/raw en la colección activa")
+    ap.add_argument("--raw", default="data/raw")
+    ap.add_argument("--sources", default="data/sources.csv")
+    ap.add_argument("--collection", default="ufro_normativa", help="Alias (o colección) a actualizar")
+    ap.add_argument("--chunk-size", type=int, default=900)
+    ap.add_argument("--overlap", type=int, default=120)
+    ap.add_argument("--poll", type=float, default=float(os.environ.get("WATCH_POLL_S", 2)))
+    ap.add_argument("--debounce", type=float, default=float(os.environ.get("WATCH_DEBOUNCE_S", 3)))
+    ap.add_argument("--max-delay", type=float, default=float(os.environ.get("WATCH_MAX_DELAY_S", 30)))
+    ap.add_argument("--once", action="store_true",
+                    help="Sincronizar las diferencias actuales con la colección y terminar")
+    args = ap.parse_args()
+
+    qdrant_client = QdrantClient(
+        url=os.environ.get("QDRANT_HOST"),
+        api_key=os.environ.get("QDRANT_API_KEY")
+    )
+    indexer = IncrementalIndexer(
+        qdrant_client, args.collection, SentenceTransformer('all-MiniLM-L6-v2'),
+        Path(args.raw), Path(args.sources), args.chunk_size, args.overlap,
+    )
+    try:
+        watch(indexer, args.poll, args.debounce, args.max_delay, once=args.once)
+    except KeyboardInterrupt:
+        print("[Watch] Detenido")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+"""
+Reporta la memoria del maestro de Gunicorn y de cada worker.
+
+Lee /proc/<pid>/smaps_rollup (Linux) para mostrar:
+    - RSS:     memoria residente total del proceso
+    - PSS:     RSS repartiendo las páginas compartidas entre quienes las usan
+    - Shared:  páginas compartidas (p. ej. el modelo heredado del maestro)
+    - Private: páginas propias del proceso
+
+La suma de PSS es el consumo real del despliegue; RSS sobrestima porque cuenta
+las páginas compartidas en cada worker.
+
+Uso:
+    python scripts/worker_memory.py <pid_maestro>
+"""
+import sys
+from pathlib import Path
+
+
+def read_rollup(pid: int) -> dict:
+    """Devuelve los campos de smaps_rollup (en kB) para un PID."""
+    fields = {}
+    for line in Path(f"/proc/{pid}/smaps_rollup").read_text().splitlines()[1:]:
+        parts = line.split()
+        if len(parts) >= 2 and parts[1].isdigit():
+            fields[parts[0].rstrip(":")] = int(parts[1])
+    return fields
+
+
+def children_of(pid: int) -> list:
+    """Lista los PIDs hijos directos de un proceso."""
+    children = []
+    for task in Path(f"/proc/{pid}/task").iterdir():
+        child_file = task / "children"
+        if child_file.exists():
+            children.extend(int(c) for c in child_file.read_text().split())
+    return children
+
+
+def main():
+    if len(sys.argv) != 2:
+        print(__doc__)
+        sys.exit(1)
+
+    master = int(sys.argv[1])
+    pids = [("maestro", master)] + [("worker", c) for c in children_of(master)]
+
+    print(f"{'rol':<8} {'pid':>7} {'RSS MB':>9} {'PSS MB':>9} {'Shared MB':>10} {'Private MB':>11}")
+    total_pss = 0
+    for role, pid in pids:
+        r = read_rollup(pid)
+        shared = r.get("Shared_Clean", 0) + r.get("Shared_Dirty", 0)
+        private = r.get("Private_Clean", 0) + r.get("Private_Dirty", 0)
+        total_pss += r.get("Pss", 0)
+        print(f"{role:<8} {pid:>7} {r.get('Rss', 0) / 1024:>9.1f} {r.get('Pss', 0) / 1024:>9.1f} "
+              f"{shared / 1024:>10.1f} {private / 1024:>11.1f}")
+
+    print(f"\nPSS total ({len(pids) - 1} workers + maestro): {total_pss / 1024:.1f} MB")
+
+
+if __name__ == "__main__":
+    main()
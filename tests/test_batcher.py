@@ -0,0 +1,45 @@
+import threading
+import time
+
+import numpy as np
+
+from rag.batcher import EmbeddingBatcher
+
+
+class _CountingModel:
+    """Modelo falso que registra el tamaño de cada lote."""
+
+    def __init__(self):
+        self.batch_sizes = []
+
+    def encode(self, texts, **kwargs):
+        self.batch_sizes.append(len(texts))
+        return np.zeros((len(texts), 4), dtype=np.float32)
+
+
+def test_submits_a_few_ms_apart_share_a_batch():
+    model = _CountingModel()
+    batcher = EmbeddingBatcher(model, max_wait_ms=200, max_batch_size=8)
+
+    first = batcher.submit("¿Qué es el PIA?")
+    time.sleep(0.005)
+    second = batcher.submit("¿Cuándo empieza el semestre?")
+
+    assert first.result(timeout=5).shape == (4,)
+    assert second.result(timeout=5).shape == (4,)
+    assert model.batch_sizes == [2]
+
+
+def test_batch_closes_at_max_batch_size():
+    model = _CountingModel()
+    batcher = EmbeddingBatcher(model, max_wait_ms=10_000, max_batch_size=3)
+
+    threads = [threading.Thread(target=batcher.encode, args=(f"q{i}",)) for i in range(3)]
+    start = time.monotonic()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join(timeout=5)
+
+    assert model.batch_sizes == [3]
+    assert time.monotonic() - start < 5
@@ -0,0 +1,46 @@
+from collections import Counter
+
+from rag.neighbors import NEXT_FIELD, PREV_FIELD, expand_context
+
+
+def _document(n_chunks, words_per_chunk=10):
+    """Chunks c0..cN de un mismo documento, sin solapamiento y con palabras únicas."""
+    chunks = {}
+    for i in range(n_chunks):
+        chunks[f"c{i}"] = {
+            "chunk_id": f"c{i}",
+            "text": " ".join(f"w{i}_{j}" for j in range(words_per_chunk)),
+            "page": 1,
+            PREV_FIELD: f"c{i - 1}" if i > 0 else None,
+            NEXT_FIELD: f"c{i + 1}" if i < n_chunks - 1 else None,
+        }
+    return chunks
+
+
+def _fetch(chunks):
+    return lambda ids: {c: chunks[c] for c in ids if c in chunks}
+
+
+def test_middle_chunk_is_consumed_by_only_one_passage():
+    chunks = _document(5)
+    hits = [{**chunks["c1"], "score": 0.9}, {**chunks["c3"], "score": 0.8}]
+
+    # 20 palabras de hits + 12 para vecinos: c2 entra solo en parte por cualquier lado
+    for budget in (28, 32, 36):
+        passages = expand_context(hits, _fetch(chunks), budget)
+        words = [w for p in passages for w in p["text"].split()]
+
+        assert len(words) <= budget
+        assert not [w for w, n in Counter(words).items() if n > 1]
+        middle = [i for i, p in enumerate(passages) if any(w.startswith("w2_") for w in p["text"].split())]
+        assert len(middle) <= 1
+
+
+def test_middle_chunk_fully_consumed_is_not_repeated():
+    chunks = _document(5)
+    hits = [{**chunks["c1"], "score": 0.9}, {**chunks["c3"], "score": 0.8}]
+
+    passages = expand_context(hits, _fetch(chunks), 1000)
+    words = [w for p in passages for w in p["text"].split()]
+
+    assert sorted(words) == sorted(w for c in chunks.values() for w in c["text"].split())
@@ -0,0 +1,37 @@
+import csv
+
+from eval.retrieval_eval import load_gold_set, write_rows
+
+
+def test_write_rows_uses_columns_from_every_row(tmp_path):
+    rows = [
+        {"index": "FlatIP", "recall@5": 0.5},
+        {"index": "FlatIP+ruteo2", "recall@5": 0.4, "routing_recall": 0.9},
+    ]
+    out = tmp_path / "sweep.csv"
+    write_rows(out, rows)
+
+    with out.open(encoding="utf-8", newline="") as f:
+        reader = csv.DictReader(f)
+        assert reader.fieldnames == ["index", "recall@5", "routing_recall"]
+        assert [r["routing_recall"] for r in reader] == ["", "0.9"]
+
+
+def test_write_rows_skips_empty_grid(tmp_path):
+    out = tmp_path / "sweep.csv"
+    write_rows(out, [])
+    assert not out.exists()
+
+
+def test_load_gold_set_keeps_commas_in_ground_truth(tmp_path):
+    gold = tmp_path / "gold_set.csv"
+    gold.write_text(
+        "ID,query,ground_truth,source_file\n"
+        'C-01,"¿Cuándo empieza el semestre?",En marzo, según el calendario, sección 2.,'
+        "CALENDARIO ACADÉMICO 2025, PREGRADO.pdf\n",
+        encoding="utf-8",
+    )
+    rows = load_gold_set(gold, ["CALENDARIO ACADÉMICO 2025, PREGRADO.pdf"])
+
+    assert rows[0]["ground_truth"] == "En marzo, según el calendario, sección 2."
+    assert rows[0]["source_file"] == "CALENDARIO ACADÉMICO 2025, PREGRADO.pdf"
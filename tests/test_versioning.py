@@ -0,0 +1,56 @@
+import threading
+import time
+
+from bench.fakes import HashingEncoder
+from rag.retrieve import _EmbeddingRetriever
+from rag.versioning import IndexGeneration
+
+
+def test_close_waits_for_last_release():
+    generation = IndexGeneration("v1", "v1", index=object())
+    assert generation.acquire()
+    generation.retire()
+
+    # El drain venció con una consulta en curso: el índice sigue disponible para ella
+    assert not generation.drain(timeout=0.01)
+    generation.close()
+    assert generation.index is not None
+
+    generation.release()
+    assert "index" not in generation.resources
+
+
+def test_close_without_queries_in_flight_is_immediate():
+    generation = IndexGeneration("v1", "v1", index=object())
+    generation.close()
+    assert generation.resources == {}
+
+
+class _StubRetriever(_EmbeddingRetriever):
+    def __init__(self, first: IndexGeneration):
+        super().__init__(HashingEncoder())
+        self.refresh_interval = 0
+        self._generation = first
+
+
+def test_query_on_retired_generation_waits_for_the_new_one():
+    old = IndexGeneration("v1", "v1")
+    new = IndexGeneration("v2", "v2")
+    retriever = _StubRetriever(old)
+    # Caso extremo: la versión activa ya está retirada y el puntero aún no cambia
+    old.retire()
+
+    seen = []
+
+    def query():
+        with retriever._generation_in_use() as generation:
+            seen.append(generation.version)
+
+    thread = threading.Thread(target=query)
+    thread.start()
+    time.sleep(0.05)
+    assert thread.is_alive() and not seen
+
+    retriever._install(new)
+    thread.join(timeout=5)
+    assert seen == ["v2"]
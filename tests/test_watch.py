@@ -0,0 +1,26 @@
+from rag.ingest import load_sources
+from rag.watch import add_sources
+
+
+def test_add_sources_without_trailing_newline(tmp_path):
+    # Igual que data/sources.csv: la última fila no termina en salto de línea
+    sources = tmp_path / "sources.csv"
+    sources.write_text(
+        "filename,doc_id,title,url,vigencia\n"
+        'reglamento.pdf,reglamento,Reglamento,https://ufro.cl/r.pdf,"Desde septiembre de 2022"',
+        encoding="utf-8",
+    )
+
+    assert add_sources(sources, ["nuevo_reglamento.txt", "reglamento.pdf"]) == ["nuevo_reglamento.txt"]
+
+    rows = load_sources(sources)
+    assert set(rows) == {"reglamento.pdf", "nuevo_reglamento.txt"}
+    assert rows["reglamento.pdf"]["vigencia"] == "Desde septiembre de 2022"
+    assert rows["nuevo_reglamento.txt"]["doc_id"] == "nuevo-reglamento"
+
+
+def test_add_sources_creates_file(tmp_path):
+    sources = tmp_path / "sources.csv"
+    assert add_sources(sources, ["a.md"]) == ["a.md"]
+    assert add_sources(sources, ["a.md"]) == []
+    assert list(load_sources(sources)) == ["a.md"]
@@ -0,0 +1,15 @@
+# wsgi.py
+"""
+Punto de entrada WSGI para producción (Gunicorn).
+
+Importar `flask_app` carga el modelo de embeddings, el cliente de Qdrant y los
+proveedores LLM. Con `preload_app = True` (ver gunicorn.conf.py) esto ocurre una
+sola vez en el proceso maestro y los workers comparten esas páginas de memoria
+copy-on-write después del fork.
+
+Uso:
+    gunicorn -c gunicorn.conf.py wsgi:app
+"""
+from flask_app import app
+
+__all__ = ["app"]